@@ -0,0 +1,77 @@
+"""
+bench_cache.py: Decoding a trace where most payloads repeat exactly (periodic
+beacons), without a cache, with a cache returning shared frozen packets and
+with a cache returning copies.
+
+    PYTHONPATH=. python benchmarks/bench_cache.py [packets] [distinct]
+"""
+
+from __future__ import print_function
+
+import random
+import sys
+import time
+
+from serdepa import SerdepaPacket, Length, List, nx_uint8, nx_uint16, nx_int16, nx_uint32
+from serdepa.serdepa import DecodeCache
+
+
+class Node(SerdepaPacket):
+    _fields_ = [
+        ("nodeId", nx_uint16),
+        ("attr", nx_int16),
+        ("inQlty", nx_uint8),
+        ("outQlty", nx_uint8),
+        ("qlty", nx_uint8),
+        ("lifetime", nx_uint8)
+    ]
+
+
+class Beacon(SerdepaPacket):
+    _fields_ = [
+        ("source", nx_uint32),
+        ("count", Length(nx_uint8, "nodes")),
+        ("nodes", List(Node))
+    ]
+
+
+def trace(count, distinct, seed=1):
+    rng = random.Random(seed)
+    payloads = []
+    for i in range(distinct):
+        beacon = Beacon(source=i)
+        for j in range(rng.randint(1, 8)):
+            beacon.nodes.append(Node(nodeId=j, attr=-j, qlty=rng.randint(0, 255)))
+        payloads.append(beacon.serialize())
+    return [rng.choice(payloads) for _ in range(count)]
+
+
+def plain(frames):
+    for frame in frames:
+        packet = Beacon()
+        packet.deserialize(frame)
+
+
+def cached(copy):
+    def run(frames):
+        cache = DecodeCache(Beacon, maxsize=256, copy=copy)
+        for frame in frames:
+            cache.decode(frame)
+        return cache.stats
+    return run
+
+
+def measure(name, loop, frames):
+    start = time.perf_counter()
+    stats = loop(frames)
+    elapsed = time.perf_counter() - start
+    print("{:8} {:8.3f} s {:10.0f} packets/s {}".format(name, elapsed, len(frames) / elapsed, stats or ""))
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50000
+    distinct = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    frames = trace(count, distinct)
+    measure("plain", plain, frames)
+    measure("frozen", cached(False), frames)
+    measure("copy", cached(True), frames)
@@ -0,0 +1,46 @@
+"""
+bench_equivalence.py: Checks the fast codecs against serialize() and
+deserialize() on random packet layouts and prints the speedup of the fast
+paths per layout, or the mismatches found.
+
+    PYTHONPATH=. python benchmarks/bench_equivalence.py [layouts] [first seed] [records]
+"""
+
+from __future__ import print_function
+
+import sys
+
+from serdepa.equivalence import describe, run
+
+
+def main(layouts, first, records):
+    failed = 0
+    totals = {}
+    for report in run(range(first, first + layouts), records=records):
+        print("{:6} {:5} B  {}".format(report.seed, report.size, describe(report.packet_class)))
+        for mismatch in report.mismatches:
+            print("         MISMATCH {}: {}".format(mismatch.codec, mismatch.detail))
+        if report.mismatches:
+            failed += 1
+            continue
+        print("         {}".format("  ".join(
+            "{} {:7.2f} us -> {:6.2f} us x{:5.1f}".format(
+                name, timing.reference * 1e6, timing.fast * 1e6, timing.reference / timing.fast
+            ) for name, timing in report.timings.items()
+        )))
+        for name, timing in report.timings.items():
+            totals.setdefault(name, []).append(timing.reference / timing.fast)
+    print()
+    for name, speedups in sorted(totals.items()):
+        speedups.sort()
+        print("{:9} speedup over {} layouts: min x{:.1f}, median x{:.1f}, max x{:.1f}".format(
+            name, len(speedups), speedups[0], speedups[len(speedups) // 2], speedups[-1]
+        ))
+    print("{} of {} layouts with mismatches".format(failed, layouts))
+    return failed
+
+
+if __name__ == '__main__':
+    args = [int(arg) for arg in sys.argv[1:]]
+    layouts, first, records = (args + [50, 0, 100][len(args):])[:3]
+    sys.exit(1 if main(layouts, first, records) else 0)
@@ -0,0 +1,83 @@
+"""
+bench_import.py: Time to import a protocol module with many packet classes
+and to use one of them, with classes compiled at definition and with
+_lazy_ = True.
+
+    PYTHONPATH=. python benchmarks/bench_import.py [classes]
+"""
+
+from __future__ import print_function
+
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import tempfile
+
+TEMPLATE = """
+from serdepa import SerdepaPacket, Length, List, Array, nx_uint8, nx_uint16, nx_int32, uint32
+
+
+class Base(SerdepaPacket):
+    _lazy_ = {lazy}
+
+
+class Point(Base):
+    _fields_ = [
+        ("x", nx_int32),
+        ("y", nx_int32),
+    ]
+"""
+
+PACKET = """
+
+class Packet{i}(Base):
+    _fields_ = [
+        ("header", nx_uint8),
+        ("seq", nx_uint16),
+        ("stamp", uint32),
+        ("origin", Point),
+        ("flags", Array(nx_uint8, 4)),
+        ("count", Length(nx_uint8, "points")),
+        ("points", List(Point)),
+    ]
+"""
+
+RUN = """
+import time
+start = time.perf_counter()
+import protocol
+imported = time.perf_counter()
+packet = protocol.Packet0()
+packet.deserialize(bytes(bytearray(19)) + b"\\x01" + bytes(bytearray(8)))
+used = time.perf_counter()
+print(imported - start, used - imported)
+"""
+
+
+def measure(directory, lazy, classes, runs=5):
+    with open(os.path.join(directory, "protocol.py"), "w") as f:
+        f.write(TEMPLATE.format(lazy=lazy))
+        for i in range(classes):
+            f.write(PACKET.format(i=i))
+    py_compile.compile(os.path.join(directory, "protocol.py"), doraise=True)
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join([directory, os.getcwd()]))
+    results = []
+    for _ in range(runs):
+        out = subprocess.check_output([sys.executable, "-c", "import serdepa\n" + RUN], env=env)
+        results.append(tuple(float(value) for value in out.split()))
+    imported, used = min(results)
+    print("{:6} import {:8.2f} ms, first use {:6.2f} ms".format(
+        "lazy" if lazy else "eager", imported * 1000, used * 1000
+    ))
+
+
+if __name__ == '__main__':
+    classes = int(sys.argv[1]) if len(sys.argv) > 1 else 500
+    directory = tempfile.mkdtemp()
+    try:
+        measure(directory, False, classes)
+        measure(directory, True, classes)
+    finally:
+        shutil.rmtree(directory)
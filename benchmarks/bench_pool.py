@@ -0,0 +1,93 @@
+"""
+bench_pool.py: GC pauses of a long running receive loop, decoding into fresh
+packets versus decoding into pooled packets.
+
+    PYTHONPATH=. python benchmarks/bench_pool.py [packets]
+"""
+
+from __future__ import print_function
+
+import gc
+import sys
+import time
+from codecs import decode
+
+from serdepa import SerdepaPacket, Length, List, nx_uint8, nx_uint16, nx_int16, nx_uint32
+
+
+class Node(SerdepaPacket):
+    _fields_ = [
+        ("nodeId", nx_uint16),
+        ("attr", nx_int16),
+        ("inQlty", nx_uint8),
+        ("outQlty", nx_uint8),
+        ("qlty", nx_uint8),
+        ("lifetime", nx_uint8)
+    ]
+
+
+class Beat(SerdepaPacket):
+    _fields_ = [
+        ("clockstamp", nx_uint32),
+        ("count", Length(nx_uint8, "nodes")),
+        ("nodes", List(Node))
+    ]
+
+
+FRAME = decode("1DD26640" "07" + "022B0139FFFF0003" * 7, "hex")
+
+
+class GCTimer(object):
+
+    def __init__(self):
+        self.pauses = []
+        self._start = None
+
+    def __call__(self, phase, info):
+        if phase == "start":
+            self._start = time.perf_counter()
+        else:
+            self.pauses.append(time.perf_counter() - self._start)
+
+
+def fresh_loop(count):
+    kept = []
+    for i in range(count):
+        packet = Beat()
+        packet.deserialize(FRAME)
+        kept.append(packet)
+        if len(kept) > 64:     # some packets live a little while in the application
+            del kept[:32]
+
+
+def pooled_loop(count):
+    pool = Beat.pool(maxsize=128)
+    kept = []
+    for i in range(count):
+        kept.append(pool.decode(FRAME))
+        if len(kept) > 64:
+            for packet in kept[:32]:
+                pool.release(packet)
+            del kept[:32]
+
+
+def run(name, loop, count):
+    gc.collect()
+    timer = GCTimer()
+    gc.callbacks.append(timer)
+    try:
+        start = time.perf_counter()
+        loop(count)
+        elapsed = time.perf_counter() - start
+    finally:
+        gc.callbacks.remove(timer)
+    pauses = timer.pauses or [0.0]
+    print("{:8} {:8.3f} s {:6} collections, total pause {:8.2f} ms, max pause {:6.3f} ms".format(
+        name, elapsed, len(timer.pauses), sum(pauses) * 1000, max(pauses) * 1000
+    ))
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    run("fresh", fresh_loop, count)
+    run("pooled", pooled_loop, count)
@@ -0,0 +1,87 @@
+"""
+aiopipeline.py: asyncio support for DecodePipeline, see
+DecodePipeline.map_async and DecodePipeline.decode_async. Needs Python 3.6+.
+"""
+
+import asyncio
+import collections
+
+from .exceptions import DeserializeError
+
+
+__author__ = "Raido Pahtma, Kaarel Ratas"
+__license__ = "MIT"
+
+
+async def _batches(frames, size):
+    batch = []
+    if hasattr(frames, "__aiter__"):
+        async for frame in frames:
+            batch.append(frame)
+            if len(batch) == size:
+                yield batch
+                batch = []
+    else:
+        for frame in frames:
+            batch.append(frame)
+            if len(batch) == size:
+                yield batch
+                batch = []
+    if batch:
+        yield batch
+
+
+async def _acquire(slots):
+    """
+    Acquires a threading semaphore without blocking the event loop.
+    """
+    if slots.acquire(blocking=False):
+        return
+    acquired = asyncio.get_event_loop().run_in_executor(None, slots.acquire)
+    try:
+        await asyncio.shield(acquired)
+    except asyncio.CancelledError:
+        # the thread still gets the slot, give it back
+        acquired.add_done_callback(lambda f: slots.release())
+        raise
+
+
+async def decode_async(pipeline, frame):
+    await _acquire(pipeline._slots)
+    try:
+        future = pipeline._submit([frame])
+    except BaseException:
+        pipeline._slots.release()
+        raise
+    future.add_done_callback(lambda f: pipeline._slots.release())
+    result = (await asyncio.wrap_future(future))[0]
+    if isinstance(result, DeserializeError):
+        raise result
+    return result
+
+
+async def map_async(pipeline, frames):
+    if pipeline.ordered:
+        futures = collections.deque()
+        async for batch in _batches(frames, pipeline.batch_size):
+            futures.append(asyncio.wrap_future(pipeline._submit(batch)))
+            while len(futures) >= pipeline.max_pending or (futures and futures[0].done()):
+                for packet in pipeline._packets(await futures.popleft()):
+                    yield packet
+        while futures:
+            for packet in pipeline._packets(await futures.popleft()):
+                yield packet
+    else:
+        futures = set()
+        async for batch in _batches(frames, pipeline.batch_size):
+            futures.add(asyncio.wrap_future(pipeline._submit(batch)))
+            if len(futures) >= pipeline.max_pending:
+                done, futures = await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
+                for future in done:
+                    for packet in pipeline._packets(future.result()):
+                        yield packet
+        while futures:
+            done, futures = await asyncio.wait(futures, return_when=asyncio.FIRST_COMPLETED)
+            for future in done:
+                for packet in pipeline._packets(future.result()):
+                    yield packet
@@ -0,0 +1,299 @@
+"""
+capture.py: Block compressed capture files for logs of one packet class.
+
+A capture file consists of a header, compressed blocks of records and a block
+index at the end:
+
+    header:  "SDPC", version, compression, class name length, record size
+             (0 for variable size packets), class name
+    blocks:  compressed block payloads
+    index:   (file offset, first record, record count, stored size) per block
+    trailer: index offset, block count, "SDPI"
+
+Blocks of fixed size packets store every integer field (see
+SerdepaPacket.leaf_fields) as a column of its own, which compresses much
+better than the concatenated records. Blocks of variable size packets store
+the record lengths followed by the records as they are; their fixed leading
+fields are not split into columns, so they compress (and are read by
+serdepa.query) no better than the records themselves.
+"""
+
+from __future__ import unicode_literals
+
+import bisect
+import collections
+import struct
+import zlib
+
+from .exceptions import DeserializeError
+
+
+__author__ = "Raido Pahtma, Kaarel Ratas"
+__license__ = "MIT"
+
+
+MAGIC = b"SDPC"
+INDEX_MAGIC = b"SDPI"
+VERSION = 1
+COMPRESSIONS = {None: 0, "zlib": 1, "lzma": 2}
+
+_HEADER = struct.Struct(">4sBBHI")
+_INDEX_ENTRY = struct.Struct(">QQII")
+_TRAILER = struct.Struct(">QI4s")
+
+BlockInfo = collections.namedtuple("BlockInfo", ["offset", "first", "count", "stored"])
+
+
+def _compress(compression, payload, level):
+    if compression == "zlib":
+        return zlib.compress(bytes(payload), 6 if level is None else level)
+    elif compression == "lzma":
+        import lzma
+        return lzma.compress(bytes(payload), preset=6 if level is None else level)
+    return bytes(payload)
+
+
+def _decompress(compression, payload):
+    if compression == "zlib":
+        return zlib.decompress(payload)
+    elif compression == "lzma":
+        import lzma
+        return lzma.decompress(payload)
+    return payload
+
+
+def _to_columns(records, count, size, leaves):
+    columns = bytearray()
+    for path, offset, int_type in leaves:
+        width = int_type.serialized_size()
+        column = bytearray(count * width)
+        for k in range(width):
+            column[k::width] = records[offset + k::size]
+        columns += column
+    return columns
+
+
+def _from_columns(columns, count, size, leaves):
+    records = bytearray(count * size)
+    pos = 0
+    for path, offset, int_type in leaves:
+        width = int_type.serialized_size()
+        for k in range(width):
+            records[offset + k::size] = columns[pos + k:pos + count * width:width]
+        pos += count * width
+    return records
+
+
+class CaptureWriter(object):
+    """
+    Writes packets of packet_class into a capture file, block_records packets
+    per block. compression is "zlib", "lzma" or None. close() (or leaving the
+    with block) writes the block index; the file object itself stays open.
+    """
+
+    def __init__(self, fileobj, packet_class, block_records=4096, compression="zlib", level=None):
+        if compression not in COMPRESSIONS:
+            raise ValueError("Unknown compression {}".format(compression))
+        self._file = fileobj
+        self._class = packet_class
+        self._size = packet_class._size
+        self._leaves = packet_class.leaf_fields() if self._size is not None else None
+        self._block_records = block_records
+        self._compression = compression
+        self._level = level
+        self._pending = []
+        self._index = []
+        self._records = 0
+        name = packet_class.__name__.encode("utf-8")
+        header = _HEADER.pack(MAGIC, VERSION, COMPRESSIONS[compression], len(name), self._size or 0) + name
+        self._file.write(header)
+        self._offset = len(header)
+        self._closed = False
+
+    def write(self, packet):
+        """
+        Writes a packet, or an already serialized packet.
+        """
+        if self._closed:
+            raise ValueError("The capture has been closed.")
+        data = bytes(packet) if isinstance(packet, (bytes, bytearray, memoryview)) else packet.serialize()
+        if self._size is not None and len(data) != self._size:
+            raise ValueError("Expected a record of {} bytes, got {}".format(self._size, len(data)))
+        self._pending.append(data)
+        if len(self._pending) >= self._block_records:
+            self.flush_block()
+
+    def write_many(self, packets):
+        for packet in packets:
+            self.write(packet)
+
+    def flush_block(self):
+        if not self._pending:
+            return
+        count = len(self._pending)
+        if self._size is not None:
+            payload = _to_columns(b"".join(self._pending), count, self._size, self._leaves)
+        else:
+            payload = struct.pack(str(">{}I".format(count)), *[len(record) for record in self._pending])
+            payload += b"".join(self._pending)
+        stored = _compress(self._compression, payload, self._level)
+        self._file.write(stored)
+        self._index.append(BlockInfo(self._offset, self._records, count, len(stored)))
+        self._offset += len(stored)
+        self._records += count
+        self._pending = []
+
+    def close(self):
+        if self._closed:
+            return
+        self.flush_block()
+        index_offset = self._offset
+        for block in self._index:
+            self._file.write(_INDEX_ENTRY.pack(*block))
+        self._file.write(_TRAILER.pack(index_offset, len(self._index), INDEX_MAGIC))
+        self._file.flush()
+        self._closed = True
+
+    def __len__(self):
+        return self._records + len(self._pending)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class CaptureReader(object):
+    """
+    Reads a capture file of packet_class from a seekable file object. Records
+    can be read by number, the block containing them is found with the index.
+    """
+
+    def __init__(self, fileobj, packet_class):
+        self._file = fileobj
+        self._class = packet_class
+        self._file.seek(0)
+        header = self._file.read(_HEADER.size)
+        if len(header) != _HEADER.size:
+            raise DeserializeError("Not a capture file.")
+        magic, version, compression, name_length, size = _HEADER.unpack(header)
+        if magic != MAGIC:
+            raise DeserializeError("Not a capture file.")
+        if version != VERSION:
+            raise DeserializeError("Unsupported capture file version {}".format(version))
+        name = self._file.read(name_length).decode("utf-8")
+        if name != packet_class.__name__ or size != (packet_class._size or 0):
+            raise DeserializeError("The capture contains {} records of {} bytes, not {}".format(
+                name, size or "variable", packet_class.__name__
+            ))
+        self._compression = dict((v, k) for k, v in COMPRESSIONS.items())[compression]
+        self._size = packet_class._size
+        self._leaves = packet_class.leaf_fields() if self._size is not None else None
+
+        self._file.seek(-_TRAILER.size, 2)
+        index_offset, blocks, magic = _TRAILER.unpack(self._file.read(_TRAILER.size))
+        if magic != INDEX_MAGIC:
+            raise DeserializeError("The capture file is truncated, the block index is missing.")
+        self._file.seek(index_offset)
+        index = self._file.read(blocks * _INDEX_ENTRY.size)
+        self._index = [BlockInfo(*_INDEX_ENTRY.unpack_from(index, i * _INDEX_ENTRY.size)) for i in range(blocks)]
+        self._firsts = [block.first for block in self._index]
+        self._cached = (None, None)
+        self._records = (None, None)
+
+    def __len__(self):
+        if not self._index:
+            return 0
+        return self._index[-1].first + self._index[-1].count
+
+    @property
+    def blocks(self):
+        return list(self._index)
+
+    def block_of(self, record):
+        """
+        Returns the number of the block containing a record.
+        """
+        if not 0 <= record < len(self):
+            raise IndexError("Record {} out of range".format(record))
+        return bisect.bisect_right(self._firsts, record) - 1
+
+    def _payload(self, block):
+        if self._cached[0] != block:
+            info = self._index[block]
+            self._file.seek(info.offset)
+            self._cached = (block, _decompress(self._compression, self._file.read(info.stored)))
+        return self._cached[1]
+
+    def block_records(self, block):
+        """
+        Returns the serialized records of a block as a list of bytes.
+        """
+        if self._records[0] == block:
+            return self._records[1]
+        payload = self._payload(block)
+        count = self._index[block].count
+        if self._size is not None:
+            records = bytes(_from_columns(payload, count, self._size, self._leaves))
+            ret = [records[i * self._size:(i + 1) * self._size] for i in range(count)]
+        else:
+            lengths = struct.unpack_from(str(">{}I".format(count)), payload)
+            ret, pos = [], 4 * count
+            for length in lengths:
+                ret.append(payload[pos:pos + length])
+                pos += length
+        self._records = (block, ret)
+        return ret
+
+    def read_block(self, block):
+        """
+        Returns the packets of a block.
+        """
+        packets = []
+        for record in self.block_records(block):
+            packet = self._class()
+            packet.deserialize(record)
+            packets.append(packet)
+        return packets
+
+    def block_columns(self, block):
+        """
+        Returns an OrderedDict of leaf field path -> tuple of values for a
+        block of fixed size packets.
+        """
+        if self._size is None:
+            raise ValueError("{} does not have a fixed size".format(self._class.__name__))
+        payload = self._payload(block)
+        count = self._index[block].count
+        columns = collections.OrderedDict()
+        pos = 0
+        for path, offset, int_type in self._leaves:
+            fmt = str("{}{}{}".format(int_type._format[0], count, int_type._format[1:]))
+            columns[path] = struct.unpack_from(fmt, payload, pos)
+            pos += count * int_type.serialized_size()
+        return columns
+
+    def block_array(self, block):
+        """
+        Returns the records of a block of fixed size packets as a NumPy
+        structured array (see serdepa.dtypes.packet_dtype).
+        """
+        from .dtypes import require_numpy, packet_dtype
+        numpy = require_numpy()
+        payload = self._payload(block)
+        records = _from_columns(payload, self._index[block].count, self._size, self._leaves)
+        return numpy.frombuffer(records, dtype=packet_dtype(self._class))
+
+    def __getitem__(self, record):
+        if record < 0:
+            record += len(self)
+        block = self.block_of(record)
+        packet = self._class()
+        packet.deserialize(self.block_records(block)[record - self._index[block].first])
+        return packet
+
+    def __iter__(self):
+        for block in range(len(self._index)):
+            for packet in self.read_block(block):
+                yield packet
@@ -0,0 +1,90 @@
+"""
+cstructs.py: ctypes Structures matching the layout of fixed size packets.
+
+    view = packet_view(Packet, shared_buffer, offset)
+    view.header             # read straight from the buffer
+    view.origin.x = 5       # written straight into the buffer
+
+A ctypes Structure has a single byte order, so the multi-byte integers of a
+packet (not counting nested packets, which get Structures of their own) must
+all be nx_* or all native types.
+"""
+
+from __future__ import unicode_literals
+
+import ctypes
+
+from .serdepa import BaseInt, Checksum, Array, ByteString
+
+
+__author__ = "Raido Pahtma, Kaarel Ratas"
+__license__ = "MIT"
+
+
+_CTYPES = {
+    (1, False): ctypes.c_uint8, (1, True): ctypes.c_int8,
+    (2, False): ctypes.c_uint16, (2, True): ctypes.c_int16,
+    (4, False): ctypes.c_uint32, (4, True): ctypes.c_int32,
+    (8, False): ctypes.c_uint64, (8, True): ctypes.c_int64,
+}
+
+
+def int_ctype(int_type):
+    """
+    Returns the ctypes type of a serdepa integer type, for example c_uint16
+    for nx_uint16. The byte order is set by the Structure it is used in.
+    """
+    return _CTYPES[(int_type.serialized_size(), int_type._signed)]
+
+
+def packet_structure(packet_class):
+    """
+    Returns a ctypes BigEndianStructure (for nx_* fields) or
+    LittleEndianStructure (for native fields) with the same memory layout as
+    the serialized fixed size packet_class. Nested packets become nested
+    Structures and Arrays ctypes arrays.
+    """
+    if packet_class._size is None:
+        raise ValueError("{} does not have a fixed size".format(packet_class.__name__))
+    structure = packet_class.__dict__.get("_ctype")
+    if structure is None:
+        orders = set()
+        fields = []
+        for name, (field_type, _) in packet_class._fields.items():
+            fields.append((str(name), _field_ctype(field_type, orders)))
+        if len(orders) > 1:
+            raise ValueError("{} mixes big and little endian fields".format(packet_class.__name__))
+        base = ctypes.LittleEndianStructure if orders == {"<"} else ctypes.BigEndianStructure
+        structure = type(str(packet_class.__name__), (base, ), {"_pack_": 1, "_fields_": fields})
+        if ctypes.sizeof(structure) != packet_class._size:
+            raise ValueError("The Structure of {} is {} bytes, expected {}".format(
+                packet_class.__name__, ctypes.sizeof(structure), packet_class._size
+            ))
+        setattr(packet_class, "_ctype", structure)
+    return structure
+
+
+def _field_ctype(field_type, orders):
+    if isinstance(field_type, Checksum):
+        field_type = field_type._type.__class__
+    if isinstance(field_type, type) and issubclass(field_type, BaseInt):
+        if field_type.serialized_size() > 1:
+            orders.add(field_type._format[0])
+        return int_ctype(field_type)
+    elif isinstance(field_type, type):
+        return packet_structure(field_type)
+    elif isinstance(field_type, ByteString):
+        return ctypes.c_uint8 * field_type._data_container.length
+    elif isinstance(field_type, Array):
+        return _field_ctype(field_type._type, orders) * field_type.length
+    raise ValueError("{} does not have a fixed size".format(field_type))
+
+
+def packet_view(packet_class, buffer, offset=0):
+    """
+    Returns the Structure of packet_class over a writable buffer (bytearray,
+    mmap, shared memory) at offset without copying. Reading a field reads
+    the buffer and assigning to it writes the buffer. Use
+    packet_structure(cls).from_buffer_copy for read-only buffers.
+    """
+    return packet_structure(packet_class).from_buffer(buffer, offset)
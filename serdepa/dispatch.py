@@ -0,0 +1,203 @@
+"""
+dispatch.py: Decoding mixed streams of packets told apart by a discriminator.
+
+    dispatcher = Dispatcher("header")
+    dispatcher.register(0x01, OnePacket)
+    dispatcher.register(0x02, AnotherPacket)
+    packet = dispatcher.decode(data)
+
+The discriminator is read with a single unpack_from at the offset all the
+registered classes share, and the class is found with one dict lookup. A
+Dispatcher can be registered as the target of another one to dispatch on a
+second field.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import struct
+import threading
+
+from .serdepa import SerdepaPacket, BaseInt, Length
+from .exceptions import DeserializeError, PacketDefinitionError
+
+
+__author__ = "Raido Pahtma, Kaarel Ratas"
+__license__ = "MIT"
+
+
+def static_field(packet_class, name):
+    """
+    Returns the offset and the integer type of a field (or a dotted path into
+    nested packets) that has the same offset in every packet of packet_class.
+    """
+    packet, offset = packet_class, 0
+    for attr in name.split("."):
+        if not (isinstance(packet, type) and issubclass(packet, SerdepaPacket)) or attr not in packet._fields:
+            raise PacketDefinitionError("{} has no field {}".format(packet_class.__name__, name))
+        layout = packet._offsets[attr]
+        if layout.offset is None or layout.terms:
+            raise PacketDefinitionError("The offset of {} in {} is not static".format(name, packet_class.__name__))
+        offset += layout.offset
+        packet = packet._fields[attr][0]
+    if isinstance(packet, Length):
+        packet = packet._type.__class__
+    if not (isinstance(packet, type) and issubclass(packet, BaseInt)):
+        raise PacketDefinitionError("The field {} of {} is not an integer".format(name, packet_class.__name__))
+    return offset, packet
+
+
+class Dispatcher(object):
+    """
+    Maps the values of a discriminator field to packet classes (or other
+    Dispatchers). The offset and type of the field are taken from the
+    registered classes unless given explicitly. The counters in stats can be
+    updated from several threads, for example by a DecodePipeline.
+    """
+
+    def __init__(self, field, offset=None, field_type=None):
+        self.field = field
+        self._offset = offset
+        self._type = field_type
+        self._unpack_from = None if field_type is None else struct.Struct(field_type._format).unpack_from
+        self._targets = {}
+        self.decoded = collections.Counter()
+        self.unknown = collections.Counter()
+        self.errors = 0
+        self._lock = threading.Lock()
+
+    def register(self, value, target=None):
+        """
+        Registers a packet class or a Dispatcher for a discriminator value.
+        Without a target, returns a class decorator.
+        """
+        if target is None:
+            def decorator(cls):
+                self.register(value, cls)
+                return cls
+            return decorator
+        if value in self._targets:
+            raise PacketDefinitionError("Discriminator value {} of {} is already registered to {}".format(
+                value, self.field, self._name(self._targets[value])
+            ))
+        if isinstance(target, Dispatcher):
+            classes = target.classes()
+        else:
+            classes = [target]
+        for cls in classes:
+            offset, field_type = static_field(cls, self.field)
+            if self._offset is None:
+                self._offset, self._type = offset, field_type
+                self._unpack_from = struct.Struct(field_type._format).unpack_from
+            elif (offset, field_type._format) != (self._offset, self._type._format):
+                raise PacketDefinitionError(
+                    "The discriminator {} of {} is a {} at offset {}, expected a {} at offset {}".format(
+                        self.field, cls.__name__, field_type.__name__, offset, self._type.__name__, self._offset
+                    )
+                )
+        self._targets[value] = target
+        return target
+
+    def classes(self):
+        """
+        Returns all the packet classes this dispatcher (and the nested
+        dispatchers) can decode.
+        """
+        ret = []
+        for target in self._targets.values():
+            ret.extend(target.classes() if isinstance(target, Dispatcher) else [target])
+        return ret
+
+    def classify(self, data, pos=0):
+        """
+        Returns the packet class of the data without decoding it, or None if
+        the discriminator value is not registered.
+        """
+        try:
+            value = self._unpack_from(data, pos + self._offset)[0]
+        except struct.error as e:
+            raise DeserializeError("Invalid length of data!", e)
+        except TypeError:
+            raise DeserializeError("No packet classes registered for {}".format(self.field))
+        target = self._targets.get(value)
+        if target is None:
+            with self._lock:
+                self.unknown[value] += 1
+            return None
+        if isinstance(target, Dispatcher):
+            return target.classify(data, pos)
+        return target
+
+    def decode(self, data, pos=0):
+        """
+        Returns a deserialized packet of the class registered for the
+        discriminator value in data. Raises DeserializeError for unknown values.
+        Frames with a wrong checksum are rejected before the packet is built.
+        Unknown values are counted in unknown and all other errors in errors.
+        """
+        try:
+            cls = self.classify(data, pos)
+        except DeserializeError:
+            self._error()
+            raise
+        if cls is None:
+            raise DeserializeError("Unknown {} {}".format(self.field, self._unpack_from(data, pos + self._offset)[0]))
+        try:
+            cls.verify(data, pos)
+            packet = cls()
+            packet.deserialize(data, pos, checksums=False)
+        except DeserializeError:
+            self._error()
+            raise
+        with self._lock:
+            self.decoded[cls.__name__] += 1
+        return packet
+
+    def _error(self):
+        with self._lock:
+            self.errors += 1
+
+    def decode_many(self, frames, skip_invalid=True):
+        """
+        Decodes an iterable of frames, skipping (but counting) frames of
+        unknown types and invalid frames if skip_invalid is set.
+        """
+        for frame in frames:
+            try:
+                yield self.decode(frame)
+            except DeserializeError:
+                if not skip_invalid:
+                    raise
+
+    @property
+    def stats(self):
+        with self._lock:
+            ret = {
+                "decoded": dict(self.decoded),
+                "unknown": dict(self.unknown),
+                "errors": self.errors,
+            }
+        ret["nested"] = dict(
+            (value, target.stats) for value, target in self._targets.items() if isinstance(target, Dispatcher)
+        )
+        return ret
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["_unpack_from"]   # Struct methods and locks can't be pickled
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._unpack_from = None if self._type is None else struct.Struct(self._type._format).unpack_from
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _name(target):
+        return "a dispatcher on {}".format(target.field) if isinstance(target, Dispatcher) else target.__name__
+
+    def __repr__(self):
+        return "<Dispatcher on {}: {}>".format(self.field, ", ".join(
+            "{}: {}".format(value, self._name(target)) for value, target in sorted(self._targets.items())
+        ))
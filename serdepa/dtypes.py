@@ -0,0 +1,72 @@
+"""
+dtypes.py: NumPy dtypes matching the layout of fixed size packets.
+
+NumPy is optional, the functions here raise ImportError if it is missing.
+"""
+
+from __future__ import unicode_literals
+
+from .serdepa import BaseInt, Length, Checksum, Array, ByteString
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+__author__ = "Raido Pahtma, Kaarel Ratas"
+__license__ = "MIT"
+
+
+def require_numpy():
+    if numpy is None:
+        raise ImportError("NumPy is required for this, install it with 'pip install numpy'.")
+    return numpy
+
+
+def int_dtype(int_type):
+    """
+    Returns the dtype of a serdepa integer type, for example >u2 for nx_uint16.
+    """
+    require_numpy()
+    return numpy.dtype(str("{}{}{}".format(
+        int_type._format[0], "i" if int_type._signed else "u", int_type.serialized_size()
+    )))
+
+
+def packet_dtype(packet_class):
+    """
+    Returns a structured dtype with the same memory layout as the serialized
+    fixed size packet_class. Nested packets become nested dtypes and Arrays
+    subarrays, so np.frombuffer(data, packet_dtype(cls)) decodes packets
+    without any copying.
+    """
+    require_numpy()
+    if packet_class._size is None:
+        raise ValueError("{} does not have a fixed size".format(packet_class.__name__))
+    dtype = packet_class.__dict__.get("_dtype")
+    if dtype is None:
+        names, formats, offsets = [], [], []
+        for name, layout in packet_class._offsets.items():
+            names.append(str(name))
+            formats.append(_field_dtype(packet_class._fields[name][0]))
+            offsets.append(layout.offset)
+        dtype = numpy.dtype({
+            "names": names, "formats": formats, "offsets": offsets, "itemsize": packet_class._size
+        })
+        setattr(packet_class, "_dtype", dtype)
+    return dtype
+
+
+def _field_dtype(field_type):
+    if isinstance(field_type, (Length, Checksum)):
+        return int_dtype(field_type._type.__class__)
+    elif isinstance(field_type, type) and issubclass(field_type, BaseInt):
+        return int_dtype(field_type)
+    elif isinstance(field_type, type):
+        return packet_dtype(field_type)
+    elif isinstance(field_type, ByteString):
+        return numpy.dtype((numpy.uint8, (field_type._data_container.length, )))
+    elif isinstance(field_type, Array):
+        return numpy.dtype((_field_dtype(field_type._type), (field_type.length, )))
+    raise ValueError("{} does not have a fixed size".format(field_type))
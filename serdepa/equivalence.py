@@ -0,0 +1,503 @@
+"""
+equivalence.py: A randomized harness checking that the fast paths of serdepa
+produce the same bytes and values as the reference serialize() and
+deserialize() of packets, and measuring how much faster they are.
+
+    rng = random.Random(seed)
+    packet_class = random_layout(rng)
+    values = random_values(rng, packet_class)
+    checked, mismatches = check_layout(packet_class, values)    # [] if they all agree
+    measure_layout(packet_class, values)     # OrderedDict of Timings
+
+Layouts are built from every integer type, Length, List, Array, ByteString,
+checksums and nested packets, and respect the rules of packet definitions
+(only the last field can be a List or ByteString without a Length).
+check_layout serializes the values with the reference codec and compares
+every codec in CODECS that applies to the layout with it. run() does both
+for a range of seeds and returns a Report per layout.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import copy
+import io
+import random
+import re
+import timeit
+
+from .serdepa import (
+    SerdepaPacket, SuperSerdepaPacket, DecodeCache, BaseInt, Length, Checksum, List, Array, ByteString, CRC16, CRC32,
+    nx_uint8, nx_int8, uint8, int8, nx_uint16, nx_int16, uint16, int16,
+    nx_uint32, nx_int32, uint32, int32, nx_uint64, nx_int64, uint64, int64,
+    _is_variable
+)
+from .exceptions import SerdepaError, DeserializeError
+from .dtypes import numpy
+
+
+__author__ = "Raido Pahtma, Kaarel Ratas"
+__license__ = "MIT"
+
+
+INT_TYPES = (
+    nx_uint8, nx_int8, uint8, int8, nx_uint16, nx_int16, uint16, int16,
+    nx_uint32, nx_int32, uint32, int32, nx_uint64, nx_int64, uint64, int64,
+)
+LENGTH_TYPES = (nx_uint8, uint8, nx_uint16, uint16, nx_uint32)
+
+_SWAPPED = {}
+for _int_type in INT_TYPES:
+    _SWAPPED[_int_type] = next(
+        other for other in INT_TYPES
+        if other is not _int_type and other._signed == _int_type._signed and
+        other.serialized_size() == _int_type.serialized_size()
+    )
+
+Mismatch = collections.namedtuple("Mismatch", ["codec", "detail"])
+Timing = collections.namedtuple("Timing", ["reference", "fast"])     # seconds per record
+Report = collections.namedtuple("Report", ["seed", "packet_class", "size", "codecs", "mismatches", "timings"])
+
+
+class _Differs(Exception):
+    pass
+
+
+class _NotApplicable(Exception):
+    pass
+
+
+def _expect(got, expected, what):
+    if got != expected:
+        raise _Differs("{}: got {!r}, expected {!r}".format(what, got, expected))
+
+
+def random_layout(rng, name="Random", depth=0, max_depth=2, max_fields=5):
+    """
+    Returns a new packet class with a random layout. Nested packets, and
+    elements of Lists and Arrays, are random layouts of their own up to
+    max_depth levels deep.
+    """
+    counter = [0]
+
+    def nested():
+        counter[0] += 1
+        return random_layout(rng, "{}_{}".format(name, counter[0]), depth + 1, max_depth, max_fields)
+
+    def element():
+        return nested() if depth < max_depth and rng.random() < 0.3 else rng.choice(INT_TYPES)
+
+    fields = []
+    for i in range(rng.randint(1, max_fields)):
+        field = "f{}".format(i)
+        kind = rng.choice(("int", "int", "int", "packet", "array", "list", "bytes"))
+        if kind == "packet" and depth < max_depth:
+            fields.append((field, nested()))
+        elif kind == "array":
+            fields.append((field, Array(element(), rng.randint(1, 3))))
+        elif kind == "list":
+            fields.append(("n_" + field, Length(rng.choice(LENGTH_TYPES), field)))
+            fields.append((field, List(element())))
+        elif kind == "bytes":
+            fields.append(("n_" + field, Length(rng.choice(LENGTH_TYPES), field)))
+            fields.append((field, ByteString()))
+        else:
+            fields.append((field, rng.choice(INT_TYPES)))
+    tail = rng.random()
+    if tail < 0.15:
+        fields.append(("tail", ByteString(rng.randint(1, 4))))
+    elif tail < 0.3 and depth == 0:     # the end of the data ends these, so they can not be nested
+        fields.append(("tail", List(element()) if rng.random() < 0.5 else ByteString()))
+    elif tail < 0.5:
+        names = [field[0] for field in fields]
+        first = rng.randrange(len(names))
+        last = rng.randrange(first, len(names))
+        checksum, int_type = rng.choice(((CRC16, nx_uint16), (CRC32, nx_uint32)))
+        int_type = rng.choice((int_type, _SWAPPED[int_type]))
+        fields.append(("crc", checksum(names[first], names[last], int_type=int_type)))
+    return SuperSerdepaPacket(str(name), (SerdepaPacket, ), {"_fields_": fields})
+
+
+def random_values(rng, packet_class, max_items=4):
+    """
+    Returns a random tuple of field values for packet_class (see
+    SerdepaPacket.to_tuple). Arrays and fixed ByteStrings are sometimes
+    given fewer elements than they hold, to check the padding.
+    """
+    return tuple(
+        _random_value(rng, field_type, max_items) for name, (field_type, _) in packet_class._fields.items()
+        if name not in packet_class._computed
+    )
+
+
+def _random_value(rng, field_type, max_items):
+    if isinstance(field_type, type) and issubclass(field_type, BaseInt):
+        low, high = field_type.value_range()
+        return rng.choice((low, high, 0, rng.randint(low, high)))
+    elif isinstance(field_type, type):
+        return random_values(rng, field_type, max_items)
+    elif isinstance(field_type, ByteString):
+        container = field_type._data_container
+        count = rng.randint(0, container.length if isinstance(container, Array) else max_items * 2)
+        return bytes(bytearray(rng.randint(0, 255) for _ in range(count)))
+    count = rng.randint(0, field_type.length if isinstance(field_type, Array) else max_items)
+    return [_random_value(rng, field_type._type, max_items) for _ in range(count)]
+
+
+def describe(packet_class):
+    """
+    Returns a one line description of the layout of packet_class.
+    """
+    return "{}({})".format(packet_class.__name__, ", ".join(
+        _describe_type(field_type) for field_type, _ in packet_class._fields.values()
+    ))
+
+
+def _describe_type(field_type):
+    if isinstance(field_type, type):
+        return field_type.__name__ if issubclass(field_type, BaseInt) else describe(field_type)
+    elif isinstance(field_type, (Length, Checksum)):
+        return "{}<{}>".format(field_type.__class__.__name__, field_type._type.__class__.__name__)
+    elif isinstance(field_type, ByteString):
+        container = field_type._data_container
+        return "ByteString({})".format(container.length if isinstance(container, Array) else "")
+    elif isinstance(field_type, Array):
+        return "Array({}, {})".format(_describe_type(field_type._type), field_type.length)
+    return "List({})".format(_describe_type(field_type._type))
+
+
+def variant(packet_class, **attrs):
+    """
+    Returns a class with the fields of packet_class (the nested packets are
+    shared) and the class attributes attrs, for example _lazy_=True.
+    """
+    attrs["_fields_"] = [
+        (name, field_type) + (() if default is None else (default, ))
+        for name, (field_type, default) in packet_class._fields.items()
+    ]
+    return SuperSerdepaPacket(str(packet_class.__name__), (SerdepaPacket, ), attrs)
+
+
+def swapped(packet_class):
+    """
+    Returns a class with the fields of packet_class in the other byte order,
+    nested packets included. Checksums are kept, stored swapped.
+    """
+    fields = []
+    for name, (field_type, default) in packet_class._fields.items():
+        fields.append((name, _swapped_type(field_type)) + (() if default is None else (default, )))
+    return SuperSerdepaPacket(str(packet_class.__name__ + "Swapped"), (SerdepaPacket, ), {"_fields_": fields})
+
+
+def _swapped_type(field_type):
+    if isinstance(field_type, type):
+        return _SWAPPED[field_type] if issubclass(field_type, BaseInt) else swapped(field_type)
+    elif isinstance(field_type, (Length, Checksum)):
+        ret = copy.copy(field_type)
+        ret._type = _SWAPPED[field_type._type.__class__]()
+        return ret
+    elif isinstance(field_type, ByteString):
+        return field_type
+    elif isinstance(field_type, Array):
+        return Array(_swapped_type(field_type._type), field_type.length)
+    return List(_swapped_type(field_type._type))
+
+
+def _open_ended(packet_class):
+    name, (field_type, _) = list(packet_class._fields.items())[-1]
+    return _is_variable(field_type) and name not in packet_class._depends.values()
+
+
+def _decoded(packet_class, data):
+    packet = packet_class()
+    packet.deserialize(data)
+    return packet
+
+
+def _path_value(obj, path, item):
+    for attr, index in re.findall(r"(\w+)(?:\[(\d+)\])?", path):
+        obj = item(obj, attr)
+        if index:
+            obj = obj[int(index)]
+    return int(obj)
+
+
+# The codecs compared with the reference, each a check(packet_class, packet,
+# data) that raises _Differs when its result differs from the reference
+# packet or the reference encoding data of the packet. A codec that does not
+# apply to a layout raises _NotApplicable.
+
+def _check_deserialize(cls, packet, data):
+    decoded = _decoded(cls, data)
+    _expect(bytes(decoded.serialize()), data, "serialize after deserialize")
+    _expect(decoded.serialized_size(), len(data), "serialized_size")
+    _expect(decoded.to_tuple(), packet.to_tuple(), "values after deserialize")
+
+
+def _check_validation(cls, packet, data):
+    for validation in ("unchecked", "strict"):
+        decoded = cls()
+        decoded.deserialize(data, validation=validation)
+        _expect(decoded.to_tuple(), packet.to_tuple(), "values after a {} deserialize".format(validation))
+        _expect(bytes(decoded.serialize()), data, "serialize after a {} deserialize".format(validation))
+
+
+def _check_from_dict(cls, packet, data):
+    _expect(bytes(cls.from_dict(packet.to_dict()).serialize()), data, "from_dict")
+    _expect(bytes(cls.from_tuple(packet.to_tuple()).serialize()), data, "from_tuple")
+
+
+def _check_serialize_to(cls, packet, data):
+    out = io.BytesIO()
+    written = packet.serialize_to(out, chunk_size=7)
+    _expect(out.getvalue(), data, "serialize_to")
+    _expect(written, len(data), "bytes written")
+
+
+def _check_serialize_buffers(cls, packet, data):
+    _expect(b"".join(bytes(buf) for buf in packet.serialize_buffers(min_size=4)), data, "serialize_buffers")
+
+
+def _check_serialize_many(cls, packet, data):
+    items = [packet, packet.to_tuple(), packet.to_dict()]
+    _expect(bytes(cls.serialize_many(items)), data * 3, "serialize_many")
+
+
+def _check_builtins(cls, packet, data):
+    _expect(cls.to_tuples([data]), [packet.to_tuple()], "to_tuples")
+    _expect(cls.to_dicts([bytearray(data)]), [packet.to_dict()], "to_dicts")
+    _expect(cls.to_tuples([_decoded(cls, data)]), [packet.to_tuple()], "to_tuples of packets")
+    if not _open_ended(cls) and data:
+        _expect(cls.to_tuples(data * 3), [packet.to_tuple()] * 3, "to_tuples of a buffer")
+
+
+def _check_incremental(cls, packet, data):
+    incremental = variant(cls, _incremental_=True)
+    encoder = incremental.from_tuple(packet.to_tuple())
+    _expect(bytes(encoder.serialize()), data, "first incremental serialize")
+    _expect(bytes(encoder.serialize()), data, "second incremental serialize")
+    _expect(bytes(_decoded(incremental, data).serialize()), data, "incremental serialize after deserialize")
+
+
+def _check_lazy(cls, packet, data):
+    lazy = variant(cls, _lazy_=True)
+    _expect(bytes(lazy.from_tuple(packet.to_tuple()).serialize()), data, "lazy serialize")
+    _expect(_decoded(lazy, data).to_tuple(), packet.to_tuple(), "lazy deserialize")
+
+
+def _check_cache(cls, packet, data):
+    cache = DecodeCache(cls, copy=True)
+    for _ in range(2):
+        _expect(cache.decode(data).to_tuple(), packet.to_tuple(), "DecodeCache")
+    pool = cls.pool()
+    for _ in range(2):
+        decoded = pool.decode(data)
+        _expect(decoded.to_tuple(), packet.to_tuple(), "PacketPool")
+        pool.release(decoded)
+
+
+def _check_peek(cls, packet, data):
+    names = [name for name, (field_type, _) in cls._fields.items() if name not in cls._computed]
+    ints = [
+        name for name in names if isinstance(cls._fields[name][0], type) and issubclass(cls._fields[name][0], BaseInt)
+    ]
+    if not ints:
+        raise _NotApplicable()
+    for name in ints:
+        _expect(cls.peek(data, name), getattr(packet, name), "peek {}".format(name))
+    _expect(list(cls.deserialize_fields(data, ints)), [getattr(packet, name) for name in ints], "deserialize_fields")
+
+
+def _check_patch(cls, packet, data):
+    values = list(packet.to_tuple())
+    updates = {}
+    for i, name in enumerate(name for name in cls._fields if name not in cls._computed):
+        field_type = cls._fields[name][0]
+        if isinstance(field_type, type) and issubclass(field_type, BaseInt):
+            low, high = field_type.value_range()
+            values[i] = updates[name] = high if values[i] == low else low
+    if not updates:
+        raise _NotApplicable()
+    patched = cls.patch(bytearray(data), updates, fallback=True)
+    _expect(bytes(patched), bytes(cls.from_tuple(values).serialize()), "patch")
+
+
+def _check_verify(cls, packet, data):
+    if not cls._has_checksums:
+        raise _NotApplicable()
+    cls.verify(data)
+    name, (checksum, _) = list(cls._fields.items())[-1]
+    if isinstance(checksum, Checksum):
+        corrupted = bytearray(data)
+        corrupted[-1] ^= 0x01
+        try:
+            cls.verify(corrupted)
+        except DeserializeError:
+            pass
+        else:
+            raise _Differs("verify accepted a corrupted {}".format(name))
+
+
+def _check_capture(cls, packet, data):
+    from .capture import CaptureWriter, CaptureReader
+    out = io.BytesIO()
+    with CaptureWriter(out, cls, block_records=2) as writer:
+        for _ in range(3):
+            writer.write(packet)
+    reader = CaptureReader(out, cls)
+    records = [bytes(record) for block in range(len(reader.blocks)) for record in reader.block_records(block)]
+    _expect(records, [data] * 3, "capture records")
+
+
+def _check_numpy(cls, packet, data):
+    if cls._size is None or numpy is None:
+        raise _NotApplicable()
+    from .dtypes import packet_dtype
+    records = numpy.frombuffer(data * 2, dtype=packet_dtype(cls))
+    _expect(records.tobytes(), data * 2, "packet_dtype bytes")
+    packet = _decoded(cls, data)    # with the padding of Arrays
+    for path, offset, int_type in cls.leaf_fields():
+        _expect(
+            _path_value(records[1], path, lambda obj, attr: obj[attr]),
+            _path_value(packet, path, _packet_item), "packet_dtype {}".format(path)
+        )
+
+
+def _check_ctypes(cls, packet, data):
+    if cls._size is None:
+        raise _NotApplicable()
+    from .cstructs import packet_structure
+    try:
+        structure = packet_structure(cls)
+    except ValueError:      # mixed byte orders
+        raise _NotApplicable()
+    view = structure.from_buffer_copy(data)
+    _expect(bytes(view), data, "packet_structure bytes")
+    packet = _decoded(cls, data)
+    for path, offset, int_type in cls.leaf_fields():
+        _expect(
+            _path_value(view, path, getattr),
+            _path_value(packet, path, _packet_item), "packet_structure {}".format(path)
+        )
+
+
+def _check_transcode(cls, packet, data):
+    if cls._size is None:
+        raise _NotApplicable()
+    from .transcode import Transcoder
+    twin = swapped(cls)
+    transcoder = Transcoder(cls, twin)
+    converted = transcoder.convert(data * 2)
+    _expect(bytes(converted), bytes(twin.from_tuple(packet.to_tuple()).serialize()) * 2, "Transcoder to swapped")
+    _expect(bytes(transcoder.reverse().convert(converted)), data * 2, "Transcoder back")
+
+
+def _packet_item(obj, attr):
+    obj = getattr(obj, attr)
+    return getattr(obj, "_data_container", obj)     # ByteStrings are not indexable
+
+
+CODECS = collections.OrderedDict([
+    ("deserialize", _check_deserialize),
+    ("validation", _check_validation),
+    ("from_dict", _check_from_dict),
+    ("serialize_to", _check_serialize_to),
+    ("serialize_buffers", _check_serialize_buffers),
+    ("serialize_many", _check_serialize_many),
+    ("builtins", _check_builtins),
+    ("incremental", _check_incremental),
+    ("lazy", _check_lazy),
+    ("cache", _check_cache),
+    ("peek", _check_peek),
+    ("patch", _check_patch),
+    ("verify", _check_verify),
+    ("capture", _check_capture),
+    ("numpy", _check_numpy),
+    ("ctypes", _check_ctypes),
+    ("transcode", _check_transcode),
+])
+
+
+def reference_encoding(packet_class, values):
+    """
+    Returns the reference packet of values and its serialize() bytes.
+    """
+    packet = packet_class.from_tuple(values)
+    return packet, bytes(packet.serialize())
+
+
+def check_layout(packet_class, values, codecs=None):
+    """
+    Compares every codec (names from CODECS, all by default) that applies to
+    packet_class with the reference encoding of values. Returns the names of
+    the codecs checked and a list of Mismatches, errors included.
+    """
+    packet, data = reference_encoding(packet_class, values)
+    checked, mismatches = [], []
+    for name in codecs or CODECS:
+        try:
+            CODECS[name](packet_class, packet, data)
+        except _NotApplicable:
+            continue
+        except _Differs as e:
+            mismatches.append(Mismatch(name, str(e)))
+        except (SerdepaError, ValueError, TypeError, AttributeError, IndexError, KeyError, NotImplementedError) as e:
+            mismatches.append(Mismatch(name, "{}: {}".format(e.__class__.__name__, e)))
+        checked.append(name)
+    return checked, mismatches
+
+
+def measure_layout(packet_class, values, records=100, repeat=3):
+    """
+    Times the reference codec against the fast paths for a batch of records
+    copies of values. Returns an OrderedDict of Timings in seconds per
+    record: "decode" is deserialize against to_tuples, "unchecked" against
+    an unchecked deserialize, "encode" from_tuple and serialize against
+    serialize_many, "numpy" (fixed size packets, if NumPy is installed)
+    deserialize against np.frombuffer.
+    """
+    packet, data = reference_encoding(packet_class, values)
+    frames = [data] * records
+    tuples = [packet.to_tuple()] * records
+
+    def best(func):
+        return min(timeit.repeat(func, number=1, repeat=repeat)) / records
+
+    def decode():
+        for frame in frames:
+            packet_class().deserialize(frame)
+
+    def unchecked():
+        for frame in frames:
+            packet_class().deserialize(frame, validation="unchecked")
+
+    def encode():
+        for item in tuples:
+            packet_class.from_tuple(item).serialize()
+
+    ret = collections.OrderedDict()
+    ret["decode"] = Timing(best(decode), best(lambda: packet_class.to_tuples(frames)))
+    ret["unchecked"] = Timing(ret["decode"].reference, best(unchecked))
+    ret["encode"] = Timing(best(encode), best(lambda: packet_class.serialize_many(tuples)))
+    if numpy is not None and packet_class._size:
+        from .dtypes import packet_dtype
+        dtype, buf = packet_dtype(packet_class), data * records
+        ret["numpy"] = Timing(ret["decode"].reference, best(lambda: numpy.frombuffer(buf, dtype=dtype)))
+    return ret
+
+
+def run(seeds, codecs=None, timings=True, records=100):
+    """
+    Generates a random layout and values for every seed, checks them and
+    optionally times them. Returns a list of Reports.
+    """
+    reports = []
+    for seed in seeds:
+        rng = random.Random(seed)
+        packet_class = random_layout(rng, "Random{}".format(seed))
+        values = random_values(rng, packet_class)
+        checked, mismatches = check_layout(packet_class, values, codecs)
+        size = len(reference_encoding(packet_class, values)[1])
+        measured = measure_layout(packet_class, values, records) if timings and not mismatches else None
+        reports.append(Report(seed, packet_class, size, checked, mismatches, measured))
+    return reports
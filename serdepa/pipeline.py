@@ -0,0 +1,209 @@
+"""
+pipeline.py: Decoding streams of frames on a thread or process pool.
+
+    with DecodePipeline(Packet, workers=4) as pipeline:
+        for packet in pipeline.map(frames):
+            handle(packet)
+
+The decoder is a packet class or a Dispatcher. At most max_pending batches
+of batch_size frames are being decoded at a time, so a fast source is slowed
+down to the speed of the decoding instead of filling up memory. Packets are
+delivered in the order of the frames unless ordered is False, in which case
+they come as soon as they are decoded.
+
+A process pool needs the packet classes to be importable in the worker
+processes (defined at the top level of a module) and sends the decoded
+packets back pickled, so it pays off only for large or complicated packets.
+
+map_async() and decode_async() (Python 3.6+) do the same for asyncio code.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import itertools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+from .exceptions import DeserializeError
+
+
+__author__ = "Raido Pahtma, Kaarel Ratas"
+__license__ = "MIT"
+
+
+def _decode_batch(decoder, frames):
+    """
+    Decodes a batch of frames in a worker. Invalid frames are returned as
+    their DeserializeError so the rest of the batch is not lost.
+    """
+    ret = []
+    for frame in frames:
+        try:
+            if hasattr(decoder, "decode"):
+                ret.append(decoder.decode(frame))
+            else:
+                packet = decoder()
+                packet.deserialize(frame)
+                ret.append(packet)
+        except DeserializeError as e:
+            ret.append(e)
+    return ret
+
+
+def _batches(frames, size):
+    frames = iter(frames)
+    while True:
+        batch = list(itertools.islice(frames, size))
+        if not batch:
+            return
+        yield batch
+
+
+class DecodePipeline(object):
+    """
+    Decodes frames with decoder (a packet class or a Dispatcher) on a pool
+    of workers. executor is "thread", "process" or an Executor, which is
+    then not shut down by close(). Invalid frames are counted and skipped,
+    or if skip_invalid is not set, their DeserializeError is raised where
+    their packet would have been delivered.
+    """
+
+    def __init__(self, decoder, workers=4, executor="thread", max_pending=64, batch_size=1,
+                 ordered=True, skip_invalid=True):
+        if executor == "thread":
+            self._executor, self._owned = ThreadPoolExecutor(workers), True
+        elif executor == "process":
+            self._executor, self._owned = ProcessPoolExecutor(workers), True
+        else:
+            self._executor, self._owned = executor, False
+        self.decoder = decoder
+        self.max_pending = max_pending
+        self.batch_size = batch_size
+        self.ordered = ordered
+        self.skip_invalid = skip_invalid
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+        self._started = None
+        self.submitted = 0
+        self.decoded = 0
+        self.errors = 0
+        self.pending = 0
+        self.max_pending_seen = 0
+
+    def _submit(self, frames):
+        with self._lock:
+            if self._started is None:
+                self._started = time.time()
+            self.submitted += len(frames)
+            self.pending += len(frames)
+            self.max_pending_seen = max(self.max_pending_seen, self.pending)
+        future = self._executor.submit(_decode_batch, self.decoder, frames)
+        future.add_done_callback(lambda f: self._done(f, len(frames)))
+        return future
+
+    def _done(self, future, count):
+        with self._lock:
+            self.pending -= count
+            if not future.cancelled() and future.exception() is None:
+                errors = sum(1 for item in future.result() if isinstance(item, DeserializeError))
+                self.errors += errors
+                self.decoded += count - errors
+
+    def _packets(self, results):
+        for item in results:
+            if isinstance(item, DeserializeError):
+                if not self.skip_invalid:
+                    raise item
+            else:
+                yield item
+
+    def submit(self, frame):
+        """
+        Submits a single frame and returns a concurrent.futures.Future of its
+        packet. Blocks while max_pending frames are being decoded.
+        """
+        self._slots.acquire()
+        future = self._submit([frame])
+        future.add_done_callback(lambda f: self._slots.release())
+        return future
+
+    def decode(self, frame):
+        """
+        Decodes a single frame on the pool and returns the packet.
+        """
+        result = self.submit(frame).result()[0]
+        if isinstance(result, DeserializeError):
+            raise result
+        return result
+
+    def map(self, frames):
+        """
+        Decodes an iterable of frames and yields the packets. The frames are
+        read from the iterable only as fast as they are decoded.
+        """
+        if self.ordered:
+            futures = collections.deque()
+            for batch in _batches(frames, self.batch_size):
+                futures.append(self._submit(batch))
+                while len(futures) >= self.max_pending or (futures and futures[0].done()):
+                    for packet in self._packets(futures.popleft().result()):
+                        yield packet
+            while futures:
+                for packet in self._packets(futures.popleft().result()):
+                    yield packet
+        else:
+            futures = set()
+            for batch in _batches(frames, self.batch_size):
+                futures.add(self._submit(batch))
+                if len(futures) >= self.max_pending:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        for packet in self._packets(future.result()):
+                            yield packet
+            while futures:
+                done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                for future in done:
+                    for packet in self._packets(future.result()):
+                        yield packet
+
+    def map_async(self, frames):
+        """
+        Returns an asynchronous iterator of the packets decoded from an
+        iterable or an asynchronous iterable of frames.
+        """
+        from .aiopipeline import map_async
+        return map_async(self, frames)
+
+    def decode_async(self, frame):
+        """
+        Returns an awaitable of the packet decoded from a frame. Waits
+        (without blocking the event loop) while max_pending frames are being
+        decoded.
+        """
+        from .aiopipeline import decode_async
+        return decode_async(self, frame)
+
+    @property
+    def stats(self):
+        with self._lock:
+            elapsed = time.time() - self._started if self._started is not None else 0.0
+            return {
+                "submitted": self.submitted,
+                "decoded": self.decoded,
+                "errors": self.errors,
+                "pending": self.pending,
+                "max_pending": self.max_pending_seen,
+                "rate": self.decoded / elapsed if elapsed > 0 else 0.0,
+            }
+
+    def close(self):
+        if self._owned:
+            self._executor.shutdown(wait=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
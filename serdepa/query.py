@@ -0,0 +1,402 @@
+"""
+query.py: Aggregating fields over large numbers of serialized packets
+without decoding them into packet objects.
+
+    result = aggregate(MyNodes, open("nodes.bin", "rb"),
+                       {"qlty": ["min", "max", "mean", Histogram(0, 256, 16)]},
+                       group_by="nodeId")
+    result[12]["qlty"]["mean"]
+
+The source is read chunk_records records at a time and only the running
+count, sum, minimum, maximum and histogram of every field (per group) are
+kept, so the memory use does not depend on the size of the source.
+
+Fields of fixed size packets are selected by their leaf paths (see
+SerdepaPacket.leaf_fields) and read as columns at their fixed offsets, with a
+NumPy dtype when NumPy is installed and with Struct.iter_unpack otherwise.
+Fields of variable size packets are read from a capture file or an iterable
+of serialized packets without building the packets: at their offsets where
+these are static and after finding where the fields start (reading only the
+Length fields) otherwise.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import struct
+
+from . import serdepa
+from .capture import CaptureReader
+from .dtypes import numpy, int_dtype
+from .exceptions import DeserializeError
+
+
+__author__ = "Raido Pahtma, Kaarel Ratas"
+__license__ = "MIT"
+
+
+REDUCERS = ("count", "sum", "min", "max", "mean")
+
+
+class Histogram(object):
+    """
+    A reducer counting values in bins equal-width bins covering
+    [low, high). Values outside the range are counted in the first or the
+    last bin. Its result is the list of counts.
+    """
+
+    def __init__(self, low, high, bins):
+        if high <= low or bins < 1:
+            raise ValueError("Invalid histogram range {}..{} with {} bins".format(low, high, bins))
+        self.low = low
+        self.high = high
+        self.bins = bins
+
+    def edges(self):
+        """
+        Returns the bins + 1 edges of the bins.
+        """
+        return [self.low + (self.high - self.low) * i / float(self.bins) for i in range(self.bins + 1)]
+
+    def bin(self, value):
+        return min(self.bins - 1, max(0, int((value - self.low) * self.bins // (self.high - self.low))))
+
+    def __repr__(self):
+        return "Histogram({}, {}, {})".format(self.low, self.high, self.bins)
+
+
+class _Stats(object):
+    """
+    The running count, sum, minimum, maximum and histogram of a field.
+    """
+    __slots__ = ("count", "total", "minimum", "maximum", "counts")
+
+    def __init__(self, histogram):
+        self.count = 0
+        self.total = 0
+        self.minimum = None
+        self.maximum = None
+        self.counts = [0] * histogram.bins if histogram else None
+
+    def merge(self, count, total, minimum, maximum):
+        self.count += count
+        self.total += total
+        self.minimum = minimum if self.minimum is None else min(self.minimum, minimum)
+        self.maximum = maximum if self.maximum is None else max(self.maximum, maximum)
+
+    def add(self, values, histogram):
+        self.merge(len(values), sum(values), min(values), max(values))
+        if histogram:
+            for value in values:
+                self.counts[histogram.bin(value)] += 1
+
+    def result(self, reducers):
+        ret = collections.OrderedDict()
+        for reducer in reducers:
+            if isinstance(reducer, Histogram):
+                ret["histogram"] = list(self.counts)
+            elif reducer == "count":
+                ret["count"] = self.count
+            elif reducer == "sum":
+                ret["sum"] = self.total
+            elif reducer == "min":
+                ret["min"] = self.minimum
+            elif reducer == "max":
+                ret["max"] = self.maximum
+            else:
+                ret["mean"] = self.total / float(self.count) if self.count else None
+        return ret
+
+
+class Aggregation(object):
+    """
+    Running aggregates of fields of packet_class packets. fields maps field
+    selectors to lists of reducers: "count", "sum", "min", "max", "mean" or
+    a Histogram. With group_by the aggregates are kept per value of that
+    field. method is "numpy" or "struct", or None for NumPy when it is
+    installed; it only matters for fixed size packets.
+    """
+
+    def __init__(self, packet_class, fields, group_by=None, method=None):
+        self.packet_class = packet_class
+        self.fields = collections.OrderedDict()
+        for name, reducers in fields.items():
+            reducers = [reducers] if isinstance(reducers, (Histogram, type(""), str)) else list(reducers)
+            histograms = [reducer for reducer in reducers if isinstance(reducer, Histogram)]
+            for reducer in reducers:
+                if not isinstance(reducer, Histogram) and reducer not in REDUCERS:
+                    raise ValueError("Unknown reducer {}".format(reducer))
+            if len(histograms) > 1:
+                raise ValueError("Only one Histogram per field, {} has {}".format(name, len(histograms)))
+            self.fields[name] = (reducers, histograms[0] if histograms else None)
+        self.group_by = group_by
+        self._selected = list(self.fields) + ([group_by] if group_by is not None and group_by not in self.fields else [])
+        if packet_class._size is not None:
+            leaves = dict((path, (offset, int_type)) for path, offset, int_type in packet_class.leaf_fields())
+            for name in self._selected:
+                if name not in leaves:
+                    raise ValueError("{} is not an integer field of {}".format(name, packet_class.__name__))
+            self._leaves = [(name, ) + leaves[name] for name in self._selected]
+        self._readers = [_frame_reader(packet_class, name) for name in self._selected]
+        if method is None:
+            method = "numpy" if numpy is not None else "struct"
+        elif method == "numpy" and numpy is None:
+            raise ImportError("NumPy is required for this, install it with 'pip install numpy'.")
+        elif method not in ("numpy", "struct"):
+            raise ValueError("Unknown method {}".format(method))
+        self.method = method
+        self._unpackers = None
+        self._dtype = None
+        self._groups = collections.OrderedDict()
+        self.records = 0
+
+    def _stats(self, key):
+        stats = self._groups.get(key)
+        if stats is None:
+            stats = self._groups[key] = dict((name, _Stats(histogram)) for name, (_, histogram) in self.fields.items())
+        return stats
+
+    def update(self, data):
+        """
+        Adds the records of a buffer of fixed size packets one after another.
+        """
+        size = self.packet_class._size
+        if size is None:
+            raise ValueError("{} does not have a fixed size, use update_frames".format(self.packet_class.__name__))
+        if len(data) % size:
+            raise DeserializeError("{} bytes is not a whole number of {} byte records".format(len(data), size))
+        if not len(data):
+            return
+        if self.method == "numpy":
+            if self._dtype is None:
+                self._dtype = numpy.dtype({
+                    "names": ["f{}".format(i) for i in range(len(self._leaves))],
+                    "formats": [int_dtype(int_type) for _, _, int_type in self._leaves],
+                    "offsets": [offset for _, offset, _ in self._leaves],
+                    "itemsize": size,
+                })
+            records = numpy.frombuffer(data, dtype=self._dtype)
+            columns = [records["f{}".format(i)] for i in range(len(self._leaves))]
+        else:
+            if self._unpackers is None:
+                self._unpackers = _column_structs(self._leaves, size)
+            columns = [None] * len(self._leaves)
+            for unpacker, indices in self._unpackers:
+                unpacked = list(zip(*unpacker.iter_unpack(data))) if hasattr(unpacker, "iter_unpack") else \
+                    list(zip(*[unpacker.unpack_from(data, pos) for pos in range(0, len(data), size)]))
+                for index, column in zip(indices, unpacked):
+                    columns[index] = column
+        self.update_columns(dict(zip(self._selected, columns)))
+
+    def update_frames(self, frames):
+        """
+        Adds the serialized packets in an iterable, reading the selected
+        fields without building the packets.
+        """
+        readers = self._readers
+        columns = [[] for _ in self._selected]
+        try:
+            for frame in frames:
+                for column, read in zip(columns, readers):
+                    column.append(read(frame))
+        except struct.error as e:
+            raise DeserializeError("Invalid length of data!", e)
+        if columns[0]:
+            self.update_columns(dict(zip(self._selected, columns)))
+
+    def update_columns(self, columns):
+        """
+        Adds records given as columns, a dict of field selector -> sequence
+        (or NumPy array) of values.
+        """
+        count = len(columns[self._selected[0]])
+        if not count:
+            return
+        self.records += count
+        if self.method == "numpy":
+            self._update_numpy(dict((name, numpy.asarray(columns[name])) for name in self._selected))
+        elif self.group_by is None:
+            stats = self._stats(None)
+            for name, (_, histogram) in self.fields.items():
+                stats[name].add(columns[name], histogram)
+        else:
+            keys = columns[self.group_by]
+            for name, (_, histogram) in self.fields.items():
+                buckets = collections.defaultdict(list)
+                for key, value in zip(keys, columns[name]):
+                    buckets[key].append(value)
+                for key, values in buckets.items():
+                    self._stats(key)[name].add(values, histogram)
+
+    def _update_numpy(self, columns):
+        if self.group_by is None:
+            keys, starts, order = [None], numpy.array([0]), None
+        else:
+            order = numpy.argsort(columns[self.group_by], kind="stable")
+            sorted_keys = columns[self.group_by][order]
+            starts = numpy.flatnonzero(numpy.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            keys = sorted_keys[starts].tolist()
+        counts = numpy.diff(numpy.r_[starts, len(columns[self._selected[0]])]).tolist()
+        for name, (_, histogram) in self.fields.items():
+            values = columns[name] if order is None else columns[name][order]
+            # 64 bit sums could overflow
+            wide = values.astype(object if values.dtype.itemsize == 8 else numpy.int64)
+            totals = numpy.add.reduceat(wide, starts).tolist()
+            minima = numpy.minimum.reduceat(values, starts).tolist()
+            maxima = numpy.maximum.reduceat(values, starts).tolist()
+            if histogram:
+                bins = numpy.clip(
+                    (wide - histogram.low) * histogram.bins // (histogram.high - histogram.low), 0, histogram.bins - 1
+                ).astype(numpy.intp)
+                group = numpy.repeat(numpy.arange(len(keys)), counts)
+                hist = numpy.bincount(group * histogram.bins + bins, minlength=len(keys) * histogram.bins)
+                hist = hist.reshape(len(keys), histogram.bins).tolist()
+            for i, key in enumerate(keys):
+                stats = self._stats(key)[name]
+                stats.merge(counts[i], totals[i], minima[i], maxima[i])
+                if histogram:
+                    stats.counts = [a + b for a, b in zip(stats.counts, hist[i])]
+
+    def result(self):
+        """
+        Returns {field: {reducer: value}}, or with group_by
+        {group value: {field: {reducer: value}}} ordered by group value.
+        A Histogram is reported as "histogram".
+        """
+        results = dict(
+            (key, collections.OrderedDict(
+                (name, stats[name].result(reducers)) for name, (reducers, _) in self.fields.items()
+            ))
+            for key, stats in self._groups.items()
+        )
+        if self.group_by is None:
+            return results.get(None) or collections.OrderedDict(
+                (name, _Stats(histogram).result(reducers)) for name, (reducers, histogram) in self.fields.items()
+            )
+        return collections.OrderedDict((key, results[key]) for key in sorted(results))
+
+
+def _frame_reader(packet_class, name):
+    """
+    Returns a function reading the integer field name (a leaf path, see
+    Aggregation) of a serialized packet_class packet. Fixed size parts are
+    read at their offsets, the start of a field that follows variable size
+    fields is found with _field_spans. Raises ValueError if name is not an
+    integer field of packet_class.
+    """
+    error = ValueError("{} is not an integer field of {}".format(name, packet_class.__name__))
+    steps = []      # (None, static offset) or (packet class, index of the field)
+    packet, path = packet_class, name
+    while path and _is_packet(packet) and packet._size is None:
+        attr, _, path = path.partition(".")
+        if attr not in packet._fields:
+            raise error
+        layout = packet._offsets[attr]
+        if layout.offset is not None and not layout.terms:
+            steps.append((None, layout.offset))
+        else:
+            steps.append((packet, list(packet._fields).index(attr)))
+        packet = packet._fields[attr][0]
+    if path:    # the rest of the path is in a fixed size packet
+        leaves = dict((leaf, (offset, int_type)) for leaf, offset, int_type in packet.leaf_fields()) \
+            if _is_packet(packet) else {}
+        if path not in leaves:
+            raise error
+        offset, packet = leaves[path]
+        steps.append((None, offset))
+    elif isinstance(packet, (serdepa.Length, serdepa.Checksum)):
+        packet = packet._type.__class__
+    if not (isinstance(packet, type) and issubclass(packet, serdepa.BaseInt)):
+        raise error
+    unpack_from = struct.Struct(packet._format).unpack_from
+    field_spans = serdepa._field_spans
+
+    def read(data):
+        pos = 0
+        for packet, step in steps:
+            pos = pos + step if packet is None else field_spans(packet, data, pos)[step]
+        return unpack_from(data, pos)[0]
+    return read
+
+
+def _is_packet(field_type):
+    return isinstance(field_type, type) and issubclass(field_type, serdepa.SerdepaPacket)
+
+
+def _column_structs(leaves, size):
+    """
+    Returns (Struct, indices) pairs unpacking the selected leaves of a
+    record, one Struct per byte order with pad bytes over the rest.
+    """
+    orders = collections.OrderedDict()
+    for index, (_, offset, int_type) in enumerate(leaves):
+        order = int_type._format[0] if int_type.serialized_size() > 1 else None
+        orders.setdefault(order, []).append((offset, index, int_type))
+    if None in orders and len(orders) > 1:     # single bytes join any byte order
+        singles = orders.pop(None)
+        orders[list(orders)[0]].extend(singles)
+    unpackers = []
+    for order, selected in orders.items():
+        selected.sort()
+        fmt, pos = order or ">", 0
+        for offset, index, int_type in selected:
+            fmt += "{}x".format(offset - pos) if offset > pos else ""
+            fmt += int_type._format[1:]
+            pos = offset + int_type.serialized_size()
+        fmt += "{}x".format(size - pos) if size > pos else ""
+        unpackers.append((struct.Struct(str(fmt)), [index for _, index, _ in selected]))
+    return unpackers
+
+
+def aggregate(packet_class, source, fields, group_by=None, chunk_records=65536, method=None):
+    """
+    Aggregates fields (see Aggregation) over the packet_class packets in
+    source and returns Aggregation.result(). source is a buffer or a file
+    object (or file name) of fixed size packets one after another, a
+    CaptureReader or an iterable of serialized packets. At most
+    chunk_records records are held in memory at once.
+    """
+    aggregation = Aggregation(packet_class, fields, group_by, method)
+    size = packet_class._size
+    if isinstance(source, CaptureReader):
+        for block in range(len(source.blocks)):
+            if size is not None:
+                aggregation.update_columns(source.block_columns(block))
+            else:
+                aggregation.update_frames(source.block_records(block))
+    elif isinstance(source, (bytes, bytearray, memoryview)):
+        if size is None:
+            raise ValueError("{} does not have a fixed size, the records can't be split".format(packet_class.__name__))
+        data = memoryview(source)
+        step = size * chunk_records
+        for pos in range(0, len(data), step):
+            aggregation.update(data[pos:pos + step])
+    elif hasattr(source, "read") or isinstance(source, (type(""), str)):
+        if size is None:
+            raise ValueError("{} does not have a fixed size, the records can't be split".format(packet_class.__name__))
+        fileobj = open(source, "rb") if isinstance(source, (type(""), str)) else source
+        try:
+            while True:
+                data = fileobj.read(size * chunk_records)
+                if not data:
+                    break
+                while len(data) % size:
+                    more = fileobj.read(size - len(data) % size)
+                    if not more:
+                        raise DeserializeError("The data ends with a partial record of {} bytes".format(
+                            len(data) % size
+                        ))
+                    data += more
+                aggregation.update(data)
+        finally:
+            if fileobj is not source:
+                fileobj.close()
+    else:
+        frames = []
+        for frame in source:
+            frames.append(frame)
+            if len(frames) >= chunk_records:
+                aggregation.update_frames(frames)
+                frames = []
+        aggregation.update_frames(frames)
+    return aggregation.result()
@@ -0,0 +1,214 @@
+"""
+ring.py: A shared memory ring buffer of serialized packets for handing
+packets from one process to another without pickling.
+
+    ring = PacketRing(Packet, capacity=1 << 20)        # in the producer
+    ring.put(packet)
+
+    ring = PacketRing.attach(name, Packet)             # in the consumer
+    packet = ring.get()
+
+The shared memory starts with the write index, the read index and the
+capacity, each on a cache line of its own, followed by the data area.
+Records are a 4 byte length and the serialized packet, at most half of the
+capacity, and never wrap around the end of the data area; a length of
+0xFFFFFFFF (or less than 4 bytes left) tells the consumer to continue from
+the start. The indices only grow, the producer alone writes the write index
+and the consumer alone the read index, so one producer and one consumer
+need no locks.
+
+Needs multiprocessing.shared_memory (Python 3.8+).
+"""
+
+from __future__ import unicode_literals
+
+import struct
+import time
+
+try:
+    from multiprocessing import shared_memory, resource_tracker
+except ImportError:
+    shared_memory = None
+
+
+__author__ = "Raido Pahtma, Kaarel Ratas"
+__license__ = "MIT"
+
+
+_INDEX = struct.Struct("<Q")
+_LENGTH = struct.Struct("<I")
+_WRITE, _READ, _CAPACITY, _DATA = 0, 64, 128, 192
+_WRAP = 0xFFFFFFFF
+
+
+class PacketRing(object):
+    """
+    A single producer, single consumer ring buffer of packets in shared
+    memory. decoder is a packet class or a Dispatcher. A new ring of
+    capacity bytes is created unless create is False, in which case the
+    existing ring called name is attached (see attach).
+    """
+
+    def __init__(self, decoder, capacity=1 << 20, name=None, create=True):
+        if shared_memory is None:
+            raise ImportError("PacketRing needs multiprocessing.shared_memory (Python 3.8+).")
+        self.decoder = decoder
+        if create:
+            self._shm = shared_memory.SharedMemory(name=name, create=True, size=_DATA + capacity)
+            self._buf = self._shm.buf
+            self._buf[:_DATA] = bytes(_DATA)
+            _INDEX.pack_into(self._buf, _CAPACITY, capacity)
+        else:
+            self._shm = shared_memory.SharedMemory(name=name)
+            # only the creator should unlink the memory when it exits
+            resource_tracker.unregister(self._shm._name, "shared_memory")
+            self._buf = self._shm.buf
+        self.capacity = _INDEX.unpack_from(self._buf, _CAPACITY)[0]
+        self._write = _INDEX.unpack_from(self._buf, _WRITE)[0]
+        self._read = _INDEX.unpack_from(self._buf, _READ)[0]
+        self._record = None
+
+    @classmethod
+    def attach(cls, name, decoder):
+        """
+        Attaches to the ring called name, created by another process.
+        """
+        return cls(decoder, name=name, create=False)
+
+    @property
+    def name(self):
+        return self._shm.name
+
+    def used(self):
+        """
+        Returns the number of bytes written but not yet read.
+        """
+        return _INDEX.unpack_from(self._buf, _WRITE)[0] - _INDEX.unpack_from(self._buf, _READ)[0]
+
+    def put(self, packet, timeout=None):
+        """
+        Writes a packet, or an already serialized packet, into the ring.
+        Records (the 4 byte length and the packet) can take up at most half
+        of the capacity, larger ones raise ValueError. Waits for the consumer to make room for at most timeout seconds (or
+        forever if None) and returns False if the ring stayed full.
+        """
+        data = packet if isinstance(packet, (bytes, bytearray, memoryview)) else packet.serialize()
+        size = _LENGTH.size + len(data)
+        # a larger record might not fit before the end nor, with the skipped
+        # end counted, after the start even in an empty ring
+        if size > self.capacity // 2:
+            raise ValueError("A record of {} bytes does not fit in a ring of {}, at most {}".format(
+                size, self.capacity, self.capacity // 2
+            ))
+        pos = self._write % self.capacity
+        skip = self.capacity - pos if self.capacity - pos < size else 0
+        end = self._write + skip + size
+        if not self._wait(lambda: end - _INDEX.unpack_from(self._buf, _READ)[0] <= self.capacity, timeout):
+            return False
+        if skip:
+            if skip >= _LENGTH.size:
+                _LENGTH.pack_into(self._buf, _DATA + pos, _WRAP)
+            pos = 0
+        _LENGTH.pack_into(self._buf, _DATA + pos, len(data))
+        self._buf[_DATA + pos + _LENGTH.size:_DATA + pos + size] = data
+        self._write = end
+        _INDEX.pack_into(self._buf, _WRITE, end)     # publishes the record
+        return True
+
+    def peek(self, timeout=0):
+        """
+        Returns a memoryview of the next serialized packet in the shared
+        memory, or None if the ring stays empty for timeout seconds (forever
+        if None). The record is kept until advance() is called.
+        """
+        if self._record is None:
+            if not self._wait(lambda: _INDEX.unpack_from(self._buf, _WRITE)[0] != self._read, timeout):
+                return None
+            pos = self._read % self.capacity
+            left = self.capacity - pos
+            if left < _LENGTH.size or _LENGTH.unpack_from(self._buf, _DATA + pos)[0] == _WRAP:
+                self._read += left
+                pos = 0
+            length = _LENGTH.unpack_from(self._buf, _DATA + pos)[0]
+            start = _DATA + pos + _LENGTH.size
+            self._record = (self._read + _LENGTH.size + length, self._buf[start:start + length])
+        return self._record[1]
+
+    def advance(self):
+        """
+        Frees the record returned by peek(). Views of it must not be used
+        afterwards.
+        """
+        if self._record is not None:
+            end, view = self._record
+            view.release()
+            self._record = None
+            self._read = end
+            _INDEX.pack_into(self._buf, _READ, end)
+
+    def get(self, timeout=0):
+        """
+        Decodes the next packet straight from the shared memory and frees
+        its record. Returns None if the ring stays empty for timeout seconds
+        (forever if None).
+        """
+        view = self.peek(timeout)
+        if view is None:
+            return None
+        try:
+            if hasattr(self.decoder, "decode"):
+                packet = self.decoder.decode(view)
+            else:
+                packet = self.decoder()
+                packet.deserialize(view)
+        finally:
+            self.advance()
+        return packet
+
+    def drain(self):
+        """
+        Yields the packets currently in the ring.
+        """
+        while True:
+            packet = self.get()
+            if packet is None:
+                return
+            yield packet
+
+    @staticmethod
+    def _wait(ready, timeout):
+        if ready():
+            return True
+        if timeout == 0:
+            return False
+        deadline = None if timeout is None else time.time() + timeout
+        delay = 0.0
+        while not ready():
+            if deadline is not None and time.time() >= deadline:
+                return False
+            time.sleep(delay)
+            delay = min(0.001, delay + 0.00005)
+        return True
+
+    def close(self):
+        """
+        Detaches from the shared memory. All views returned by peek() must
+        have been released.
+        """
+        if self._record is not None:
+            self._record[1].release()
+            self._record = None
+        self._buf = None
+        self._shm.close()
+
+    def unlink(self):
+        """
+        Removes the shared memory, called by the process that created it.
+        """
+        self._shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
@@ -0,0 +1,282 @@
+"""
+schema.py: Declarative packet definitions.
+
+Builds SerdepaPacket subclasses from a plain dict schema (as loaded from JSON,
+YAML or similar), for example:
+
+    {
+        "PointStruct": [
+            ["x", "nx_int32"],
+            ["y", "nx_int32"]
+        ],
+        "AnotherPacket": [
+            ["header", "nx_uint8", 1],
+            ["origin", "PointStruct"],
+            ["points", {"type": "Length", "of": "nx_uint8", "field": "data"}],
+            ["data", {"type": "List", "of": "PointStruct"}],
+            ["tail", {"type": "ByteString"}]
+        ]
+    }
+
+A field is a [name, type] or [name, type, default] list or a
+{"name": ..., "type": ..., "default": ...} dict. A type is the name of an
+integer type, the name of another packet in the schema (or in the types
+mapping given to the loader) or a dict with a "type" of Length, List, Array,
+ByteString, CRC16 or CRC32, for example
+
+    ["crc", {"type": "CRC16", "first": "header", "last": "data"}]
+
+Checksums also take the arguments of their types, such as "poly", "init",
+"reflect", "xorout" (CRC16 only) and "int_type" (the name of an integer
+type), for example {"type": "CRC16", "poly": 32773, "reflect": true,
+"int_type": "uint16"} for CRC-16/MODBUS.
+
+compile_schema() validates the schema once and returns a picklable
+LayoutPlan. A saved plan can be loaded and built in another process without
+parsing or validating the schema again. The plan also carries the computed
+layout (offsets, sizes, checksums ...) of every class, so building it does not
+compute them again; it still checks that only the last field has an undefined
+length and that every Length has its field.
+Plan files are pickles, so they must only be loaded from trusted sources.
+"""
+
+from __future__ import unicode_literals
+
+import collections
+import pickle
+
+from . import serdepa
+from .serdepa import SerdepaPacket, SuperSerdepaPacket, BaseInt, Length, List, Array, ByteString, CRC16, CRC32
+from .exceptions import PacketDefinitionError
+
+
+__author__ = "Raido Pahtma, Kaarel Ratas"
+__license__ = "MIT"
+
+
+PLAN_VERSION = 2
+
+# the optional keys of checksum specs, the arguments of the checksum types
+_CRC_KEYS = {
+    "CRC16": ("int_type", "poly", "init", "reflect", "xorout"),
+    "CRC32": ("int_type", ),
+}
+
+
+class LayoutPlan(object):
+    """
+    A validated, picklable description of a set of packet classes.
+
+    The packets attribute is a list of (class name, fields) pairs in
+    dependency order, every field being a (name, type spec[, default]) tuple.
+    The layouts attribute is a list of the computed layouts of the classes in
+    the same order, or None to compute them when building.
+    """
+
+    def __init__(self, packets, version=PLAN_VERSION, layouts=None):
+        self.packets = packets
+        self.version = version
+        self.layouts = layouts
+
+    def build(self, module=None):
+        """
+        Create the packet classes described by this plan. Returns an
+        OrderedDict of class name -> class.
+        """
+        classes = collections.OrderedDict()
+        for i, (name, fields) in enumerate(self.packets):
+            attrs = {
+                '_fields_': [
+                    (field[0], _make_type(field[1], classes)) + tuple(field[2:])
+                    for field in fields
+                ],
+                '_trusted_': True,
+                '_layout_': self.layouts[i] if self.layouts is not None else None,
+                '__module__': module or __name__,
+            }
+            classes[name] = SuperSerdepaPacket(str(name), (SerdepaPacket,), attrs)
+        return classes
+
+    def dump(self, fileobj):
+        pickle.dump(self, fileobj, protocol=pickle.HIGHEST_PROTOCOL)
+
+    def save(self, path):
+        with open(path, 'wb') as f:
+            self.dump(f)
+
+    @classmethod
+    def load(cls, fileobj):
+        """
+        Loads a plan saved with dump(). The file is unpickled, which can run
+        arbitrary code, so it must come from a trusted source.
+        """
+        plan = pickle.load(fileobj)
+        if not isinstance(plan, cls):
+            raise PacketDefinitionError("Not a layout plan: {}".format(type(plan).__name__))
+        if plan.version != PLAN_VERSION:
+            raise PacketDefinitionError(
+                "Unsupported layout plan version {} (expected {})".format(plan.version, PLAN_VERSION)
+            )
+        return plan
+
+    @classmethod
+    def open(cls, path):
+        with open(path, 'rb') as f:
+            return cls.load(f)
+
+    def __eq__(self, other):
+        return isinstance(other, LayoutPlan) and (self.version, self.packets) == (other.version, other.packets)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return "<LayoutPlan of {}>".format(", ".join(name for name, _ in self.packets))
+
+
+def compile_schema(schema, types=None):
+    """
+    Validate a dict schema and compile it into a LayoutPlan. The types mapping
+    can provide already existing packet (or integer) classes by name.
+    Raises PacketDefinitionError if the schema is malformed.
+    """
+    types = dict(types or {})
+    packets = collections.OrderedDict()
+    for name, fields in schema.items():
+        if name in types:
+            raise PacketDefinitionError("Packet {} shadows an existing type.".format(name))
+        if not isinstance(fields, (list, tuple)):
+            raise PacketDefinitionError("The fields of {} must be a list.".format(name))
+        packets[name] = [_normalize_field(field, name, schema, types) for field in fields]
+
+    order = []
+    visiting = set()
+
+    def visit(name):
+        if name in order:
+            return
+        if name in visiting:
+            raise PacketDefinitionError("Packet {} contains itself.".format(name))
+        visiting.add(name)
+        for field in packets[name]:
+            for ref in _references(field[1]):
+                visit(ref)
+        visiting.discard(name)
+        order.append(name)
+
+    for name in packets:
+        visit(name)
+
+    plan = LayoutPlan([(name, packets[name]) for name in order])
+    plan.layouts = [serdepa._layout_of(cls) for cls in _validate(plan)]
+    return plan
+
+
+def load_schema(schema, types=None, module=None):
+    """
+    Build the packet classes of a dict schema. Returns an OrderedDict of
+    class name -> class.
+    """
+    return compile_schema(schema, types).build(module)
+
+
+def _validate(plan):
+    """
+    Run the regular metaclass checks once on every class of the plan. Returns
+    the classes in the order of the plan.
+    """
+    classes = collections.OrderedDict()
+    for name, fields in plan.packets:
+        attrs = {
+            '_fields_': [
+                (field[0], _make_type(field[1], classes)) + tuple(field[2:])
+                for field in fields
+            ],
+            '__module__': __name__,
+        }
+        classes[name] = SuperSerdepaPacket(str(name), (SerdepaPacket,), attrs)
+    return list(classes.values())
+
+
+def _normalize_field(field, packet, schema, types):
+    if isinstance(field, dict):
+        if "name" not in field or "type" not in field:
+            raise PacketDefinitionError("A field needs both a name and a type: {}".format(field))
+        ret = (field["name"], field["type"]) + ((field["default"], ) if "default" in field else ())
+    elif isinstance(field, (list, tuple)) and len(field) in (2, 3):
+        ret = tuple(field)
+    else:
+        raise PacketDefinitionError("A field needs both a name and a type: {}".format(field))
+    return (ret[0], _normalize_type(ret[1], packet, schema, types)) + ret[2:]
+
+
+def _normalize_type(spec, packet, schema, types):
+    if isinstance(spec, dict):
+        kind = spec.get("type")
+        try:
+            if kind == "Length":
+                inner = _normalize_type(spec["of"], packet, schema, types)
+                if inner[0] not in ("int", "class") or (inner[0] == "class" and not issubclass(inner[1], BaseInt)):
+                    raise PacketDefinitionError("A Length must be an integer type in {}: {}".format(packet, spec))
+                return ("Length", inner, spec["field"])
+            elif kind == "List":
+                return ("List", _normalize_type(spec["of"], packet, schema, types))
+            elif kind == "Array":
+                return ("Array", _normalize_type(spec["of"], packet, schema, types), int(spec["length"]))
+            elif kind == "ByteString":
+                length = spec.get("length")
+                return ("ByteString", None if length is None else int(length))
+            elif kind in ("CRC16", "CRC32"):
+                unknown = set(spec) - set(_CRC_KEYS[kind]) - {"type", "first", "last"}
+                if unknown:
+                    raise PacketDefinitionError("Unknown keys {} of a {} in {}".format(
+                        ", ".join(sorted(unknown)), kind, packet
+                    ))
+                options = tuple((key, spec[key]) for key in _CRC_KEYS[kind] if key in spec)
+                if "int_type" in spec and _normalize_type(spec["int_type"], packet, schema, {})[0] != "int":
+                    raise PacketDefinitionError("The int_type of a {} must be an integer type in {}: {}".format(
+                        kind, packet, spec
+                    ))
+                return (kind, spec.get("first"), spec.get("last"), options)
+        except KeyError as e:
+            raise PacketDefinitionError("Missing key {} in {} of {}".format(e, spec, packet))
+        raise PacketDefinitionError("Unknown field type {} in {}".format(kind, packet))
+    if spec in types:
+        return ("class", types[spec])
+    if spec in schema:
+        return ("packet", spec)
+    value = getattr(serdepa, spec, None) if isinstance(spec, type("")) else None
+    if isinstance(value, type) and issubclass(value, BaseInt) and value._format:
+        return ("int", spec)
+    raise PacketDefinitionError("Unknown field type {} in {}".format(spec, packet))
+
+
+def _references(spec):
+    if spec[0] == "packet":
+        yield spec[1]
+    elif spec[0] in ("Length", "List", "Array"):
+        for ref in _references(spec[1]):
+            yield ref
+
+
+def _make_type(spec, classes):
+    kind = spec[0]
+    if kind == "int":
+        return getattr(serdepa, spec[1])
+    elif kind == "packet":
+        return classes[spec[1]]
+    elif kind == "class":
+        return spec[1]
+    elif kind == "Length":
+        return Length(_make_type(spec[1], classes), spec[2])
+    elif kind == "List":
+        return List(_make_type(spec[1], classes))
+    elif kind == "Array":
+        return Array(_make_type(spec[1], classes), spec[2])
+    elif kind in ("CRC16", "CRC32"):
+        options = dict(spec[3] if len(spec) > 3 else ())
+        if "int_type" in options:
+            options["int_type"] = getattr(serdepa, options["int_type"])
+        return (CRC16 if kind == "CRC16" else CRC32)(spec[1], spec[2], **options)
+    else:
+        return ByteString(spec[1])
@@ -7,12 +7,14 @@ from __future__ import unicode_literals
 from functools import reduce
 import struct
 import collections
+import binascii
+import zlib
+import threading
 import warnings
 import copy
 import math
 from codecs import encode
-
-from six import add_metaclass, BytesIO
+from io import BytesIO
 
 from .exceptions import PacketDefinitionError, DeserializeError, SerializeError
 
@@ -21,6 +23,19 @@ __author__ = "Raido Pahtma, Kaarel Ratas"
 __license__ = "MIT"
 
 
+def add_metaclass(metaclass):
+    """
+    Class decorator for creating a class with a metaclass on both Python 2
+    and 3.
+    """
+    def wrapper(cls):
+        attrs = dict(cls.__dict__)
+        attrs.pop("__dict__", None)
+        attrs.pop("__weakref__", None)
+        return metaclass(cls.__name__, cls.__bases__, attrs)
+    return wrapper
+
+
 def add_property(cls, attr, attr_type):
     if hasattr(cls, attr):
         raise PacketDefinitionError(
@@ -43,11 +58,24 @@ def add_property(cls, attr, attr_type):
                     '_field_registry'
                 )[getattr(self, '_depends')[attr]])
 
+        elif isinstance(attr_type, Checksum):
+            setter = None
+
+            def getter(self):
+                data = self.serialize()
+                start = _field_spans(self.__class__, data, 0)[list(self._fields).index(attr)]
+                return struct.unpack_from(attr_type._type._format, data, start)[0]
+
         elif isinstance(attr_type, SuperSerdepaPacket):
             def setter(self, v):
+                if self._frozen_:
+                    raise AttributeError("Cannot assign to {} of a frozen {}".format(attr, cls.__name__))
                 if isinstance(v, self._fields[attr][0]):
                     setattr(self, '_%s' % attr, v)
                     self._field_registry[attr] = v
+                    if self._incremental_:
+                        self._dirty_.add(attr)
+                    self._version_ += 1
                 else:
                     raise ValueError(
                         "Cannot assign a value of type {} "
@@ -58,167 +86,2276 @@ def add_property(cls, attr, attr_type):
                         )
                     )
 
-            def getter(self):
-                return getattr(self, '_%s' % attr)
+            def getter(self):
+                return getattr(self, '_%s' % attr)
+
+        else:
+            def setter(self, v):
+                if self._frozen_:
+                    raise AttributeError("Cannot assign to {} of a frozen {}".format(attr, cls.__name__))
+                setattr(getattr(self, '_%s' % attr), "value", v)
+                if self._incremental_:
+                    self._dirty_.add(attr)
+                self._version_ += 1
+
+            def getter(self):
+                return getattr(self, '_%s' % attr).value
+
+        setattr(cls, attr, property(getter, setter))
+
+
+FieldOffset = collections.namedtuple("FieldOffset", ["name", "offset", "size", "terms"])
+
+
+def _fixed_size(field_type):
+    """
+    Returns the serialized size of a field type if it does not depend on the
+    contents of the field, None otherwise.
+    """
+    if isinstance(field_type, type):
+        if issubclass(field_type, BaseInt):
+            return field_type.serialized_size()
+        return field_type._size
+    elif isinstance(field_type, (Length, Checksum)):
+        return field_type.serialized_size()
+    elif isinstance(field_type, Array):
+        size = _fixed_size(field_type._type)
+        return None if size is None else size * field_type.length
+    elif isinstance(field_type, ByteString) and isinstance(field_type._data_container, Array):
+        return field_type._data_container.length
+    return None
+
+
+def _size_bounds(field_type):
+    """
+    Returns the smallest and the largest serialized size of a field type. The
+    largest size is None if the size is not bounded.
+    """
+    size = _fixed_size(field_type)
+    if size is not None:
+        return size, size
+    elif isinstance(field_type, type):
+        return field_type._minimal_size, field_type._maximal_size
+    elif isinstance(field_type, Array):
+        low, high = _size_bounds(field_type._type)
+        return low * field_type.length, None if high is None else high * field_type.length
+    return 0, None
+
+
+def _element_type(field_type):
+    if isinstance(field_type, ByteString):
+        return field_type._data_container._type
+    return field_type._type
+
+
+def _is_variable(field_type):
+    """
+    Tells if a field type is a List or a ByteString whose length is set by
+    a Length field or by the end of the data.
+    """
+    if isinstance(field_type, ByteString):
+        return isinstance(field_type._data_container, List)
+    return isinstance(field_type, List)
+
+
+def _leaves(field_type, path, offset):
+    if isinstance(field_type, (Length, Checksum)):
+        field_type = field_type._type.__class__
+    if isinstance(field_type, type) and issubclass(field_type, BaseInt):
+        yield path, offset, field_type
+    elif isinstance(field_type, type):
+        for name, layout in field_type._offsets.items():
+            for leaf in _leaves(field_type._fields[name][0], path + "." + name if path else name,
+                                offset + layout.offset):
+                yield leaf
+    else:
+        element = _element_type(field_type)
+        size = _fixed_size(element)
+        for i in range(_fixed_size(field_type) // size):
+            for leaf in _leaves(element, "{}[{}]".format(path, i), offset + i * size):
+                yield leaf
+
+
+def _flatten(field_type, value, default, out):
+    """
+    Appends the integer values of a fixed size field to out in layout order.
+    value can be a field object, a nested packet, a tuple or dict of field
+    values, a sequence for an Array or None for the default value.
+    """
+    if value is None:
+        value = default
+    if isinstance(field_type, Checksum):
+        out.append(0)   # filled in after packing
+    elif isinstance(field_type, type) and issubclass(field_type, BaseInt):
+        out.append(0 if value is None else value._value if isinstance(value, BaseInt) else value)
+    elif isinstance(field_type, type):
+        if isinstance(value, SerdepaPacket):
+            if type(value) is not field_type:
+                raise TypeError("Expected a {} packet, got a {}".format(field_type.__name__, type(value).__name__))
+            for name, (sub_type, _) in field_type._fields.items():
+                _flatten(sub_type, value._field_registry[name], None, out)
+        elif isinstance(value, dict) or value is None:
+            value = value or {}
+            for name, (sub_type, sub_default) in field_type._fields.items():
+                _flatten(sub_type, value.get(name), sub_default, out)
+        else:
+            fields = [(sub_type, sub_default) for name, (sub_type, sub_default) in field_type._fields.items()
+                      if name not in field_type._computed]
+            if len(value) != len(fields):
+                raise SerializeError("{} has {} fields, got {} values".format(
+                    field_type.__name__, len(fields), len(value)
+                ))
+            items = iter(value)
+            for sub_type, sub_default in field_type._fields.values():
+                _flatten(sub_type, None if isinstance(sub_type, Checksum) else next(items), sub_default, out)
+    else:
+        element = _element_type(field_type)
+        length = _fixed_size(field_type) // _fixed_size(element)
+        if isinstance(value, ByteString):
+            value = value._data_container
+        if isinstance(value, BaseIterable):
+            items = list(list.__iter__(value))
+        elif isinstance(value, bytes):
+            items = bytearray(value)
+        else:
+            items = list(value or [])
+        if len(items) > length:
+            raise SerializeError("{} items do not fit in an Array of {}".format(len(items), length))
+        for item in items:
+            _flatten(element, item, None, out)
+        for _ in range(length - len(items)):
+            _flatten(element, None, None, out)
+
+
+def _measure_steps(cls):
+    """
+    Returns the steps SerdepaPacket._measure takes to find the end of a
+    variable size packet: ("skip", size, None), ("length", Struct, List name),
+    ("packet", class, None), ("array", count, element class) and
+    ("items", List name, element size) or ("packets", List name, element class).
+    """
+    steps = []
+    for name, (field_type, _) in cls._fields.items():
+        size = _fixed_size(field_type)
+        if isinstance(field_type, Length):
+            steps.append(("length", struct.Struct(field_type._type._format), field_type._field))
+        elif size is not None:
+            if steps and steps[-1][0] == "skip":
+                steps[-1] = ("skip", steps[-1][1] + size, None)
+            else:
+                steps.append(("skip", size, None))
+        elif isinstance(field_type, type):
+            steps.append(("packet", field_type, None))
+        else:
+            element = _element_type(field_type)
+            if isinstance(field_type, Array):
+                steps.append(("array", field_type.length, element))
+            elif _fixed_size(element) is not None:
+                steps.append(("items", name, _fixed_size(element)))
+            else:
+                steps.append(("packets", name, element))
+    return steps
+
+
+def _unchecked_steps(cls):
+    """
+    Returns the steps of SerdepaPacket._deserialize_unchecked:
+    ("ints", Struct, [(name, is Length), ...]) for runs of integer fields,
+    ("packet", name, None), ("values", name, (Struct format, element size,
+    count)) for Lists, Arrays and ByteStrings of integers, ("items", name,
+    count) for Lists and Arrays of packets and ("field", name, count) for
+    Lists of variable size packets. count is the number of elements of an
+    Array, the name of the Length of a List or None for the last field.
+    """
+    counts = dict((field, length) for length, field in cls._depends.items())
+    steps = []
+    run = []
+
+    def flush():
+        for packer, offset, start, stop in _batch_structs(run):
+            steps.append(("ints", packer, [(name, length) for (name, length), _, _ in run[start:stop]]))
+        del run[:]
+
+    for name, (field_type, _) in cls._fields.items():
+        if isinstance(field_type, (Length, Checksum)):
+            int_type = field_type._type.__class__
+        elif isinstance(field_type, type) and issubclass(field_type, BaseInt):
+            int_type = field_type
+        else:
+            int_type = None
+        if int_type is not None:
+            offset = sum(leaf[2].serialized_size() for leaf in run)
+            run.append(((name, isinstance(field_type, Length)), offset, int_type))
+            continue
+        flush()
+        if isinstance(field_type, type):
+            steps.append(("packet", name, None))
+            continue
+        count = field_type.length if isinstance(field_type, Array) else counts.get(name)
+        if isinstance(field_type, ByteString):
+            container = field_type._data_container
+            count = container.length if isinstance(container, Array) else counts.get(name)
+        element = _element_type(field_type)
+        if issubclass(element, BaseInt):
+            steps.append(("values", name, (element._format, element.serialized_size(), count)))
+        elif isinstance(field_type, Array) or element._size is not None:
+            steps.append(("items", name, count))
+        else:
+            steps.append(("field", name, count))
+    flush()
+    return steps
+
+
+def _validate_steps(cls):
+    """
+    Returns the steps of SerdepaPacket.validate: ("skip", size, None),
+    ("ints", Struct, (name, limit)) for integers and Arrays of integers with
+    limits, ("length", Struct, (List name, limit)), ("packet", class, None),
+    ("array", count, element class) and ("items", List name, (element
+    size, element class or None, limit)) or ("packets", List name,
+    (element class, limit)).
+    """
+    limits = cls._limits_
+    steps = []
+    for name, (field_type, _) in cls._fields.items():
+        size = _fixed_size(field_type)
+        if isinstance(field_type, Length):
+            steps.append(("length", struct.Struct(field_type._type._format), (field_type._field, limits.get(name))))
+        elif name in limits and not _is_variable(field_type):
+            int_type = field_type._type if isinstance(field_type, Array) else field_type
+            count = field_type.length if isinstance(field_type, Array) else 1
+            steps.append(("ints", struct.Struct(str(int_type._format[0] + str(count) + int_type._format[1:])),
+                          (name, limits[name])))
+        elif size is not None and not _has_limits(field_type):
+            if steps and steps[-1][0] == "skip":
+                steps[-1] = ("skip", steps[-1][1] + size, None)
+            else:
+                steps.append(("skip", size, None))
+        elif isinstance(field_type, type):
+            steps.append(("packet", field_type, None))
+        else:
+            element = _element_type(field_type)
+            checked = element if _has_limits(element) or _fixed_size(element) is None else None
+            if isinstance(field_type, Array):
+                steps.append(("array", field_type.length, element))
+            elif _fixed_size(element) is not None:
+                steps.append(("items", name, (_fixed_size(element), checked, limits.get(name))))
+            else:
+                steps.append(("packets", name, (element, limits.get(name))))
+    return steps
+
+
+def _has_limits(field_type):
+    """
+    Tells if a packet class, or the element of a List or Array, has limits
+    (see _compute_limits) of its own or in its nested packets.
+    """
+    if isinstance(field_type, (BaseIterable, ByteString)):
+        field_type = _element_type(field_type)
+    if not isinstance(field_type, type) or issubclass(field_type, BaseInt):
+        return False
+    return bool(field_type._limits_) or any(_has_limits(value) for value, _ in field_type._fields.values())
+
+
+def _check_limit(cls, name, value, limit):
+    if limit is not None and not limit[0] <= value <= limit[1]:
+        raise DeserializeError("{} of {} is {}, not within {} to {}".format(
+            name, cls.__name__, value, limit[0], limit[1]
+        ))
+
+
+def _field_spans(cls, data, pos):
+    """
+    Returns the positions where the fields of the serialized cls packet at
+    pos in data start, followed by its end, reading only the Length fields
+    and the lengths of variable size elements.
+    """
+    if cls._size is not None:
+        return [pos + layout.offset for layout in cls._offsets.values()] + [pos + cls._size]
+    starts = []
+    lengths = {}
+    for name, (field_type, _) in cls._fields.items():
+        starts.append(pos)
+        size = _fixed_size(field_type)
+        if isinstance(field_type, Length):
+            lengths[field_type._field] = struct.unpack_from(field_type._type._format, data, pos)[0]
+            pos += size
+        elif size is not None:
+            pos += size
+        elif isinstance(field_type, type):
+            pos = field_type._measure(data, pos)
+        elif isinstance(field_type, Array):
+            for _ in range(field_type.length):
+                pos = field_type._type._measure(data, pos)
+        elif name not in lengths:
+            pos = max(pos, len(data))   # the last field without a Length takes the rest
+        else:
+            element = _element_type(field_type)
+            if _fixed_size(element) is not None:
+                pos += lengths[name] * _fixed_size(element)
+            else:
+                for _ in range(lengths[name]):
+                    pos = element._measure(data, pos)
+    starts.append(pos)
+    return starts
+
+
+def _batch_structs(leaves):
+    """
+    Returns (Struct, offset, first leaf, last leaf + 1) tuples packing runs of
+    leaves of the same byte order, usually a single Struct for the packet.
+    """
+    runs = []
+    for i, (path, offset, int_type) in enumerate(leaves):
+        # single bytes do not have a byte order and join any run
+        order = None if int_type.serialized_size() == 1 else int_type._format[0]
+        if runs and (order is None or runs[-1][0] in (None, order)):
+            runs[-1][0] = runs[-1][0] or order
+            runs[-1][2] += int_type._format[1:]
+            runs[-1][4] = i + 1
+        else:
+            runs.append([order, offset, int_type._format[1:], i, i + 1])
+    return [
+        (struct.Struct(str((order or ">") + codes)), offset, start, stop)
+        for order, offset, codes, start, stop in runs
+    ]
+
+
+def _is_flat(cls, structs):
+    """
+    Tells if the fields of a fixed size class are all plain integers packed
+    by a single Struct, so its tuples of field values are the Struct values.
+    """
+    return len(structs) == 1 and not cls._computed and \
+        [path for path, _, _ in cls.leaf_fields()] == list(cls._fields)
+
+
+def _shaper(field_type, as_dict):
+    """
+    Returns shape(values, i) -> (value, next i) building the builtin value of
+    a fixed size field from values, the flat tuple of its leaf integers.
+    """
+    if isinstance(field_type, Checksum) or isinstance(field_type, type) and issubclass(field_type, BaseInt):
+        def shape(values, i):
+            return values[i], i + 1
+    elif isinstance(field_type, type):
+        names = [name for name in field_type._fields if name not in field_type._computed]
+        count = len(names)
+        if all(isinstance(sub, type) and issubclass(sub, BaseInt) for sub, _ in field_type._fields.values()):
+            if as_dict:
+                def shape(values, i):
+                    return dict(zip(names, values[i:i + count])), i + count
+            else:
+                def shape(values, i):
+                    return tuple(values[i:i + count]), i + count
+        else:
+            shapes = [
+                (_shaper(sub, as_dict), name in field_type._computed) for name, (sub, _) in field_type._fields.items()
+            ]
+
+            def shape(values, i):
+                out = []
+                for sub, computed in shapes:
+                    value, i = sub(values, i)
+                    if not computed:
+                        out.append(value)
+                return (dict(zip(names, out)) if as_dict else tuple(out)), i
+    else:
+        element = _element_type(field_type)
+        count = _fixed_size(field_type) // _fixed_size(element)
+        if isinstance(field_type, ByteString):
+            def shape(values, i):
+                return bytes(bytearray(values[i:i + count])), i + count
+        elif isinstance(element, type) and issubclass(element, BaseInt):
+            def shape(values, i):
+                return list(values[i:i + count]), i + count
+        else:
+            sub = _shaper(element, as_dict)
+
+            def shape(values, i):
+                out = []
+                for _ in range(count):
+                    value, i = sub(values, i)
+                    out.append(value)
+                return out, i
+    return shape
+
+
+def _fixed_reader(field_type, as_dict):
+    """
+    Returns read(data, pos) -> (value, end) for a fixed size field: its leaf
+    integers are unpacked with the Structs of _batch_structs and shaped.
+    """
+    structs = _batch_structs(list(_leaves(field_type, "", 0)))
+    size = _fixed_size(field_type)
+    shape = _shaper(field_type, as_dict)
+    if len(structs) == 1:
+        unpack_from = structs[0][0].unpack_from
+
+        def read(data, pos):
+            return shape(unpack_from(data, pos), 0)[0], pos + size
+    else:
+        def read(data, pos):
+            values = ()
+            for unpacker, offset, _, _ in structs:
+                values += unpacker.unpack_from(data, pos + offset)
+            return shape(values, 0)[0], pos + size
+    return read
+
+
+def _builtin_reader(cls, as_dict):
+    """
+    Returns read(data, pos) -> (value, end) decoding a cls packet at pos
+    straight into a dict (or tuple) of builtins, without field objects.
+    Length fields are left out, as in SerdepaPacket._assign. The readers
+    are built on first use and kept on the class.
+    """
+    readers = cls.__dict__.get("_builtin_readers")
+    if readers is None:
+        readers = {}
+        setattr(cls, "_builtin_readers", readers)
+    read = readers.get(as_dict)
+    if read is None:
+        read = readers[as_dict] = _fixed_reader(cls, as_dict) if cls._size is not None \
+            else _variable_reader(cls, as_dict)
+    return read
+
+
+def _variable_reader(cls, as_dict):
+    steps = []
+    for name, (field_type, _) in cls._fields.items():
+        if isinstance(field_type, Length):
+            steps.append(("length", struct.Struct(field_type._type._format), field_type._field))
+        elif isinstance(field_type, Checksum):
+            steps.append(("skip", field_type.serialized_size(), None))
+        elif _fixed_size(field_type) is not None:
+            steps.append(("value", _fixed_reader(field_type, as_dict), None))
+        elif isinstance(field_type, type):
+            steps.append(("value", _builtin_reader(field_type, as_dict), None))
+        elif isinstance(field_type, Array):
+            steps.append(("array", field_type.length, _builtin_reader(field_type._type, as_dict)))
+        elif isinstance(field_type, ByteString):
+            steps.append(("bytes", name, None))
+        else:
+            element = field_type._type
+            size = _fixed_size(element)
+            if isinstance(element, type) and issubclass(element, BaseInt):
+                steps.append(("ints", name, (element._format[0], element._format[1:], size)))
+            elif size is not None:
+                steps.append(("items", name, (_fixed_reader(element, as_dict), size)))
+            else:
+                steps.append(("packets", name, _builtin_reader(element, as_dict)))
+    names = [name for name in cls._fields if name not in cls._computed]
+
+    def read(data, pos):
+        lengths = {}
+        out = []
+        for kind, value, extra in steps:
+            if kind == "value":
+                item, pos = value(data, pos)
+                out.append(item)
+            elif kind == "skip":
+                pos += value
+            elif kind == "length":
+                lengths[extra] = value.unpack_from(data, pos)[0]
+                pos += value.size
+            elif kind == "array":
+                items = []
+                for _ in range(value):
+                    item, pos = extra(data, pos)
+                    items.append(item)
+                out.append(items)
+            else:
+                count = lengths.get(value)     # the last field without a Length takes the rest
+                if kind == "bytes":
+                    end = len(data) if count is None else pos + count
+                    if end > len(data):
+                        raise DeserializeError("Invalid length of data to deserialize. {}, {}".format(end, len(data)))
+                    out.append(bytes(data[pos:end]))
+                    pos = end
+                elif kind == "ints":
+                    order, code, size = extra
+                    if count is None:
+                        count = max(0, len(data) - pos) // size
+                    out.append(list(struct.unpack_from(str("{}{}{}".format(order, count, code)), data, pos)))
+                    pos += count * size
+                elif kind == "items":
+                    reader, size = extra
+                    if count is None:
+                        count = max(0, len(data) - pos) // size
+                    items = []
+                    for _ in range(count):
+                        item, pos = reader(data, pos)
+                        items.append(item)
+                    out.append(items)
+                else:
+                    items = []
+                    while len(items) < count if count is not None else pos < len(data):
+                        item, end = extra(data, pos)
+                        if end == pos:
+                            raise DeserializeError("An element of {} has no length".format(value))
+                        items.append(item)
+                        pos = end
+                    out.append(items)
+        return (dict(zip(names, out)) if as_dict else tuple(out)), pos
+    return read
+
+
+def _builtin_value(field, as_dict):
+    """
+    Returns the builtin value of a field object of a packet instance: an
+    int, bytes, a list or, for nested packets, a dict or tuple.
+    """
+    if isinstance(field, BaseInt):
+        return field._value
+    elif isinstance(field, SerdepaPacket):
+        values = [
+            _builtin_value(sub, as_dict) for name, sub in field._field_registry.items() if name not in field._computed
+        ]
+        return dict(zip([name for name in field._fields if name not in field._computed], values)) if as_dict \
+            else tuple(values)
+    elif isinstance(field, ByteString):
+        return bytes(bytearray(_builtin_value(field._data_container, as_dict)))
+    items = list.__getitem__(field, slice(field.length))
+    ints = isinstance(field._type, type) and issubclass(field._type, BaseInt)
+    if ints:
+        values = [item._value for item in items]
+    else:
+        values = [
+            _builtin_reader(field._type, as_dict)(memoryview(item.data)[item.start:item.end], 0)[0]
+            if item.__class__ is _Undecoded else _builtin_value(item, as_dict) for item in items
+        ]
+    for _ in range(field.length - len(values)):     # Arrays are padded with default elements
+        values.append(0 if ints else _builtin_value(field._type(), as_dict))
+    return values
+
+
+def _compute_offsets(fields, depends):
+    """
+    Computes the offset of every field from the start of the packet. The
+    offset of a field is offset + sum(value of length field * element size)
+    over the (length field, element size) pairs in terms. The offset is None
+    when it can't be expressed like that (it follows a List of variable size
+    elements).
+    """
+    lengths = dict((v, k) for k, v in depends.items())
+    offsets = collections.OrderedDict()
+    offset, terms = 0, ()
+    for name, (field_type, _) in fields.items():
+        size = _fixed_size(field_type)
+        offsets[name] = FieldOffset(name, offset, size, terms if offset is not None else None)
+        if offset is None:
+            continue
+        elif size is not None:
+            offset += size
+        elif name in lengths and _fixed_size(_element_type(field_type)) is not None:
+            terms += ((lengths[name], _fixed_size(_element_type(field_type))), )
+        else:
+            offset = None
+    return offsets
+
+
+def _compute_bounds(cls):
+    """
+    Sets the smallest and the largest (None if unbounded) serialized size of a
+    packet class. The largest number of elements of a List is the largest
+    value its Length can hold.
+    """
+    lengths = dict((v, k) for k, v in cls._depends.items())
+    minimal, maximal = 0, 0
+    for name, (field_type, _) in cls._fields.items():
+        low, high = _size_bounds(field_type)
+        if high is None and name in lengths and _is_variable(field_type):
+            high = _size_bounds(_element_type(field_type))[1]
+            if high is not None:
+                high *= cls._fields[lengths[name]][0]._type.value_range()[1]
+        minimal += low
+        maximal = None if maximal is None or high is None else maximal + high
+    cls._minimal_size = minimal
+    cls._maximal_size = maximal
+
+
+def _compute_kinds(cls):
+    """
+    Classifies the fields for incremental serialization. A packet class is
+    tracked if all its fields are integers or tracked packets, so that its
+    setters see every change made to it.
+    """
+    kinds = []
+    for name, (field_type, _) in cls._fields.items():
+        if isinstance(field_type, Length):
+            kinds.append((name, "length"))
+        elif isinstance(field_type, Checksum):
+            kinds.append((name, "checksum"))
+        elif isinstance(field_type, type) and issubclass(field_type, BaseInt):
+            kinds.append((name, "int"))
+        elif isinstance(field_type, type) and field_type._tracked:
+            kinds.append((name, "packet"))
+        elif isinstance(field_type, BaseIterable) and isinstance(field_type._type, type) \
+                and issubclass(field_type._type, SerdepaPacket) and field_type._type._tracked:
+            kinds.append((name, "packets"))
+        else:
+            kinds.append((name, "other"))
+    cls._kinds = kinds
+    cls._nested = [name for name, kind in kinds if kind == "packet"]
+    cls._tracked = all(kind in ("int", "packet", "checksum") for name, kind in kinds)
+
+
+def _compute_checksums(cls):
+    """
+    Sets the checksums of a packet class as (name, Checksum, index of the
+    first field, index of the last field, index of the checksum) tuples,
+    whether it or its nested packets have checksums and the names of the
+    computed (Length and checksum) fields.
+    """
+    names = list(cls._fields)
+    checksums = []
+    for index, (name, (field_type, _)) in enumerate(cls._fields.items()):
+        if not isinstance(field_type, Checksum):
+            continue
+        first = 0 if field_type._first is None else names.index(field_type._first) \
+            if field_type._first in names else None
+        last = index - 1 if field_type._last is None else names.index(field_type._last) \
+            if field_type._last in names else None
+        if first is None or last is None or not 0 <= first <= last < index:
+            raise PacketDefinitionError("The checksum {} of {} must cover fields before it, not {} to {}".format(
+                name, cls.__name__, field_type._first, field_type._last
+            ))
+        checksums.append((name, field_type, first, last, index))
+    nested = False
+    for field_type, _ in cls._fields.values():
+        if isinstance(field_type, (BaseIterable, ByteString)):
+            field_type = _element_type(field_type)
+        if isinstance(field_type, type) and issubclass(field_type, SerdepaPacket):
+            nested = nested or field_type._has_checksums
+    cls._checksums = checksums
+    cls._has_checksums = bool(checksums) or nested
+    cls._computed = frozenset(cls._depends) | frozenset(name for name, _, _, _, _ in checksums)
+
+
+def _compute_limits(cls):
+    """
+    Checks the _limits_ of a packet class: a dict of field name -> (low,
+    high) for integer fields, Arrays of integers and Length fields (their
+    values) and Lists and ByteStrings (their number of elements).
+    """
+    for name, limit in cls._limits_.items():
+        field_type = cls._fields.get(name, (None, ))[0]
+        if isinstance(field_type, Array):
+            field_type = field_type._type
+        if not (isinstance(field_type, (Length, List)) or _is_variable(field_type) or
+                isinstance(field_type, type) and issubclass(field_type, BaseInt)):
+            raise PacketDefinitionError("{} of {} can not have limits".format(name, cls.__name__))
+        if len(limit) != 2 or limit[0] > limit[1]:
+            raise PacketDefinitionError("The limits of {} of {} must be (low, high), not {}".format(
+                name, cls.__name__, limit
+            ))
+
+
+VALIDATIONS = ("unchecked", "checked", "strict")
+
+_LAYOUT_ATTRS = (
+    "_fields", "_depends", "_offsets", "_size", "_fixed_part", "_variable_fields", "_minimal_size",
+    "_maximal_size", "_kinds", "_nested", "_tracked", "_partial_plans", "_peekers", "_checksums",
+    "_has_checksums", "_computed",
+)
+
+# the layout attributes that can be stored in a plan, the rest are rebuilt from the fields
+_PLANNED_ATTRS = (
+    "_offsets", "_size", "_fixed_part", "_variable_fields", "_minimal_size", "_maximal_size", "_kinds",
+    "_nested", "_tracked", "_checksums", "_has_checksums", "_computed",
+)
+
+_compile_lock = threading.RLock()
+
+
+class _NotInPlace(SerializeError):
+    """
+    Raised by SerdepaPacket._patch_write for an update that is valid but
+    can not be written into the serialized packet in place.
+    """
+    pass
+
+
+class _Deferred(object):
+    """
+    Stands in for a layout attribute of a class with _lazy_ = True and
+    compiles the class when the attribute is first used.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def __get__(self, instance, owner):
+        with _compile_lock:
+            if isinstance(owner.__dict__.get(self.name), _Deferred):
+                _compile(owner)
+        return getattr(owner if instance is None else instance, self.name)
+
+
+_DEFERRED = [(name, _Deferred(name)) for name in _LAYOUT_ATTRS]
+
+
+def _compile(cls):
+    """
+    Validates the _fields_ of a packet class, installs the field properties
+    and computes the layout attributes.
+    """
+    attrs = cls.__dict__
+    fields = collections.OrderedDict()
+    depends = dict()
+    if '_fields_' in attrs and attrs.get('_trusted_', False):
+        for field in attrs['_fields_']:
+            name, value = field[0], field[1]
+            add_property(cls, name, value)
+            fields[name] = [value, field[2] if len(field) == 3 else None]
+            if isinstance(value, Length):
+                depends[name] = value._field
+        # the cheap structural checks, so a stale or edited plan can not decode wrongly
+        for name, target in depends.items():
+            if not _is_variable(fields.get(target, [None])[0]):
+                raise PacketDefinitionError("The Length {} of {} has no List or ByteString {}".format(
+                    name, cls.__name__, target
+                ))
+        for name in list(fields)[:-1]:
+            if _is_variable(fields[name][0]) and name not in depends.values():
+                raise PacketDefinitionError("Only the last field can have an undefined length ({} of {})".format(
+                    name, cls.__name__
+                ))
+        if attrs.get('_layout_') is not None:
+            _install_layout(cls, fields, depends, attrs['_layout_'])
+            return
+    elif '_fields_' in attrs:
+        for field in attrs['_fields_']:
+            if len(field) == 2 or len(field) == 3:
+                if len(field) == 2:
+                    default = None
+                elif isinstance(field[1], Length):
+                    raise PacketDefinitionError(
+                        "A Length field can't have a default value: {}".format(
+                            field
+                        )
+                    )
+                elif isinstance(field[1], Checksum):
+                    raise PacketDefinitionError(
+                        "A checksum field can't have a default value: {}".format(
+                            field
+                        )
+                    )
+                else:
+                    default = field[2]
+                name, value = field[0], field[1]
+                add_property(cls, name, value)
+                if name in fields:
+                    raise PacketDefinitionError(
+                        "The field {} appears more than once in {}.".format(
+                            name, cls.__name__
+                        )
+                    )
+                fields[name] = [value, default]
+                if not (
+                            isinstance(value, (SerdepaPacket, BaseField)) or
+                            issubclass(value, (SerdepaPacket, BaseField))
+                ):
+                    raise PacketDefinitionError(
+                        "Invalid type {} of field {} in {}".format(
+                            value.__name__, name, cls.__name__
+                        )
+                    )
+                elif isinstance(value, Length):
+                    depends[name] = value._field
+                elif isinstance(value, (List, ByteString)):
+                    if not (name in depends.values() or field == attrs['_fields_'][-1]):
+                        raise PacketDefinitionError(
+                            "Only the last field can have an undefined length ({} of type {})".format(
+                                name,
+                                type(value)
+                            )
+                        )
+            else:
+                raise PacketDefinitionError("A field needs both a name and a type: {}".format(field))
+
+    # published complete, threads using a lazy class wait for the rest in _Deferred
+    setattr(cls, "_depends", depends)
+    setattr(cls, "_fields", fields)
+    setattr(cls, "_offsets", _compute_offsets(fields, depends))
+    sizes = [layout.size for layout in getattr(cls, "_offsets").values()]
+    setattr(cls, "_size", None if None in sizes else sum(sizes))
+    setattr(cls, "_fixed_part", sum(size for size in sizes if size is not None))
+    setattr(cls, "_variable_fields", [
+        (name, _fixed_size(_element_type(value)) if _is_variable(value) else None)
+        for name, (value, _) in getattr(cls, "_fields").items() if getattr(cls, "_offsets")[name].size is None
+    ])
+    _compute_bounds(cls)
+    _compute_kinds(cls)
+    _compute_checksums(cls)
+    _compute_limits(cls)
+    setattr(cls, "_partial_plans", dict())
+    setattr(cls, "_peekers", dict())
+
+
+def _install_layout(cls, fields, depends, layout):
+    """
+    Installs the layout attributes computed earlier by _layout_of instead of
+    computing them again.
+    """
+    setattr(cls, "_depends", depends)
+    setattr(cls, "_fields", fields)
+    for name, value in layout.items():
+        if name == "_checksums":
+            value = [(field, fields[field][0], first, last, index) for field, first, last, index in value]
+        setattr(cls, name, value)
+    setattr(cls, "_partial_plans", dict())
+    setattr(cls, "_peekers", dict())
+
+
+def _layout_of(cls):
+    """
+    Returns the computed layout attributes of a compiled packet class as a
+    picklable dict, for building the class again with _trusted_ = True and
+    _layout_ = the dict without computing them.
+    """
+    layout = dict((name, getattr(cls, name)) for name in _PLANNED_ATTRS)
+    layout["_checksums"] = [(field, first, last, index) for field, _, first, last, index in layout["_checksums"]]
+    return layout
+
+
+class SuperSerdepaPacket(type):
+    """
+    Metaclass of the SerdepaPacket object. Essentially does the following:
+        Reads the _fields_ attribute of the class and for each 2- or
+        3-tuple entry sets up the properties of the class to the right
+        names. Also checks that each (non-last) List instance has a
+        Length field associated with it.
+
+    Classes that set _trusted_ = True (for example the ones built from a
+    precompiled schema plan) have already been validated, so only the
+    properties are installed for them and the cheap structural checks are
+    run. If they also set _layout_ (see _layout_of) their layout attributes
+    are installed from it instead of being computed.
+
+    Classes that set (or inherit) _lazy_ = True are only registered when
+    they are defined and compiled when they are first used: instantiated,
+    decoded or nested into a class being compiled. This keeps importing
+    modules with many packet classes cheap, but errors in the definition
+    are raised at the first use instead of at import.
+    """
+
+    def __init__(cls, what, bases=None, attrs=None):
+        if getattr(cls, "_lazy_", False) and "_fields_" in attrs:
+            for name, deferred in _DEFERRED:
+                setattr(cls, name, deferred)
+        else:
+            _compile(cls)
+        super(SuperSerdepaPacket, cls).__init__(what, bases, attrs)
+
+
+@add_metaclass(SuperSerdepaPacket)
+class SerdepaPacket(object):
+    """
+    The superclass for any packets. Defining a subclass works as such:
+        class Packet(SerdepaPacket):
+            _fields_ = [
+                ("name", type[, default]),
+                ("name", type[, default]),
+                ...
+            ]
+
+    Has the following public methods:
+    .serialize() -> bytearray
+    .serialize_to(fileobj)
+    .serialize_buffers() -> [buffer, ...]
+    .deserialize(bytearray)         raises ValueError on bad input
+    .freeze()
+    .to_dict() -> dict
+    .to_tuple() -> tuple
+
+    and the class methods
+    .serialize_many(items) -> bytearray
+    .from_dict(dict), .from_tuple(tuple) -> packet
+    .to_dicts(items), .to_tuples(items) -> [dict or tuple, ...]
+    .from_dicts(items), .from_tuples(items) -> [packet, ...]
+    .minimal_size() -> int
+    .maximal_size() -> int or None
+    .size_bounds() -> (int, int or None)
+    .deserialize_fields(data, names) -> tuple
+    .verify(data)                   raises DeserializeError on a bad checksum
+    .validate(data) -> int          raises DeserializeError on bad lengths or limits
+    .peek(data, name) -> value
+    .offset_table() -> [FieldOffset, ...]
+    .field_offset(data, name) -> int
+    .leaf_fields() -> [(path, offset, type), ...]
+    .pool() -> PacketPool
+    .cache() -> DecodeCache
+
+    deserialize() decodes into the existing field objects: nested packets
+    and List elements are reused (also ones assigned or appended by the
+    caller) and Lists are resized in place.
+
+    Validation: deserialize(data, validation=...), or the class attribute
+    _validation_, selects how much the input is checked. "checked" (the
+    default) checks the length of the data after every field. "unchecked"
+    checks the total length against the size bounds once and then decodes
+    runs of integers and Lists of integers with single unpacks, for trusted
+    data such as local captures. "strict" first runs validate(), which also
+    checks that Length fields fit in the data and that the fields named in
+    the class attribute _limits_ = {name: (low, high)} are within their
+    limits: integers and Arrays of integers by value, Lists and ByteStrings
+    by their number of elements.
+
+    Incremental serialization: a class that sets _incremental_ = True keeps
+    the bytes of its last serialize() and only re-encodes the fields that
+    were changed since then, patching them into the previous encoding. A
+    full encode is done when the length of a List changes. Integers and
+    nested packets are tracked through their setters, Lists of nested
+    packets per element; other fields are re-encoded every time.
+
+    Concurrency: serialize(), serialized_size() and str() do not modify the
+    packet (Array padding and Length values are computed on the fly), so a
+    packet that no thread is modifying can be serialized from any number of
+    threads at once. deserialize() and the setters modify the packet and
+    need exclusive access to it, but separate instances, also of the same
+    class, share no state and can be used from different threads. Incremental
+    classes are the exception: their serialize() updates the kept encoding.
+    """
+
+    _incremental_ = False
+    _lazy_ = False
+    _frozen_ = False
+    _validation_ = "checked"
+    _limits_ = {}
+    # the tracking state, instances only get their own when it changes (and _dirty_ if incremental)
+    _version_ = 0
+    _encoded_ = None
+    _dirty_ = frozenset()
+
+    def __init__(self, **kwargs):
+        if self._incremental_:
+            self._dirty_ = set()
+        self._field_registry = collections.OrderedDict()
+        for name, (type_, default) in self._fields.items():
+            if name in kwargs:
+                if issubclass(type_, SerdepaPacket):
+                    self._field_registry[name] = copy.copy(kwargs[name])
+                else:
+                    self._field_registry[name] = type_(initial=copy.copy(kwargs[name]))
+            elif default:
+                self._field_registry[name] = type_(initial=copy.copy(default))
+            else:
+                self._field_registry[name] = type_()
+            setattr(self, '_%s' % name, self._field_registry[name])
+
+    def serialize(self):
+        if self._incremental_:
+            return bytes(self._serialize_incremental())
+        serialized = BytesIO()
+        for name, field in self._field_registry.items():
+            if name in self._depends:
+                serialized.write(
+                    field.serialize(self._field_registry[self._depends[name]].length)
+                )
+            else:
+                serialized.write(field.serialize())
+        ret = serialized.getvalue()
+        serialized.close()
+        if self._checksums:
+            ret = bytes(self._fill_checksums(bytearray(ret), 0, nested=False))
+        return ret
+
+    def _serialize_full(self):
+        encoded = bytearray()
+        segments, snapshots, lengths = [], {}, {}
+        for name, kind in self._kinds:
+            field = self._field_registry[name]
+            start = len(encoded)
+            if kind == "length":
+                encoded += field.serialize(self._field_registry[self._depends[name]].length)
+            else:
+                encoded += field.serialize()
+            if kind == "packet":
+                snapshots[name] = (field, field._revision())
+            elif kind == "packets":
+                snapshots[name] = [(item, item._revision()) for item in list.__iter__(field)]
+            if isinstance(field, (BaseIterable, ByteString)):
+                lengths[name] = len(field)
+            segments.append((name, kind, start, len(encoded)))
+        if self._checksums:
+            self._fill_checksums(encoded, 0, nested=False)
+        self._encoded_ = encoded
+        self._segments_ = segments
+        self._snapshots_ = snapshots
+        self._lengths_ = lengths
+        self._dirty_.clear()
+        return encoded
+
+    def _serialize_incremental(self):
+        encoded = self._encoded_
+        registry = self._field_registry
+        if encoded is None:
+            return self._serialize_full()
+        for name, length in self._lengths_.items():
+            if len(registry[name]) != length:
+                return self._serialize_full()
+        for name, kind, start, end in self._segments_:
+            field = registry[name]
+            if kind == "int":
+                if name in self._dirty_:
+                    struct.pack_into(field._format, encoded, start, field._value)
+            elif kind == "packet":
+                snapshot = (field, field._revision())
+                if self._snapshots_[name] != snapshot:
+                    encoded[start:end] = field.serialize()
+                    self._snapshots_[name] = snapshot
+            elif kind == "packets":
+                snapshots = self._snapshots_[name]
+                size = field._type._size
+                for i, item in enumerate(list.__iter__(field)):
+                    snapshot = (item, item._revision())
+                    if snapshots[i][0] is not item or snapshots[i][1] != snapshot[1]:
+                        encoded[start + i * size:start + (i + 1) * size] = item.serialize()
+                        snapshots[i] = snapshot
+            elif kind == "other":
+                value = field.serialize()
+                if len(value) != end - start:
+                    return self._serialize_full()
+                encoded[start:end] = value
+        if self._checksums:
+            self._fill_checksums(encoded, 0, nested=False)
+        self._dirty_.clear()
+        return encoded
+
+    def _revision(self):
+        """
+        Returns a number that grows whenever the packet or one of its nested
+        packets is modified. Only meaningful for tracked packet classes.
+        """
+        revision = self._version_
+        for name in self._nested:
+            revision += self._field_registry[name]._revision()
+        return revision
+
+    def dirty_fields(self):
+        """
+        Returns the names of the fields assigned to since the packet was last
+        serialized incrementally.
+        """
+        return frozenset(self._dirty_)
+
+    def deserialize(self, data, pos=0, final=True, checksums=True, validation=None):
+        """
+        Decodes the packet from data at pos and returns the position after
+        it. The existing field objects are decoded into: nested packets and
+        the elements of Arrays and of Lists of integers or fixed size packets
+        are reused, so a packet or element the caller assigned or appended
+        earlier is overwritten and stays shared with the caller. Lists of
+        variable size packets get new elements instead. Copy what must be
+        kept before deserializing into the packet again.
+        """
+        validation = validation or self._validation_
+        if validation not in VALIDATIONS:
+            raise ValueError("Unknown validation {}".format(validation))
+        if self._frozen_:
+            raise AttributeError("Cannot deserialize into a frozen {}".format(self.__class__.__name__))
+        if self._incremental_:
+            self._encoded_ = None
+        self._version_ += 1
+        if len(data) - pos < self._minimal_size:
+            raise DeserializeError("Invalid length of data to deserialize. {} bytes left, {} needed.".format(
+                len(data) - pos, self._minimal_size
+            ))
+        if final and self._maximal_size is not None and len(data) - pos > self._maximal_size:
+            raise DeserializeError("Invalid length of data to deserialize. {} bytes left, {} at most.".format(
+                len(data) - pos, self._maximal_size
+            ))
+        if validation == "strict":
+            self.validate(data, pos, final)
+        if checksums and self._has_checksums:
+            # nested packets too: the elements of an IndexedList are only decoded when they are accessed
+            self.verify(data, pos)
+        if validation == "unchecked":
+            return self._deserialize_unchecked(data, pos, final)
+        for i, (name, field) in enumerate(self._field_registry.items()):
+            if pos >= len(data):
+                if _is_variable(field) and name in self._depends.values():
+                    pass    # the Length decides, an empty List is fine
+                elif i == len(self._field_registry) - 1 and isinstance(field, (List, ByteString)):
+                    field._resize(0)
+                    break
+                else:
+                    raise DeserializeError("Invalid length of data to deserialize.")
+            try:
+                if isinstance(field, SerdepaPacket):
+                    pos = field.deserialize(data, pos, False, False)   # verified with this packet
+                else:
+                    pos = field.deserialize(data, pos, False)
+            except AttributeError:
+                for key, value in self._depends.items():
+                    if name == value:
+                        pos = field.deserialize(data, pos, False, self._field_registry[key]._type.value)
+                        break
+                else:
+                    pos = field.deserialize(data, pos, False, -1)
+            if pos > len(data):
+                raise DeserializeError("Invalid length of data to deserialize. {}, {}".format(pos, len(data)))
+        if final and pos != len(data):
+            raise DeserializeError(
+                "After deserialization, {} bytes were left.".format(len(data)-pos+1)
+            )
+        return pos
+
+    def _deserialize_unchecked(self, data, pos, final):
+        """
+        Decodes with the steps of _unchecked_steps: runs of integers with one
+        Struct each and Lists of integers with one unpack, with no checks of
+        the length of the data between the fields.
+        """
+        steps = self.__class__.__dict__.get("_unchecked_steps")
+        if steps is None:
+            steps = _unchecked_steps(self.__class__)
+            setattr(self.__class__, "_unchecked_steps", steps)
+        registry = self._field_registry
+        try:
+            for kind, name, extra in steps:
+                if kind == "ints":
+                    for (field, length), value in zip(extra, name.unpack_from(data, pos)):
+                        (registry[field]._type if length else registry[field])._value = value
+                    pos += name.size
+                elif kind == "packet":
+                    pos = registry[name].deserialize(data, pos, False, False, "unchecked")
+                else:
+                    field = registry[name]
+                    count = extra[2] if kind == "values" else extra
+                    if count.__class__ is not int:
+                        count = -1 if count is None else registry[count]._type._value
+                    if kind == "field":
+                        pos = field.deserialize(data, pos, False, count)
+                        continue
+                    if kind == "values":
+                        fmt, size, _ = extra
+                        if count == -1:
+                            count = (len(data) - pos) // size
+                        values = struct.unpack_from(str("{}{}{}".format(fmt[0], count, fmt[1:])), data, pos)
+                        container = getattr(field, "_data_container", field)
+                        container._resize(count)
+                        for item, value in zip(list.__iter__(container), values):
+                            item._value = value
+                        pos += count * size
+                    else:
+                        if count == -1:
+                            count = (len(data) - pos) // field._type._size
+                        field._resize(count)
+                        for item in list.__iter__(field):
+                            pos = item.deserialize(data, pos, False, False, "unchecked")
+        except struct.error as e:
+            raise DeserializeError("Invalid length of data!", e)
+        if final and pos != len(data):
+            raise DeserializeError("After deserialization, {} bytes were left.".format(len(data) - pos))
+        return pos
+
+    @classmethod
+    def deserialize_fields(cls, data, names, pos=0):
+        """
+        Returns a tuple with the values of the named fields without decoding
+        the rest of the packet. Fields of nested packets are named with a
+        dotted path, such as "origin.x". Fixed size fields are skipped using
+        the precomputed field offsets and List fields using their Length.
+        Integer fields are returned as ints and other fields as the objects
+        the properties of a deserialized packet would return.
+        """
+        names = tuple(names)
+        try:
+            plan = cls._partial_plans[names]
+        except KeyError:
+            plan = cls._partial_plans[names] = cls._partial_plan(names)
+        values = {}
+        try:
+            cls._read_fields(data, pos, plan, values, "")
+        except struct.error as e:
+            raise DeserializeError("Invalid length of data!", e)
+        return tuple(values[name] for name in names)
+
+    @classmethod
+    def _partial_plan(cls, names):
+        wanted = collections.OrderedDict()
+        for name in names:
+            top, _, rest = name.partition(".")
+            if top not in cls._fields:
+                raise ValueError("{} has no field {}".format(cls.__name__, name))
+            field_type = cls._fields[top][0]
+            if rest and not (isinstance(field_type, type) and issubclass(field_type, SerdepaPacket)):
+                raise ValueError("Field {} of {} is not a packet: {}".format(top, cls.__name__, name))
+            wanted.setdefault(top, []).append(rest)
+        lengths = dict((v, k) for k, v in cls._depends.items())
+        steps = []
+        fallback = False
+        for name, (field_type, _) in cls._fields.items():
+            if name not in wanted:
+                continue
+            layout = cls._offsets[name]
+            fallback = fallback or layout.offset is None
+            paths = tuple(path for path in wanted[name] if path)
+            if paths:
+                steps.append((name, layout, field_type._partial_plan(paths), None))
+            if "" in wanted[name]:
+                if isinstance(field_type, (Length, Checksum)):
+                    steps.append((name, layout, None, struct.Struct(field_type._type._format)))
+                elif isinstance(field_type, type) and issubclass(field_type, BaseInt):
+                    steps.append((name, layout, None, struct.Struct(field_type._format)))
+                else:
+                    steps.append((name, layout, None, lengths.get(name)))
+        return names, steps, fallback
+
+    @classmethod
+    def _read_fields(cls, data, pos, plan, values, prefix):
+        names, steps, fallback = plan
+        if fallback:
+            packet = cls()
+            packet.deserialize(data, pos, final=False)
+            for name in names:
+                value = packet
+                for attr in name.split("."):
+                    value = getattr(value, attr)
+                values[prefix + name] = value
+            return
+        lengths = {}
+        for name, layout, subplan, how in steps:
+            offset = cls._position(data, pos, layout, lengths)
+            if subplan is not None:
+                cls._fields[name][0]._read_fields(data, offset, subplan, values, prefix + name + ".")
+            elif isinstance(how, struct.Struct):
+                values[prefix + name] = how.unpack_from(data, offset)[0]
+            else:
+                field = cls._fields[name][0]()
+                if _is_variable(field):
+                    length = -1 if how is None else cls._read_length(data, pos, how, lengths)
+                    end = field.deserialize(data, offset, False, length)
+                else:
+                    end = field.deserialize(data, offset, False)
+                if end > len(data):
+                    raise DeserializeError("Invalid length of data to deserialize. {}, {}".format(end, len(data)))
+                values[prefix + name] = field
+
+    @classmethod
+    def _read_length(cls, data, pos, name, lengths):
+        if name not in lengths:
+            offset = cls._position(data, pos, cls._offsets[name], lengths)
+            lengths[name] = struct.unpack_from(cls._fields[name][0]._type._format, data, offset)[0]
+        return lengths[name]
+
+    @classmethod
+    def _measure(cls, data, pos):
+        """
+        Returns the end of the serialized packet starting at pos in data,
+        reading only the Length fields and, for Lists of variable size
+        packets, the lengths of the elements.
+        """
+        if cls._size is not None:
+            return pos + cls._size
+        steps = cls.__dict__.get("_measure_steps")
+        if steps is None:
+            steps = _measure_steps(cls)
+            setattr(cls, "_measure_steps", steps)
+        lengths = {}
+        try:
+            for kind, value, extra in steps:
+                if kind == "skip":
+                    pos += value
+                elif kind == "length":
+                    lengths[extra] = value.unpack_from(data, pos)[0]
+                    pos += value.size
+                elif kind == "packet":
+                    pos = value._measure(data, pos)
+                elif kind == "array":
+                    for _ in range(value):
+                        pos = extra._measure(data, pos)
+                elif value not in lengths:
+                    return max(pos, len(data))  # the last field without a Length takes the rest
+                elif kind == "items":
+                    pos += lengths[value] * extra
+                else:
+                    for _ in range(lengths[value]):
+                        pos = extra._measure(data, pos)
+        except struct.error as e:
+            raise DeserializeError("Invalid length of data!", e)
+        return pos
+
+    @classmethod
+    def verify(cls, data, pos=0, nested=True):
+        """
+        Checks the checksum fields of the serialized packet at pos in data,
+        and with nested those of its nested packets, without decoding it.
+        Raises DeserializeError if a checksum does not match, so framers can
+        reject corrupted frames before building any packets.
+        """
+        if not cls._has_checksums:
+            return
+        try:
+            starts = _field_spans(cls, data, pos)
+            if starts[-1] > len(data):
+                raise DeserializeError("Invalid length of data to deserialize. {}, {}".format(starts[-1], len(data)))
+            view = memoryview(data)
+            for name, checksum, first, last, index in cls._checksums:
+                stored = struct.unpack_from(checksum._type._format, data, starts[index])[0]
+                computed = checksum.compute(view[starts[first]:starts[last + 1]])
+                if stored != computed:
+                    raise DeserializeError("The checksum {} of {} is {:X}, the data gives {:X}".format(
+                        name, cls.__name__, stored, computed
+                    ))
+            if nested:
+                cls._nested_checksums(data, starts, "verify")
+        except struct.error as e:
+            raise DeserializeError("Invalid length of data!", e)
+
+    @classmethod
+    def validate(cls, data, pos=0, final=True):
+        """
+        Checks the serialized packet at pos in data without decoding it:
+        that the Length fields do not claim more elements than the data
+        holds and that the fields with _limits_, nested packets included,
+        are within them. Returns the end of the packet, which must be the
+        end of data if final is set. Raises DeserializeError.
+        """
+        try:
+            end = cls._validate(data, pos)
+        except struct.error as e:
+            raise DeserializeError("Invalid length of data!", e)
+        if end > len(data) or final and end != len(data):
+            raise DeserializeError("The packet ends at {}, the data at {}".format(end, len(data)))
+        return end
+
+    @classmethod
+    def _validate(cls, data, pos):
+        if cls._size is not None and not _has_limits(cls):
+            return pos + cls._size
+        steps = cls.__dict__.get("_validate_steps")
+        if steps is None:
+            steps = _validate_steps(cls)
+            setattr(cls, "_validate_steps", steps)
+        lengths = {}
+        for kind, value, extra in steps:
+            if kind == "skip":
+                pos += value
+            elif kind == "ints":
+                for item in value.unpack_from(data, pos):
+                    _check_limit(cls, extra[0], item, extra[1])
+                pos += value.size
+            elif kind == "length":
+                lengths[extra[0]] = value.unpack_from(data, pos)[0]
+                _check_limit(cls, extra[0], lengths[extra[0]], extra[1])
+                pos += value.size
+            elif kind == "packet":
+                pos = value._validate(data, pos)
+            elif kind == "array":
+                for _ in range(value):
+                    pos = extra._validate(data, pos)
+            else:
+                count = lengths.get(value)
+                left = len(data) - pos
+                if kind == "items":
+                    size, element, limit = extra
+                    if count is None:   # the last field without a Length takes the rest
+                        if left % size:
+                            raise DeserializeError("{} bytes left for {} of {}, not a whole number of {} byte "
+                                                   "elements".format(left, value, cls.__name__, size))
+                        count = left // size
+                else:
+                    element, limit = extra
+                    size = element.minimal_size()
+                if count is not None and count * size > left:
+                    raise DeserializeError("{} {} of {} need at least {} bytes, {} left".format(
+                        count, value, cls.__name__, count * size, left
+                    ))
+                if count is not None:
+                    _check_limit(cls, value, count, limit)
+                if kind == "items" and element is None:
+                    pos += count * size
+                    continue
+                items = 0
+                while items < count if count is not None else pos < len(data):
+                    end = element._validate(data, pos)
+                    if end == pos:
+                        raise DeserializeError("An element of {} has no length".format(value))
+                    items += 1
+                    pos = end
+                if count is None:
+                    _check_limit(cls, value, items, limit)
+        return pos
+
+    @classmethod
+    def _fill_checksums(cls, data, pos, nested=True):
+        """
+        Writes the checksum fields of the serialized packet at pos in the
+        writable buffer data, those of the nested packets first if nested
+        is set. Returns data.
+        """
+        starts = _field_spans(cls, data, pos)
+        if nested:
+            cls._nested_checksums(data, starts, "_fill_checksums")
+        view = memoryview(data)
+        for name, checksum, first, last, index in cls._checksums:
+            struct.pack_into(
+                checksum._type._format, data, starts[index], checksum.compute(view[starts[first]:starts[last + 1]])
+            )
+        return data
+
+    @classmethod
+    def _nested_checksums(cls, data, starts, method):
+        for index, (field_type, _) in enumerate(cls._fields.values()):
+            if isinstance(field_type, (BaseIterable, ByteString)):
+                element, pos = _element_type(field_type), starts[index]
+                if isinstance(element, type) and issubclass(element, SerdepaPacket) and element._has_checksums:
+                    while pos < starts[index + 1]:
+                        getattr(element, method)(data, pos)
+                        pos = element._measure(data, pos)
+            elif isinstance(field_type, type) and issubclass(field_type, SerdepaPacket) and field_type._has_checksums:
+                getattr(field_type, method)(data, starts[index])
+
+    @classmethod
+    def _position(cls, data, pos, layout, lengths):
+        offset = pos + layout.offset
+        for length_name, size in layout.terms:
+            offset += size * cls._read_length(data, pos, length_name, lengths)
+        return offset
+
+    @classmethod
+    def offset_table(cls):
+        """
+        Returns a list of FieldOffset(name, offset, size, terms) tuples, one
+        for every field. size is None for fields whose size depends on their
+        contents. The position of a field is offset plus, for every
+        (length field, element size) pair in terms, the value of the length
+        field times the element size. For fields after a List of variable
+        size elements both offset and terms are None.
+        """
+        return list(cls._offsets.values())
+
+    @classmethod
+    def leaf_fields(cls):
+        """
+        Returns the integer fields of a fixed size packet as a list of
+        (path, offset, type) tuples, nested packets and Arrays flattened into
+        paths like "data[1].x".
+        """
+        if cls._size is None:
+            raise ValueError("{} does not have a fixed size".format(cls.__name__))
+        leaves = cls.__dict__.get("_leaves")
+        if leaves is None:
+            leaves = list(_leaves(cls, "", 0))
+            setattr(cls, "_leaves", leaves)
+        return leaves
+
+    @classmethod
+    def field_offset(cls, data, name, pos=0):
+        """
+        Returns the position of a field in the serialized packet in data,
+        reading the Length fields its position depends on.
+        """
+        layout = cls._offsets.get(name)
+        if layout is None:
+            raise ValueError("{} has no field {}".format(cls.__name__, name))
+        if layout.offset is None:
+            raise ValueError("The offset of {} in {} depends on the elements of a List".format(name, cls.__name__))
+        try:
+            return cls._position(data, pos, layout, {})
+        except struct.error as e:
+            raise DeserializeError("Invalid length of data!", e)
+
+    @classmethod
+    def peek(cls, data, name, pos=0):
+        """
+        Reads a single field, possibly a dotted path into nested packets, from
+        the serialized packet in data. Integer fields at a static offset are
+        read with a single unpack_from, anything else is read like
+        deserialize_fields would.
+        """
+        try:
+            reader = cls._peekers[name]
+        except KeyError:
+            reader = cls._peekers[name] = cls._peeker(name)
+        try:
+            return reader(data, pos)
+        except struct.error as e:
+            raise DeserializeError("Invalid length of data!", e)
+
+    @classmethod
+    def _peeker(cls, name):
+        packet, offset = cls, 0
+        for attr in name.split("."):
+            layout = getattr(packet, "_offsets", {}).get(attr) if isinstance(packet, type) else None
+            if layout is None or layout.offset is None or layout.terms:
+                break
+            offset += layout.offset
+            packet = packet._fields[attr][0]
+        else:
+            if isinstance(packet, (Length, Checksum)):
+                packet = packet._type.__class__
+            if isinstance(packet, type) and issubclass(packet, BaseInt):
+                unpack_from = struct.Struct(packet._format).unpack_from
+                return lambda data, pos: unpack_from(data, pos + offset)[0]
+        cls._partial_plans[(name, )] = cls._partial_plan((name, ))
+        return lambda data, pos: cls.deserialize_fields(data, (name, ), pos)[0]
+
+    @classmethod
+    def patch(cls, data, updates, pos=0, fallback=False):
+        """
+        Applies a dict of field updates (names can be dotted paths into nested
+        packets) directly to the serialized packet in the writable buffer
+        data and returns data. Integers are written with pack_into, other
+        fields are written in place as long as their size does not change.
+        If an update would change the size of the packet (and therefore a
+        Length), SerializeError is raised, or if fallback is set, the packet
+        is deserialized, updated and a new serialized bytearray is returned.
+        Nothing is written unless all the updates can be applied in place.
+        Integers out of range, and Length updates that do not match the
+        length of their List after the updates, raise SerializeError even
+        with fallback.
+        """
+        if memoryview(data).readonly:
+            raise TypeError("Cannot patch a read-only buffer of type {}".format(type(data).__name__))
+        writes = []
+        moved = None
+        try:
+            for name, value in updates.items():
+                try:
+                    writes.append(cls._patch_write(data, pos, name, value))
+                except _NotInPlace as e:
+                    moved = moved or e  # the other updates are still checked
+        except struct.error as e:
+            raise DeserializeError("Invalid length of data!", e)
+        if moved is not None:
+            if fallback:
+                return cls._patch_fallback(data, updates, pos)
+            raise moved
+        for packer, offset, value in writes:
+            if packer is None:
+                data[offset:offset + len(value)] = value
+            else:
+                packer.pack_into(data, offset, value)
+        if cls._has_checksums:
+            cls._fill_checksums(data, pos)
+        return data
+
+    @classmethod
+    def _patch_write(cls, data, pos, name, value):
+        path = name.split(".")
+        packet, offset = cls, pos
+        for i, attr in enumerate(path):
+            base = offset
+            if not (isinstance(packet, type) and issubclass(packet, SerdepaPacket)) or attr not in packet._fields:
+                raise ValueError("{} has no field {}".format(cls.__name__, name))
+            layout = packet._offsets[attr]
+            if layout.offset is None:
+                raise _NotInPlace("The offset of {} depends on the elements of a List".format(name))
+            offset = packet._position(data, offset, layout, {})
+            parent, packet = packet, packet._fields[attr][0]
+            if i < len(path) - 1 and layout.size is None:
+                raise _NotInPlace("Cannot patch {} of the variable size packet {}".format(name, attr))
+
+        if isinstance(packet, Length):
+            if value != struct.unpack_from(packet._type._format, data, offset)[0]:
+                raise _NotInPlace("Updating {} would change the length of {}".format(name, packet._field))
+            return None, offset, b""
+        elif isinstance(packet, Checksum):
+            raise ValueError("{} is a checksum, it is computed when patching".format(name))
+        elif isinstance(packet, type) and issubclass(packet, BaseInt):
+            low, high = packet.value_range()
+            if not low <= value <= high:
+                raise SerializeError("Value {} of {} is out of range [{}, {}]".format(value, name, low, high))
+            if offset + layout.size > len(data):
+                raise DeserializeError("Invalid length of data to patch. {}, {}".format(offset + layout.size, len(data)))
+            return struct.Struct(packet._format), offset, int(value)
+        elif isinstance(packet, type):
+            if not isinstance(value, packet):
+                raise ValueError("Cannot assign a value of type {} to field {} of type {}".format(
+                    value.__class__.__name__, name, packet.__name__
+                ))
+            encoded = value.serialize()
+            size = layout.size
+        else:
+            field = packet(initial=value)
+            encoded = field.serialize()
+            if layout.size is not None:
+                size = layout.size
+            else:
+                length_name = dict((v, k) for k, v in parent._depends.items()).get(path[-1])
+                if length_name is None:
+                    count = (len(data) - offset) // _fixed_size(_element_type(packet))
+                else:
+                    count = parent._read_length(data, base, length_name, {})
+                size = count * _fixed_size(_element_type(packet))
+        if len(encoded) != size:
+            raise _NotInPlace("Updating {} would change the length of the packet".format(name))
+        if offset + size > len(data):
+            raise DeserializeError("Invalid length of data to patch. {}, {}".format(offset + size, len(data)))
+        return None, offset, encoded
+
+    @classmethod
+    def _patch_fallback(cls, data, updates, pos):
+        packet = cls()
+        packet.deserialize(data, pos, final=False)
+        fields = []
+        for name, value in updates.items():
+            path = name.split(".")
+            parent = packet
+            for attr in path[:-1]:
+                parent = getattr(parent, attr)
+            field_type = parent._fields[path[-1]][0]
+            if isinstance(field_type, Checksum):
+                raise ValueError("{} is a checksum, it is computed when patching".format(name))
+            fields.append((parent, path[-1], field_type, value))
+        for parent, attr, field_type, value in fields:
+            if isinstance(field_type, (BaseIterable, ByteString)):
+                getattr(parent, attr)._set_to(value)
+            elif not isinstance(field_type, Length):
+                setattr(parent, attr, value)
+        for parent, attr, field_type, value in fields:
+            # a Length is computed, an update of it must agree with its List after the updates
+            if isinstance(field_type, Length) and value != len(getattr(parent, field_type._field)):
+                raise SerializeError("Updating {} to {} disagrees with the length {} of {}".format(
+                    attr, value, len(getattr(parent, field_type._field)), field_type._field
+                ))
+        try:
+            return bytearray(packet.serialize())
+        except struct.error as e:
+            raise SerializeError("Cannot apply the updates {}".format(updates), e)
+
+    def _iter_encoded(self, chunk_size=None):
+        """
+        Yields the serialized packet in pieces. Lists of integers are packed in
+        pieces of about chunk_size bytes, or all at once if chunk_size is None.
+        Checksums are computed from the pieces as they are yielded.
+        """
+        ranges = dict((index, (checksum, first, last)) for _, checksum, first, last, index in self._checksums)
+        states = {}
+        for i, (name, field) in enumerate(self._field_registry.items()):
+            for index, (checksum, first, _) in ranges.items():
+                if first == i:
+                    states[index] = checksum.start()
+            if i in ranges:
+                pieces = [struct.pack(field._format, ranges[i][0].finish(states.pop(i)))]
+            else:
+                pieces = self._iter_field(name, field, chunk_size)
+            for piece in pieces:
+                for index, state in list(states.items()):
+                    if i <= ranges[index][2]:
+                        states[index] = ranges[index][0].update(state, piece)
+                yield piece
+
+    def _iter_field(self, name, field, chunk_size):
+        if name in self._depends:
+            yield field.serialize(self._field_registry[self._depends[name]].length)
+        elif isinstance(field, (BaseIterable, SerdepaPacket)):
+            for piece in field._iter_encoded(chunk_size):
+                yield piece
+        elif isinstance(field, ByteString):
+            for piece in field._data_container._iter_encoded(chunk_size):
+                yield piece
+        else:
+            yield field.serialize()
+
+    def serialize_to(self, fileobj, chunk_size=65536):
+        """
+        Writes the serialized packet to a file-like object in chunks of about
+        chunk_size bytes without building the whole encoding in memory.
+        Returns the number of bytes written.
+        """
+        written = 0
+        pending = bytearray()
+        for piece in self._iter_encoded(chunk_size):
+            written += len(piece)
+            if len(piece) >= chunk_size:
+                if pending:
+                    fileobj.write(pending)
+                    pending = bytearray()
+                fileobj.write(piece)
+            else:
+                pending += piece
+                if len(pending) >= chunk_size:
+                    fileobj.write(pending)
+                    pending = bytearray()
+        if pending:
+            fileobj.write(pending)
+        return written
+
+    def serialize_buffers(self, min_size=4096):
+        """
+        Returns the serialized packet as a list of buffers for scatter-gather
+        writes with socket.sendmsg or os.writev. Lists of integers of at least
+        min_size bytes are packed into buffers of their own, the fields
+        between them are joined into one buffer.
+        """
+        buffers = []
+        pending = bytearray()
+        for piece in self._iter_encoded():
+            if len(piece) >= min_size:
+                if pending:
+                    buffers.append(pending)
+                    pending = bytearray()
+                buffers.append(piece)
+            else:
+                pending += piece
+        if pending or not buffers:
+            buffers.append(pending)
+        return buffers
+
+    @classmethod
+    def serialize_many(cls, items, prefix=None, prefix_type=None):
+        """
+        Serializes packets, tuples of field values in field order or dicts of
+        field values one after another into a single bytearray. Fixed size
+        packets are packed into a preallocated buffer with Struct.pack_into,
+        others are encoded through one reused packet. prefix "count" starts
+        the buffer with the number of records and "length" with the length of
+        the records in bytes, encoded as prefix_type (nx_uint32 by default).
+        Packets of other classes raise TypeError.
+        """
+        if prefix not in (None, "count", "length"):
+            raise ValueError("Unknown prefix {}".format(prefix))
+        prefix_type = prefix_type or nx_uint32
+        head = prefix_type.serialized_size() if prefix else 0
+        items = items if isinstance(items, (list, tuple)) else list(items)
+        if cls._size is not None:
+            structs = cls.__dict__.get("_batch_structs")
+            if structs is None:
+                structs = _batch_structs(cls.leaf_fields())
+                setattr(cls, "_batch_structs", structs)
+            flat = _is_flat(cls, structs)
+            buf = bytearray(head + len(items) * cls._size)
+            pos = head
+            try:
+                for item in items:
+                    if flat and isinstance(item, tuple) and len(item) == len(cls._fields):
+                        structs[0][0].pack_into(buf, pos, *item)
+                        pos += cls._size
+                        continue
+                    values = []
+                    _flatten(cls, item, None, values)
+                    for packer, offset, start, stop in structs:
+                        packer.pack_into(buf, pos + offset, *values[start:stop])
+                    pos += cls._size
+            except struct.error as e:
+                raise SerializeError("Invalid value in record {}".format((pos - head) // cls._size), e)
+            if cls._has_checksums:
+                for pos in range(head, len(buf), cls._size):
+                    cls._fill_checksums(buf, pos)
+        else:
+            buf = bytearray(head)
+            packet = cls()
+            for item in items:
+                if type(item) is cls:
+                    buf += item.serialize()
+                elif isinstance(item, SerdepaPacket):
+                    raise TypeError("Expected a {} packet, got a {}".format(cls.__name__, type(item).__name__))
+                else:
+                    packet.reset()
+                    cls._assign(packet, item)
+                    buf += packet.serialize()
+        if prefix:
+            try:
+                struct.pack_into(prefix_type._format, buf, 0, len(items) if prefix == "count" else len(buf) - head)
+            except struct.error as e:
+                raise SerializeError("The {} of the records does not fit in {}".format(prefix, prefix_type.__name__), e)
+        return buf
+
+    @classmethod
+    def _assign(cls, packet, values):
+        """
+        Sets the fields of packet from a tuple of values in field order or a
+        dict of field values. Length fields are skipped.
+        """
+        if not isinstance(values, dict):
+            names = [name for name in cls._fields if name not in cls._computed]
+            if len(values) != len(names):
+                raise SerializeError("{} has {} fields, got {} values".format(cls.__name__, len(names), len(values)))
+            values = dict(zip(names, values))
+        for name, value in values.items():
+            if name not in cls._fields:
+                raise ValueError("{} has no field {}".format(cls.__name__, name))
+            field = packet._field_registry[name]
+            if name in cls._computed:
+                continue
+            elif isinstance(field, SerdepaPacket) and not isinstance(value, SerdepaPacket):
+                field.__class__._assign(field, value)
+            elif isinstance(field, BaseIterable) and issubclass(field._type, SerdepaPacket):
+                items = []
+                for item in value:
+                    if not isinstance(item, field._type):
+                        item, values = field._type(), item
+                        field._type._assign(item, values)
+                    items.append(item)
+                field._set_to(items)
+            elif isinstance(field, (BaseIterable, ByteString)):
+                field._set_to(value)
+            else:
+                setattr(packet, name, value)
+
+    def to_dict(self):
+        """
+        Returns the field values as a dict of builtins: ints, bytes for
+        ByteStrings, lists for Lists and Arrays and dicts for nested packets.
+        Length fields are left out, they follow from the lists.
+        """
+        return _builtin_value(self, True)
+
+    def to_tuple(self):
+        """
+        Returns the field values as a tuple in field order, like to_dict.
+        """
+        return _builtin_value(self, False)
+
+    @classmethod
+    def from_dict(cls, values):
+        """
+        Returns a new packet with the fields set from a dict like the one of
+        to_dict. Missing fields keep their defaults.
+        """
+        if not isinstance(values, dict):
+            raise TypeError("Expected a dict, got {}".format(values.__class__.__name__))
+        packet = cls()
+        cls._assign(packet, values)
+        return packet
+
+    @classmethod
+    def from_tuple(cls, values):
+        """
+        Returns a new packet with the fields set from a tuple like the one of
+        to_tuple.
+        """
+        if isinstance(values, dict):
+            raise TypeError("Expected a tuple, got a dict")
+        packet = cls()
+        cls._assign(packet, values)
+        return packet
+
+    @classmethod
+    def from_dicts(cls, items):
+        """
+        Returns a list of packets built with from_dict.
+        """
+        return [cls.from_dict(values) for values in items]
+
+    @classmethod
+    def from_tuples(cls, items):
+        """
+        Returns a list of packets built with from_tuple.
+        """
+        return [cls.from_tuple(values) for values in items]
+
+    @classmethod
+    def to_dicts(cls, items):
+        """
+        Returns a list with the to_dict values of items: packets, serialized
+        packets, or a single buffer of serialized packets one after another.
+        Serialized packets are decoded straight into builtins with readers
+        built per class, no field objects are created.
+        """
+        return cls._to_builtins(items, True)
+
+    @classmethod
+    def to_tuples(cls, items):
+        """
+        Returns a list with the to_tuple values of items, see to_dicts.
+        """
+        return cls._to_builtins(items, False)
+
+    @classmethod
+    def _to_builtins(cls, items, as_dict):
+        read = _builtin_reader(cls, as_dict)
+        if not isinstance(items, (bytes, bytearray, memoryview)):
+            return [
+                _builtin_value(item, as_dict) if isinstance(item, SerdepaPacket) else cls._read_builtins(item, read)
+                for item in items
+            ]
+        if cls._size is not None:
+            if len(items) % cls._size:
+                raise DeserializeError("{} bytes is not a whole number of {} byte packets".format(
+                    len(items), cls._size
+                ))
+            structs = cls.__dict__.get("_batch_structs")
+            if structs is None:
+                structs = _batch_structs(cls.leaf_fields())
+                setattr(cls, "_batch_structs", structs)
+            if cls._has_checksums:
+                for pos in range(0, len(items), cls._size):
+                    cls.verify(items, pos)
+            if len(structs) == 1 and hasattr(structs[0][0], "iter_unpack") and cls._size:
+                if not as_dict and _is_flat(cls, structs):
+                    return list(structs[0][0].iter_unpack(items))
+                shape = _shaper(cls, as_dict)
+                return [shape(values, 0)[0] for values in structs[0][0].iter_unpack(items)]
+        out = []
+        pos = 0
+        try:
+            while pos < len(items):
+                if cls._has_checksums and cls._size is None:
+                    cls.verify(items, pos)
+                value, end = read(items, pos)
+                if end == pos:
+                    raise DeserializeError("A {} has no length".format(cls.__name__))
+                out.append(value)
+                pos = end
+        except struct.error as e:
+            raise DeserializeError("Invalid length of data!", e)
+        if pos != len(items):
+            raise DeserializeError("The last packet ends after the data, at {} of {}".format(pos, len(items)))
+        return out
+
+    @classmethod
+    def _read_builtins(cls, data, read):
+        cls.verify(data)
+        try:
+            value, end = read(data, 0)
+        except struct.error as e:
+            raise DeserializeError("Invalid length of data!", e)
+        if end != len(data):
+            raise DeserializeError("Invalid length of data to deserialize. {} bytes read of {}.".format(
+                end, len(data)
+            ))
+        return value
+
+    @classmethod
+    def iter_stream(cls, source, chunk=None, read_size=65536):
+        """
+        Decodes a packet whose last field is a List (or ByteString) without a
+        Length lazily from a buffer or a file object. First yields the packet
+        with an empty last field, then the elements of the last field one by
+        one, or if chunk is set, in lists of up to chunk elements (bytes for a
+        ByteString). A file is read read_size bytes at a time, so the memory
+        use does not depend on the size of the packet.
+        """
+        name, (tail, _) = list(cls._fields.items())[-1]
+        element = _element_type(tail) if _is_variable(tail) else None
+        if element is None or name in cls._depends.values() or _fixed_size(element) is None:
+            raise ValueError("The last field of {} is not a List of fixed size elements".format(cls.__name__))
+        size = _fixed_size(element)
+
+        if hasattr(source, "read"):
+            buf = bytearray()
+
+            def ensure(n):
+                while len(buf) < n:
+                    data = source.read(max(n - len(buf), read_size))
+                    if not data:
+                        raise DeserializeError("Invalid length of data to deserialize. {}, {}".format(n, len(buf)))
+                    buf.extend(data)
+        else:
+            buf = source
+
+            def ensure(n):
+                if len(buf) < n:
+                    raise DeserializeError("Invalid length of data to deserialize. {}, {}".format(n, len(buf)))
+
+        lengths = {}
+
+        def position(layout):
+            offset = layout.offset
+            for length_name, element_size in layout.terms:
+                if length_name not in lengths:
+                    length_type = cls._fields[length_name][0]._type
+                    length_offset = position(cls._offsets[length_name])
+                    ensure(length_offset + length_type.serialized_size())
+                    lengths[length_name] = struct.unpack_from(length_type._format, buf, length_offset)[0]
+                offset += lengths[length_name] * element_size
+            return offset
+
+        start = position(cls._offsets[name])
+        ensure(start)
+        header = cls()
+        header.deserialize(bytes(buf[:start]))
+        yield header
+
+        if isinstance(element, type) and issubclass(element, BaseInt):
+            fmt = element._format
+            if isinstance(tail, ByteString) and chunk:
+                def decode_items(data, pos, count):
+                    return bytes(data[pos:pos + count])
+            else:
+                def decode_items(data, pos, count):
+                    return list(struct.unpack_from(str("{}{}{}".format(fmt[0], count, fmt[1:])), data, pos))
+        else:
+            def decode_items(data, pos, count):
+                items = []
+                for i in range(count):
+                    item = element()
+                    item.deserialize(data, pos + i * size, final=False)
+                    items.append(item)
+                return items
+
+        step = chunk or max(1, read_size // size)
+        if hasattr(source, "read"):
+            pending, eof = buf[start:], False
+            while True:
+                while not eof and len(pending) < step * size:
+                    data = source.read(read_size)
+                    pending.extend(data)
+                    eof = not data
+                count = min(step, len(pending) // size)
+                if count == 0:
+                    break
+                items = decode_items(pending, 0, count)
+                del pending[:count * size]
+                if chunk:
+                    yield items
+                else:
+                    for item in items:
+                        yield item
+            left = len(pending)
+        else:
+            pos = start
+            while len(buf) - pos >= size:
+                count = min(step, (len(buf) - pos) // size)
+                items = decode_items(buf, pos, count)
+                pos += count * size
+                if chunk:
+                    yield items
+                else:
+                    for item in items:
+                        yield item
+            left = len(buf) - pos
+        if left:
+            raise DeserializeError("After deserialization, {} bytes were left.".format(left))
+
+    def reset(self):
+        """
+        Sets all the fields back to their default values. The field objects
+        and nested packets are kept, so the packet can be reused for
+        deserializing without allocating a new one.
+        """
+        if self._frozen_:
+            raise AttributeError("Cannot reset a frozen {}".format(self.__class__.__name__))
+        if self._incremental_:
+            self._encoded_ = None
+        self._version_ += 1
+        for name, (type_, default) in self._fields.items():
+            field = self._field_registry[name]
+            if isinstance(field, SerdepaPacket):
+                field.reset()
+            elif isinstance(field, BaseInt):
+                field._set_to(copy.copy(default) if default else 0)
+            elif isinstance(field, (BaseIterable, ByteString)):
+                field._set_to(default or [])
+
+    def freeze(self):
+        """
+        Makes the packet and its nested packets read-only: assigning to
+        fields, deserialize() and reset() raise AttributeError. The contents
+        of Lists are not guarded and must be left alone as well.
+        """
+        self._frozen_ = True
+        for field in self._field_registry.values():
+            if isinstance(field, SerdepaPacket):
+                field.freeze()
+            elif isinstance(field, BaseIterable) and issubclass(field._type, SerdepaPacket):
+                field._materialize()
+                for item in list.__iter__(field):
+                    item.freeze()
+        return self
+
+    def _copy_from(self, other):
+        """
+        Copies the field values of another packet of the same class into
+        this one, which is cheaper than decoding or deepcopy.
+        """
+        if self._incremental_:
+            self._encoded_ = None
+        self._version_ += 1
+        for name, field in other._field_registry.items():
+            if isinstance(field, ByteString):
+                field = field._data_container
+                target = self._field_registry[name]._data_container
+            else:
+                target = self._field_registry[name]
+            if isinstance(field, SerdepaPacket):
+                target._copy_from(field)
+            elif isinstance(field, BaseInt):
+                target._value = field._value
+            elif isinstance(field, BaseIterable):
+                field._materialize()
+                target._materialize()
+                target._resize(len(field))
+                for item, source in zip(list.__iter__(target), list.__iter__(field)):
+                    if isinstance(source, SerdepaPacket):
+                        item._copy_from(source)
+                    else:
+                        item._value = source._value
+        return self
+
+    @classmethod
+    def pool(cls, maxsize=None):
+        """
+        Returns the PacketPool of this class, creating it with maxsize
+        (default 16) on first use. Later calls return the same pool and
+        raise ValueError if they ask for a different maxsize.
+        """
+        pool = cls.__dict__.get("_pool")
+        if pool is None:
+            pool = PacketPool(cls, 16 if maxsize is None else maxsize)
+            setattr(cls, "_pool", pool)
+        elif maxsize is not None and maxsize != pool._maxsize:
+            raise ValueError("The pool of {} already exists with maxsize {}".format(cls.__name__, pool._maxsize))
+        return pool
 
+    @classmethod
+    def cache(cls, maxsize=None, max_bytes=None, copy=None):
+        """
+        Returns the DecodeCache of this class, creating it with the given
+        settings (by default maxsize 1024, no max_bytes and no copy) on first
+        use. Later calls return the same cache and raise ValueError if they
+        ask for different settings.
+        """
+        cache = cls.__dict__.get("_cache")
+        if cache is None:
+            cache = DecodeCache(cls, 1024 if maxsize is None else maxsize, max_bytes, bool(copy))
+            setattr(cls, "_cache", cache)
         else:
-            def setter(self, v):
-                setattr(getattr(self, '_%s' % attr), "value", v)
+            existing = (cache._maxsize, cache._max_bytes, cache._copy)
+            for name, value, current in zip(("maxsize", "max_bytes", "copy"), (maxsize, max_bytes, copy), existing):
+                if value is not None and value != current:
+                    raise ValueError("The cache of {} already exists with {} {}".format(cls.__name__, name, current))
+        return cache
 
-            def getter(self):
-                return getattr(self, '_%s' % attr).value
+    def serialized_size(self):
+        size = self._fixed_part
+        for name, element_size in self._variable_fields:
+            field = self._field_registry[name]
+            size += field.serialized_size() if element_size is None else len(field) * element_size
+        return size
 
-        setattr(cls, attr, property(getter, setter))
+    @classmethod
+    def minimal_size(cls):
+        return cls._minimal_size
 
+    @classmethod
+    def maximal_size(cls):
+        """
+        Returns the largest serialized size of the packet or None if the
+        size is not bounded (the last field is a List without a Length).
+        """
+        return cls._maximal_size
 
-class SuperSerdepaPacket(type):
+    @classmethod
+    def size_bounds(cls):
+        """
+        Returns the smallest and the largest (or None) serialized size, which
+        framers and allocators can use to reject data before decoding.
+        """
+        return cls._minimal_size, cls._maximal_size
+
+    def __str__(self):
+        return encode(self.serialize(), "hex").decode().upper()
+
+    def __eq__(self, other):
+        return str(self) == str(other)
+
+
+class PacketPool(object):
     """
-    Metaclass of the SerdepaPacket object. Essentially does the following:
-        Reads the _fields_ attribute of the class and for each 2- or
-        3-tuple entry sets up the properties of the class to the right
-        names. Also checks that each (non-last) List instance has a
-        Length field associated with it.
+    A bounded pool of reusable packet instances for decode loops:
+
+        pool = Packet.pool()
+        packet = pool.decode(data)
+        ...
+        pool.release(packet)
+
+    Released packets keep their contents until they are deserialized into
+    again or reset().
     """
 
-    def __init__(cls, what, bases=None, attrs=None):
+    def __init__(self, packet_class, maxsize=16):
+        self._class = packet_class
+        self._maxsize = maxsize
+        self._free = []
 
-        setattr(cls, "_fields", collections.OrderedDict())
-        setattr(cls, "_depends", dict())
-        if '_fields_' in attrs:
-            for field in attrs['_fields_']:
-                if len(field) == 2 or len(field) == 3:
-                    if len(field) == 2:
-                        default = None
-                    elif isinstance(field[1], Length):
-                        raise PacketDefinitionError(
-                            "A Length field can't have a default value: {}".format(
-                                field
-                            )
-                        )
-                    else:
-                        default = field[2]
-                    name, value = field[0], field[1]
-                    add_property(cls, name, value)
-                    if name in getattr(cls, "_fields"):
-                        raise PacketDefinitionError(
-                            "The field {} appears more than once in {}.".format(
-                                name, cls.__name__
-                            )
-                        )
-                    getattr(cls, "_fields")[name] = [value, default]
-                    if not (
-                                isinstance(value, (SerdepaPacket, BaseField)) or
-                                issubclass(value, (SerdepaPacket, BaseField))
-                    ):
-                        raise PacketDefinitionError(
-                            "Invalid type {} of field {} in {}".format(
-                                value.__name__, name, cls.__name__
-                            )
-                        )
-                    elif isinstance(value, Length):
-                        getattr(cls, "_depends")[name] = value._field
-                    elif isinstance(value, (List, ByteString)):
-                        if not (name in getattr(cls, "_depends").values() or field == attrs['_fields_'][-1]):
-                            raise PacketDefinitionError(
-                                "Only the last field can have an undefined length ({} of type {})".format(
-                                    name,
-                                    type(value)
-                                )
-                            )
-                else:
-                    raise PacketDefinitionError("A field needs both a name and a type: {}".format(field))
+    def acquire(self):
+        try:
+            return self._free.pop()
+        except IndexError:
+            return self._class()
 
-        super(SuperSerdepaPacket, cls).__init__(what, bases, attrs)
+    def release(self, packet):
+        if len(self._free) < self._maxsize:
+            self._free.append(packet)
 
+    def decode(self, data, pos=0):
+        packet = self.acquire()
+        try:
+            packet.deserialize(data, pos)
+        except Exception:
+            self.release(packet)
+            raise
+        return packet
 
-@add_metaclass(SuperSerdepaPacket)
-class SerdepaPacket(object):
-    """
-    The superclass for any packets. Defining a subclass works as such:
-        class Packet(SerdepaPacket):
-            _fields_ = [
-                ("name", type[, default]),
-                ("name", type[, default]),
-                ...
-            ]
+    def __len__(self):
+        return len(self._free)
 
-    Has the following public methods:
-    .serialize() -> bytearray
-    .deserialize(bytearray)         raises ValueError on bad input
 
-    and the class method
-    .minimal_size() -> int
+class DecodeCache(object):
     """
+    A bounded LRU cache of decoded packets keyed by their serialized bytes,
+    for traffic where the same payloads repeat:
 
-    def __init__(self, **kwargs):
-        self._field_registry = collections.OrderedDict()
-        for name, (type_, default) in self._fields.items():
-            if name in kwargs:
-                if issubclass(type_, SerdepaPacket):
-                    self._field_registry[name] = copy.copy(kwargs[name])
-                else:
-                    self._field_registry[name] = type_(initial=copy.copy(kwargs[name]))
-            elif default:
-                self._field_registry[name] = type_(initial=copy.copy(default))
-            else:
-                self._field_registry[name] = type_()
-            setattr(self, '_%s' % name, self._field_registry[name])
-
-    def serialize(self):
-        serialized = BytesIO()
-        for name, field in self._field_registry.items():
-            if name in self._depends:
-                serialized.write(
-                    field.serialize(self._field_registry[self._depends[name]].length)
-                )
-            else:
-                serialized.write(field.serialize())
-        ret = serialized.getvalue()
-        serialized.close()
-        return ret
+        cache = Packet.cache(maxsize=256)
+        packet = cache.decode(data)
 
-    def deserialize(self, data, pos=0, final=True):
-        for i, (name, field) in enumerate(self._field_registry.items()):
-            if pos >= len(data):
-                if i == len(self._field_registry) - 1 and isinstance(field, (List, ByteString)):
-                    break
-                else:
-                    raise DeserializeError("Invalid length of data to deserialize.")
-            try:
-                pos = field.deserialize(data, pos, False)
-            except AttributeError:
-                for key, value in self._depends.items():
-                    if name == value:
-                        pos = field.deserialize(data, pos, False, self._field_registry[key]._type.value)
-                        break
-                else:
-                    pos = field.deserialize(data, pos, False, -1)
-            if pos > len(data):
-                raise DeserializeError("Invalid length of data to deserialize. {}, {}".format(pos, len(data)))
-        if final and pos != len(data):
-            raise DeserializeError(
-                "After deserialization, {} bytes were left.".format(len(data)-pos+1)
-            )
-        return pos
+    A hit returns the cached packet itself, which is frozen (see
+    SerdepaPacket.freeze) because every hit of the payload shares it, or a
+    copy of it if copy is set. At most maxsize packets and, if max_bytes is
+    set, max_bytes bytes of payloads are kept; larger payloads are decoded
+    but not cached. With maxsize 0 nothing is cached. Not thread safe.
+    """
 
-    def serialized_size(self):
-        size = 0
-        for name, field in self._field_registry.items():
-            size += field.serialized_size()
-        return size
+    def __init__(self, packet_class, maxsize=1024, max_bytes=None, copy=False):
+        self._class = packet_class
+        self._maxsize = maxsize
+        self._max_bytes = max_bytes
+        self._copy = copy
+        self._packets = collections.OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def decode(self, data, pos=0):
+        key = bytes(data[pos:] if pos else data)
+        packet = self._packets.pop(key, None)
+        if packet is None:
+            self.misses += 1
+            packet = self._class()
+            packet.deserialize(key)
+            if self._maxsize <= 0 or self._max_bytes is not None and len(key) > self._max_bytes:
+                return packet
+            packet.freeze()
+            self._bytes += len(key)
+            while self._packets and (
+                len(self._packets) >= self._maxsize or
+                (self._max_bytes is not None and self._bytes > self._max_bytes)
+            ):
+                evicted, _ = self._packets.popitem(last=False)
+                self._bytes -= len(evicted)
+                self.evictions += 1
+        else:
+            self.hits += 1
+        self._packets[key] = packet
+        if self._copy:
+            return self._class()._copy_from(packet)
+        return packet
 
-    @classmethod
-    def minimal_size(cls):
-        size = 0
-        for name, (_type, default) in cls._fields.items():
-            size += _type.minimal_size()
-        return size
+    def clear(self):
+        self._packets.clear()
+        self._bytes = 0
 
-    def __str__(self):
-        return encode(self.serialize(), "hex").decode().upper()
+    @property
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "size": len(self._packets),
+            "bytes": self._bytes,
+        }
 
-    def __eq__(self, other):
-        return str(self) == str(other)
+    def __len__(self):
+        return len(self._packets)
 
 
 class BaseField(object):
@@ -271,10 +2408,40 @@ class BaseIterable(BaseField, list):
 
     def deserialize(self, value, pos, final=True):
         for i in range(self.length):
-            self[i] = self._type()
             pos = self[i].deserialize(value, pos, final=final)
         return pos
 
+    def _iter_encoded(self, chunk_size=None):
+        count = min(len(self), self.length)
+        if issubclass(self._type, BaseInt):
+            fmt = self._type._format
+            step = max(1, chunk_size // self._type.serialized_size()) if chunk_size else max(1, count)
+            for start in range(0, count, step):
+                items = list.__getitem__(self, slice(start, start + step))
+                yield struct.pack(str("{}{}{}".format(fmt[0], len(items), fmt[1:])), *[item._value for item in items])
+        else:
+            for i in range(count):
+                for piece in self[i]._iter_encoded(chunk_size):
+                    yield piece
+        if self.length > count:
+            yield self._padding(self.length - count)
+
+    def _materialize(self):
+        """
+        Makes sure every element is a decoded object, see IndexedList.
+        """
+        pass
+
+    def _resize(self, length):
+        """
+        Grows or shrinks the list in place, keeping the existing elements for reuse.
+        """
+        if len(self) > length:
+            del self[length:]
+        else:
+            for _ in range(len(self), length):
+                super(BaseIterable, self).append(self._type())
+
     def __iter__(self):
         for i in range(len(self)):
             try:
@@ -316,6 +2483,15 @@ class BaseInt(BaseField):
             raise DeserializeError("Invalid length of data!", e)
         return pos + self.serialized_size()
 
+    @classmethod
+    def value_range(cls):
+        """
+        Returns the smallest and the largest value this type can hold.
+        """
+        if cls._signed:
+            return -(1 << (cls._length - 1)), (1 << (cls._length - 1)) - 1
+        return 0, (1 << cls._length) - 1
+
     @classmethod
     def serialized_size(cls):
         """
@@ -354,12 +2530,21 @@ class Length(BaseField):
         self._type = object_type()
         self._field = field_name
 
+    def __call__(self, **kwargs):
+        ret = copy.copy(self)
+        ret._type = self._type.__class__()
+        return ret
+
     def serialized_size(self):
         return self._type.serialized_size()
 
     def serialize(self, length):  # TODO PyCharm does not like this approach, method signatures don't match
-        self._type.value = length
-        return self._type.serialize()
+        try:
+            return struct.pack(self._type._format, length)
+        except struct.error as e:
+            raise SerializeError("Length {} of {} does not fit in {}".format(
+                length, self._field, self._type.__class__.__name__
+            ), e)
 
     def deserialize(self, value, pos, final=True):
         return self._type.deserialize(value, pos, final=final)
@@ -368,6 +2553,135 @@ class Length(BaseField):
         return self.serialized_size()
 
 
+class Checksum(BaseField):
+    """
+    A checksum over the serialized bytes of the fields first to last, which
+    must come before it (by default all the fields before it). serialize()
+    fills it in and deserialize() checks it before decoding any fields,
+    raising DeserializeError on a mismatch. Like a Length it is computed, so
+    it is read-only and left out of tuples and dicts of field values.
+    """
+
+    def __init__(self, int_type, first=None, last=None):
+        self._type = int_type()
+        self._first = first
+        self._last = last
+
+    def __call__(self, **kwargs):
+        return self._type.__class__(**kwargs)
+
+    def serialized_size(self):
+        return self._type.serialized_size()
+
+    def minimal_size(self):
+        return self.serialized_size()
+
+    def start(self):
+        """
+        Returns the initial state of a running checksum.
+        """
+        raise NotImplementedError()
+
+    def update(self, state, data):
+        """
+        Returns the state after adding the bytes in data.
+        """
+        raise NotImplementedError()
+
+    def finish(self, state):
+        """
+        Returns the checksum of a final state.
+        """
+        return state
+
+    def compute(self, data):
+        """
+        Returns the checksum of the bytes in data.
+        """
+        return self.finish(self.update(self.start(), data))
+
+
+class CRC16(Checksum):
+    """
+    A table-driven CRC-16, by default CRC-16/CCITT-FALSE (poly 0x1021, init
+    0xFFFF) stored as an nx_uint16. reflect selects the bit-reversed
+    variants, for example CRC16(poly=0x8005, reflect=True) is CRC-16/MODBUS.
+    """
+
+    _tables = {}
+
+    def __init__(self, first=None, last=None, int_type=None, poly=0x1021, init=0xFFFF, reflect=False, xorout=0):
+        int_type = int_type or nx_uint16
+        if int_type.serialized_size() != 2 or int_type._signed:
+            raise PacketDefinitionError("A CRC16 must be stored in an unsigned 16 bit type, not {}".format(
+                int_type.__name__
+            ))
+        super(CRC16, self).__init__(int_type, first, last)
+        self._poly = poly
+        self._init = init
+        self._reflect = reflect
+        self._xorout = xorout
+        self._table = self._make_table(poly, reflect)
+
+    @classmethod
+    def _make_table(cls, poly, reflect):
+        table = cls._tables.get((poly, reflect))
+        if table is None:
+            table = []
+            divisor = int("{:016b}".format(poly)[::-1], 2) if reflect else poly
+            for byte in range(256):
+                crc = byte if reflect else byte << 8
+                for _ in range(8):
+                    if reflect:
+                        crc = (crc >> 1) ^ divisor if crc & 1 else crc >> 1
+                    else:
+                        crc = ((crc << 1) ^ divisor if crc & 0x8000 else crc << 1) & 0xFFFF
+                table.append(crc)
+            table = cls._tables[(poly, reflect)] = tuple(table)
+        return table
+
+    def start(self):
+        return self._init
+
+    def update(self, state, data):
+        if self._poly == 0x1021 and not self._reflect:
+            return binascii.crc_hqx(data, state)    # the same CRC, computed in C
+        table = self._table
+        if self._reflect:
+            for byte in bytearray(data):
+                state = (state >> 8) ^ table[(state ^ byte) & 0xFF]
+        else:
+            for byte in bytearray(data):
+                state = ((state << 8) & 0xFFFF) ^ table[(state >> 8) ^ byte]
+        return state
+
+    def finish(self, state):
+        return state ^ self._xorout
+
+
+class CRC32(Checksum):
+    """
+    The CRC-32 of zlib (and Ethernet, PNG, ...) stored as an nx_uint32.
+    """
+
+    def __init__(self, first=None, last=None, int_type=None):
+        int_type = int_type or nx_uint32
+        if int_type.serialized_size() != 4 or int_type._signed:
+            raise PacketDefinitionError("A CRC32 must be stored in an unsigned 32 bit type, not {}".format(
+                int_type.__name__
+            ))
+        super(CRC32, self).__init__(int_type, first, last)
+
+    def start(self):
+        return 0
+
+    def update(self, state, data):
+        return zlib.crc32(data, state)
+
+    def finish(self, state):
+        return state & 0xFFFFFFFF
+
+
 class List(BaseIterable):
     """
     An array with its length defined elsewhere.
@@ -382,25 +2696,181 @@ class List(BaseIterable):
         return len(self)
 
     def serialized_size(self):
-        return self._type.serialized_size() * self.length
+        size = _fixed_size(self._type)
+        if size is None:
+            return sum(item.serialized_size() for item in list.__iter__(self))
+        return size * self.length
 
     def deserialize(self, value, pos, final=True, length=None):
         if length is None:
             raise AttributeError("Unknown length.")
         elif length == -1:
-            del self[:]     # clear the internal list - deserialization will overwrite anyway.
-            for i in range(len(self), (len(value)-pos)//self._type().serialized_size()):
-                self.append(0)
+            self._resize((len(value)-pos)//(_fixed_size(self._type) or self._type().serialized_size()))
             return super(List, self).deserialize(value, pos, final=final)
         else:
-            del self[:]     # clear the internal list - deserialization will overwrite anyway.
-            for i in range(len(self), length):
-                self.append(0)
+            self._resize(length)
             return super(List, self).deserialize(value, pos, final=final)
 
     def minimal_size(cls):
         return 0
 
+    def __call__(self, **kwargs):
+        if isinstance(self._type, type) and issubclass(self._type, SerdepaPacket) and self._type._size is None:
+            ret = IndexedList(self._type)
+            if "initial" in kwargs:
+                ret._set_to(kwargs["initial"])
+            return ret
+        return super(List, self).__call__(**kwargs)
+
+
+class _Undecoded(object):
+    """
+    An element of an IndexedList that has not been decoded yet: the bytes
+    data[start:end].
+    """
+    __slots__ = ("data", "start", "end")
+
+    def __init__(self, data, start, end):
+        self.data = data
+        self.start = start
+        self.end = end
+
+
+class IndexedList(List):
+    """
+    The List of variable size packets of a packet instance. deserialize()
+    finds where the elements start in a single pass that reads only their
+    Length fields and keeps a copy of their bytes. An element is decoded
+    when it is first accessed, so packet.items[i] decodes only element i,
+    and elements that were never accessed are serialized by copying their
+    original bytes.
+    """
+
+    def deserialize(self, value, pos, final=True, length=None):
+        if length is None:
+            raise AttributeError("Unknown length.")
+        start = pos
+        ends = []
+        while (len(ends) < length) if length != -1 else (pos < len(value)):
+            end = self._type._measure(value, pos)
+            if end > len(value) or end == pos:
+                raise DeserializeError("Invalid length of data to deserialize. {}, {}".format(end, len(value)))
+            ends.append(end - start)
+            pos = end
+        data = bytes(value[start:pos])
+        del self[:]
+        list.extend(self, [_Undecoded(data, begin, end) for begin, end in zip([0] + ends, ends)])
+        return pos
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        item = list.__getitem__(self, index)
+        if item.__class__ is _Undecoded:
+            packet = self._type()
+            packet.deserialize(memoryview(item.data)[item.start:item.end])
+            list.__setitem__(self, index, packet)
+            return packet
+        return item
+
+    def _materialize(self):
+        for i in range(len(self)):
+            self[i]
+
+    def _set_to(self, values):
+        del self[:]     # without decoding the elements like pop() would
+        for value in values:
+            self.append(value)
+
+    # the list methods that would otherwise return or compare undecoded elements
+
+    def pop(self, index=-1):
+        self[index]
+        return list.pop(self, index)
+
+    def __reversed__(self):
+        for i in reversed(range(len(self))):
+            yield self[i]
+
+    def __contains__(self, value):
+        self._materialize()
+        return list.__contains__(self, value)
+
+    def index(self, value, *args):
+        self._materialize()
+        return list.index(self, value, *args)
+
+    def count(self, value):
+        self._materialize()
+        return list.count(self, value)
+
+    def remove(self, value):
+        self._materialize()
+        list.remove(self, value)
+
+    def copy(self):
+        self._materialize()
+        return list(list.__iter__(self))
+
+    def __add__(self, other):
+        self._materialize()
+        return list.__add__(self, other)
+
+    def __mul__(self, count):
+        self._materialize()
+        return list.__mul__(self, count)
+
+    __rmul__ = __mul__
+
+    def __repr__(self):
+        self._materialize()
+        return list.__repr__(self)
+
+    def serialize(self):
+        ret = bytearray()
+        run = None      # consecutive undecoded elements are copied at once
+        for item in list.__iter__(self):
+            if item.__class__ is _Undecoded:
+                if run is not None and run[0] is item.data and run[2] == item.start:
+                    run[2] = item.end
+                    continue
+                if run is not None:
+                    ret += memoryview(run[0])[run[1]:run[2]]
+                run = [item.data, item.start, item.end]
+            else:
+                if run is not None:
+                    ret += memoryview(run[0])[run[1]:run[2]]
+                    run = None
+                ret += item.serialize()
+        if run is not None:
+            ret += memoryview(run[0])[run[1]:run[2]]
+        return ret
+
+    def _iter_encoded(self, chunk_size=None):
+        for item in list.__iter__(self):
+            if item.__class__ is _Undecoded:
+                yield item.data[item.start:item.end]
+            else:
+                for piece in item._iter_encoded(chunk_size):
+                    yield piece
+
+    def serialized_size(self):
+        return sum(
+            item.end - item.start if item.__class__ is _Undecoded else item.serialized_size()
+            for item in list.__iter__(self)
+        )
+
+    def __eq__(self, other):
+        self._materialize()
+        if isinstance(other, BaseIterable):
+            other._materialize()
+        return list.__eq__(self, other)
+
+    def __ne__(self, other):
+        return not self == other
+
+    __hash__ = None
+
 
 class Array(BaseIterable):
     """
@@ -417,26 +2887,38 @@ class Array(BaseIterable):
         return self._length
 
     def serialized_size(self):
-        return self._type.serialized_size() * self.length
+        size = _fixed_size(self._type)
+        if size is None:
+            size = sum(self[i].serialized_size() for i in range(min(len(self), self.length)))
+            return size + max(0, self.length - len(self)) * self._type().serialized_size()
+        return size * self.length
 
     def serialize(self):
         dl = self.length - len(self)
         if dl < 0:
             warnings.warn(RuntimeWarning("The number of items in the Array exceeds the length of the array."))
-        elif dl > 0:
-            self += [self._type() for _ in range(dl)]  # TODO is this correct???
-        ret = super(Array, self).serialize()
-        for i in range(dl):
-            self.pop(-1)
+            return super(Array, self).serialize()
+        ret = bytearray()
+        for item in list.__iter__(self):
+            ret += item.serialize()
+        if dl > 0:
+            ret += self._padding(dl)
         return ret
 
+    def _padding(self, count):
+        """
+        Returns the encoding of count default elements, zero bytes for integers.
+        """
+        if issubclass(self._type, BaseInt):
+            return bytearray(self._type.serialized_size() * count)
+        return self._type().serialize() * count
+
     def deserialize(self, value, pos, final=True):
-        for i in range(len(self), self.length):
-            self.append(self._type())
+        self._resize(self.length)
         return super(Array, self).deserialize(value, pos, final=final)
 
     def minimal_size(self):
-        return self.serialized_size()
+        return _size_bounds(self)[0]
 
 
 class ByteString(BaseField):
@@ -451,6 +2933,13 @@ class ByteString(BaseField):
             self._data_container = List(nx_uint8)
         super(ByteString, self).__init__(**kwargs)
 
+    def __call__(self, **kwargs):
+        ret = copy.copy(self)
+        ret._data_container = self._data_container()
+        if "initial" in kwargs:
+            ret._set_to(kwargs["initial"])
+        return ret
+
     def __getattr__(self, attr):
         if attr not in ['_data_container']:
             return getattr(self._data_container, attr)
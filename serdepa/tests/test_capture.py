@@ -0,0 +1,118 @@
+"""test_capture.py: Tests for capture files. """
+
+import io
+import random
+import unittest
+import zlib
+
+from serdepa import SerdepaPacket
+from serdepa.capture import CaptureWriter, CaptureReader
+from serdepa.dtypes import numpy
+from serdepa.exceptions import DeserializeError
+
+from .test_serdepa import MyNodes, OnePacket, ArrayPacket, PointStruct
+
+
+class Nothing(SerdepaPacket):
+    _fields_ = []
+
+
+def nodes(count, seed=1):
+    rng = random.Random(seed)
+    return [
+        MyNodes(nodeId=rng.randint(0, 40), attr=-1, inQlty=rng.randint(0, 255), outQlty=3,
+                qlty=rng.randint(0, 255), lifetime=i % 256)
+        for i in range(count)
+    ]
+
+
+class CaptureTester(unittest.TestCase):
+
+    def write(self, packets, packet_class=MyNodes, **kwargs):
+        f = io.BytesIO()
+        with CaptureWriter(f, packet_class, **kwargs) as writer:
+            writer.write_many(packets)
+        return f
+
+    def test_fixed_round_trip(self):
+        packets = nodes(1000)
+        for compression in ("zlib", "lzma", None):
+            f = self.write(packets, block_records=300, compression=compression)
+            reader = CaptureReader(f, MyNodes)
+            self.assertEqual(len(reader), 1000)
+            self.assertEqual([block.count for block in reader.blocks], [300, 300, 300, 100])
+            self.assertEqual(list(reader), packets)
+
+    def test_random_access(self):
+        packets = nodes(1000)
+        reader = CaptureReader(self.write(packets, block_records=128), MyNodes)
+        for i in (0, 127, 128, 999, 500, -1):
+            self.assertEqual(reader[i], packets[i])
+        self.assertEqual(reader.block_of(300), 2)
+        with self.assertRaises(IndexError):
+            reader[1000]
+
+    def test_columnar_compresses_better(self):
+        packets = nodes(4096)
+        f = self.write(packets)
+        raw = zlib.compress(b"".join(packet.serialize() for packet in packets))
+        self.assertLess(len(f.getvalue()), len(raw))
+
+    def test_columns(self):
+        packets = nodes(10)
+        reader = CaptureReader(self.write(packets), MyNodes)
+        columns = reader.block_columns(0)
+        self.assertEqual(list(columns), ["nodeId", "attr", "inQlty", "outQlty", "qlty", "lifetime"])
+        self.assertEqual(columns["qlty"], tuple(packet.qlty for packet in packets))
+        self.assertEqual(columns["attr"], (-1, ) * 10)
+
+    @unittest.skipIf(numpy is None, "NumPy is not installed")
+    def test_numpy(self):
+        packets = [ArrayPacket(header=i) for i in range(5)]
+        packets[3].data.append(PointStruct(x=-3, y=4))
+        reader = CaptureReader(self.write(packets, packet_class=ArrayPacket), ArrayPacket)
+        array = reader.block_array(0)
+        self.assertEqual(list(array["header"]), [0, 1, 2, 3, 4])
+        self.assertEqual(array["data"]["x"][3][0], -3)
+        self.assertEqual(array["data"]["y"][3][0], 4)
+
+    def test_variable_size(self):
+        packets = []
+        for i in range(50):
+            packet = OnePacket(header=i, timestamp=i * 1000)
+            for j in range(i % 7):
+                packet.data.append(j)
+            packets.append(packet)
+        reader = CaptureReader(self.write(packets, packet_class=OnePacket, block_records=16), OnePacket)
+        self.assertEqual(list(reader), packets)
+        self.assertEqual(reader[33], packets[33])
+        with self.assertRaises(ValueError):
+            reader.block_columns(0)
+
+    def test_invalid(self):
+        f = self.write(nodes(3))
+        with self.assertRaises(DeserializeError):
+            CaptureReader(f, OnePacket)
+        with self.assertRaises(DeserializeError):
+            CaptureReader(io.BytesIO(f.getvalue()[:-4]), MyNodes)
+        with self.assertRaises(DeserializeError):
+            CaptureReader(io.BytesIO(b"garbage"), MyNodes)
+        with self.assertRaises(ValueError):
+            CaptureWriter(io.BytesIO(), MyNodes).write(b"\x00")
+        with self.assertRaises(ValueError):
+            CaptureWriter(io.BytesIO(), MyNodes, compression="bz2")
+
+    def test_empty(self):
+        reader = CaptureReader(self.write([]), MyNodes)
+        self.assertEqual(len(reader), 0)
+        self.assertEqual(list(reader), [])
+
+    def test_zero_size(self):
+        reader = CaptureReader(self.write([Nothing()] * 3, Nothing), Nothing)
+        self.assertEqual(len(reader), 3)
+        self.assertEqual([packet.serialize() for packet in reader], [b""] * 3)
+        self.assertEqual(reader.block_columns(0), {})
+
+
+if __name__ == '__main__':
+    unittest.main()
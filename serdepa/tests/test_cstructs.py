@@ -0,0 +1,97 @@
+"""test_cstructs.py: Tests for ctypes Structures of packets. """
+
+import ctypes
+import mmap
+import random
+import re
+import unittest
+
+from serdepa import SerdepaPacket, Array, ByteString, nx_uint8, nx_int16, nx_uint64, uint16, int32, uint8
+from serdepa.cstructs import packet_structure, packet_view
+
+from .test_serdepa import ArrayPacket, PointStruct, OnePacket
+
+
+class Record(SerdepaPacket):
+    _fields_ = [
+        ("kind", nx_uint8),
+        ("temp", nx_int16),
+        ("origin", PointStruct),
+        ("track", Array(PointStruct, 2)),
+        ("samples", Array(nx_int16, 3)),
+        ("stamp", nx_uint64),
+        ("tag", ByteString(4)),
+    ]
+
+
+class NativeRecord(SerdepaPacket):
+    _fields_ = [
+        ("flags", uint8),
+        ("count", uint16),
+        ("offset", int32),
+        ("point", PointStruct),
+    ]
+
+
+def leaf_value(obj, path):
+    for attr, index in re.findall(r"(\w+)(?:\[(\d+)\])?", path):
+        obj = getattr(obj, attr)
+        if index:
+            obj = getattr(obj, "_data_container", obj)[int(index)]     # ByteStrings are not indexable
+    return getattr(obj, "value", obj)
+
+
+class PacketStructureTester(unittest.TestCase):
+
+    def check(self, packet_class, seed):
+        rng = random.Random(seed)
+        data = bytearray(rng.randint(0, 255) for _ in range(packet_class._size * 3))
+        for pos in range(0, len(data), packet_class._size):
+            packet = packet_class()
+            packet.deserialize(data[pos:pos + packet_class._size])
+            view = packet_view(packet_class, data, pos)
+            for path, offset, int_type in packet_class.leaf_fields():
+                self.assertEqual(leaf_value(view, path), leaf_value(packet, path), path)
+            self.assertEqual(bytes(view), packet.serialize())
+
+    def test_matches_deserialize(self):
+        for seed in range(5):
+            self.check(Record, seed)
+            self.check(NativeRecord, seed)
+            self.check(ArrayPacket, seed)
+        self.assertTrue(issubclass(packet_structure(Record), ctypes.BigEndianStructure))
+        self.assertTrue(issubclass(packet_structure(NativeRecord), ctypes.LittleEndianStructure))
+        self.assertEqual(ctypes.sizeof(packet_structure(Record)), Record._size)
+
+    def test_writes_through(self):
+        buf = mmap.mmap(-1, Record._size * 2)
+        view = packet_view(Record, buf, Record._size)
+        view.temp = -2
+        view.track[1].y = 7
+        view.tag[3] = 0xAB
+        packet = Record()
+        packet.deserialize(buf[Record._size:])
+        self.assertEqual(packet.temp, -2)
+        self.assertEqual(packet.track[1].y, 7)
+        self.assertEqual(packet.tag.serialize(), b"\x00\x00\x00\xAB")
+        self.assertEqual(buf[:Record._size], bytes(bytearray(Record._size)))
+        del view
+        buf.close()
+
+    def test_invalid(self):
+        class Mixed(SerdepaPacket):
+            _fields_ = [
+                ("a", nx_int16),
+                ("b", uint16),
+            ]
+
+        with self.assertRaises(ValueError):
+            packet_structure(Mixed)
+        with self.assertRaises(ValueError):
+            packet_structure(OnePacket)
+        with self.assertRaises(TypeError):
+            packet_view(PointStruct, bytes(bytearray(8)))
+
+
+if __name__ == '__main__':
+    unittest.main()
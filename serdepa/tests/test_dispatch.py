@@ -0,0 +1,161 @@
+"""test_dispatch.py: Tests for the packet dispatcher. """
+
+import unittest
+from codecs import decode
+
+from serdepa import SerdepaPacket, Length, List, ByteString, CRC16, nx_uint8, nx_uint16, uint16
+from serdepa.dispatch import Dispatcher
+from serdepa.exceptions import DeserializeError, PacketDefinitionError
+
+
+class Header(SerdepaPacket):
+    _fields_ = [
+        ("type", nx_uint8),
+        ("subtype", nx_uint8),
+    ]
+
+
+class Ping(SerdepaPacket):
+    _fields_ = [
+        ("header", Header),
+        ("seq", nx_uint16),
+    ]
+
+
+class Data(SerdepaPacket):
+    _fields_ = [
+        ("header", Header),
+        ("length", Length(nx_uint8, "data")),
+        ("data", List(nx_uint8)),
+    ]
+
+
+class Ack(SerdepaPacket):
+    _fields_ = [
+        ("header", Header),
+        ("seq", nx_uint16),
+        ("status", nx_uint8),
+    ]
+
+
+class Part(SerdepaPacket):
+    _fields_ = [
+        ("seq", nx_uint8),
+        ("size", Length(nx_uint8, "body")),
+        ("body", ByteString()),
+        ("crc", CRC16()),
+    ]
+
+
+class DispatcherTester(unittest.TestCase):
+
+    def setUp(self):
+        self.dispatcher = Dispatcher("header.type")
+        self.dispatcher.register(1, Ping)
+        self.dispatcher.register(2, Data)
+        self.control = Dispatcher("header.subtype")
+        self.control.register(0, Ping)
+        self.control.register(1, Ack)
+        self.dispatcher.register(3, self.control)
+
+    def test_decode(self):
+        packet = self.dispatcher.decode(decode("01000102", "hex"))
+        self.assertIsInstance(packet, Ping)
+        self.assertEqual(packet.seq, 0x0102)
+        packet = self.dispatcher.decode(decode("020003010203", "hex"))
+        self.assertIsInstance(packet, Data)
+        self.assertEqual(list(packet.data), [1, 2, 3])
+
+    def test_nested(self):
+        self.assertIsInstance(self.dispatcher.decode(decode("03000001", "hex")), Ping)
+        packet = self.dispatcher.decode(decode("0301000107", "hex"))
+        self.assertIsInstance(packet, Ack)
+        self.assertEqual(packet.status, 7)
+        self.assertEqual(self.dispatcher.classify(decode("0301", "hex")), Ack)
+
+    def test_stats(self):
+        frames = [decode(frame, "hex") for frame in ("01000102", "09000000", "0309", "0200FF", "020000")]
+        packets = list(self.dispatcher.decode_many(frames))
+        self.assertEqual([type(packet) for packet in packets], [Ping, Data])
+        stats = self.dispatcher.stats
+        self.assertEqual(stats["decoded"], {"Ping": 1, "Data": 1})
+        self.assertEqual(stats["unknown"], {9: 1})
+        self.assertEqual(stats["errors"], 1)
+        self.assertEqual(stats["nested"][3]["unknown"], {9: 1})
+        with self.assertRaises(DeserializeError):
+            list(self.dispatcher.decode_many(frames, skip_invalid=False))
+        errors = self.dispatcher.errors
+        with self.assertRaises(DeserializeError):
+            self.dispatcher.decode(b"")
+        self.assertEqual(self.dispatcher.errors, errors + 1)
+
+    def test_checksum(self):
+        @self.dispatcher.register(4)
+        class Checked(SerdepaPacket):
+            _fields_ = [
+                ("header", Header),
+                ("seq", nx_uint16),
+                ("crc", CRC16()),
+            ]
+
+            def __init__(self, **kwargs):
+                built.append(self)
+                super(Checked, self).__init__(**kwargs)
+
+        built = []
+        frame = bytearray(Checked(header=Header(type=4), seq=5).serialize())
+        del built[:]
+        self.assertEqual(self.dispatcher.decode(frame).seq, 5)
+        frame[3] ^= 1
+        with self.assertRaises(DeserializeError):
+            self.dispatcher.decode(frame)
+        self.assertEqual(len(built), 1)
+        self.assertEqual(self.dispatcher.errors, 1)
+
+    def test_nested_checksum(self):
+        @self.dispatcher.register(5)
+        class Sealed(SerdepaPacket):
+            _fields_ = [
+                ("header", Header),
+                ("count", Length(nx_uint8, "parts")),
+                ("parts", List(Part)),
+            ]
+
+        frame = bytearray(Sealed.from_tuple(((5, 0), [(1, b"ab"), (2, b"c")])).serialize())
+        self.assertEqual(self.dispatcher.decode(frame).parts[1].seq, 2)
+        frame[-3] ^= 1      # in the second part, decoded only when accessed
+        with self.assertRaises(DeserializeError):
+            self.dispatcher.decode(frame)
+
+    def test_decorator(self):
+        dispatcher = Dispatcher("kind")
+
+        @dispatcher.register(0x1234)
+        class Little(SerdepaPacket):
+            _fields_ = [
+                ("kind", uint16),
+                ("value", nx_uint8),
+            ]
+        self.assertEqual(dispatcher.decode(decode("341205", "hex")).value, 5)
+
+    def test_invalid_registrations(self):
+        with self.assertRaises(PacketDefinitionError):
+            self.dispatcher.register(1, Ack)
+        with self.assertRaises(PacketDefinitionError):
+            self.dispatcher.register(4, Header)
+        with self.assertRaises(PacketDefinitionError):
+            Dispatcher("header").register(1, Ping)
+
+        class Other(SerdepaPacket):
+            _fields_ = [
+                ("seq", nx_uint16),
+                ("header", Header),
+            ]
+        with self.assertRaises(PacketDefinitionError):
+            self.dispatcher.register(5, Other)
+        with self.assertRaises(DeserializeError):
+            Dispatcher("type").decode(b"\x01")
+
+
+if __name__ == '__main__':
+    unittest.main()
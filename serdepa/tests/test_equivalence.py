@@ -0,0 +1,78 @@
+"""test_equivalence.py: Tests for the randomized codec equivalence harness. """
+
+import random
+import unittest
+
+from serdepa import SerdepaPacket, Array, ByteString, nx_uint8, nx_uint16
+from serdepa.dtypes import numpy
+from serdepa.equivalence import (
+    CODECS, describe, random_layout, random_values, check_layout, measure_layout, swapped, run
+)
+
+from .test_serdepa import AnotherPacket, Sealed
+
+
+class SingleArray(SerdepaPacket):
+    _fields_ = [
+        ("flags", Array(nx_uint8, 1)),
+        ("count", nx_uint16),
+        ("tag", ByteString(1)),
+    ]
+
+
+class EquivalenceTester(unittest.TestCase):
+
+    def test_random_layouts(self):
+        checked = set()
+        for report in run(range(150), timings=False):
+            self.assertEqual(report.mismatches, [], report.packet_class.__name__)
+            checked.update(report.codecs)
+        wanted = set(CODECS) - (set() if numpy is not None else {"numpy"})
+        self.assertEqual(checked, wanted)
+
+    def test_layouts(self):
+        for seed in range(20):
+            rng = random.Random(seed)
+            packet_class = random_layout(rng, max_depth=1, max_fields=3)
+            again = random_layout(random.Random(seed), max_depth=1, max_fields=3)
+            self.assertEqual(describe(packet_class), describe(again))
+            values = random_values(rng, packet_class)
+            self.assertEqual(len(values), len([name for name in packet_class._fields
+                                               if name not in packet_class._computed]))
+
+    def test_known_layouts(self):
+        for packet_class, values in [
+            (SingleArray, ([7], 513, b"\x05")),     # an Array of one is not a plain field for serialize_many
+            (AnotherPacket, (1, 2, (3, 4), [(5, 6), (-7, -8)])),
+            (Sealed, (1, [((2, 3), ), ((-4, 5), )], 6)),
+        ]:
+            self.assertEqual(check_layout(packet_class, values)[1], [], packet_class.__name__)
+
+    def test_errors_are_mismatches(self):
+        def unfinished(cls, packet, data):
+            raise NotImplementedError("unfinished fast path")
+
+        CODECS["unfinished"] = unfinished
+        try:
+            checked, mismatches = check_layout(SingleArray, ([7], 513, b"\x05"), ["deserialize", "unfinished"])
+        finally:
+            del CODECS["unfinished"]
+        self.assertEqual(checked, ["deserialize", "unfinished"])
+        self.assertEqual([mismatch.codec for mismatch in mismatches], ["unfinished"])
+
+    def test_swapped(self):
+        twin = swapped(SingleArray)
+        self.assertEqual([field for field, _ in twin._fields.values()][1].__name__, "uint16")
+        self.assertEqual(twin.from_tuple(([7], 513, b"\x05")).serialize(), b"\x07\x01\x02\x05")
+        self.assertEqual(swapped(twin)._size, SingleArray._size)
+
+    def test_measure(self):
+        timings = measure_layout(SingleArray, ([1], 2, b"3"), records=10, repeat=1)
+        self.assertEqual(list(timings), ["decode", "unchecked", "encode"] + (["numpy"] if numpy is not None else []))
+        for timing in timings.values():
+            self.assertGreater(timing.reference, 0)
+            self.assertGreater(timing.fast, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,127 @@
+"""test_pipeline.py: Tests for the decode pipeline. """
+
+import sys
+import unittest
+
+from serdepa.dispatch import Dispatcher
+from serdepa.exceptions import DeserializeError
+from serdepa.pipeline import DecodePipeline
+
+from .test_serdepa import MyNodes
+from .test_dispatch import Header, Ping, Ack
+
+
+def frames(count):
+    return [MyNodes(nodeId=i, attr=-i).serialize() for i in range(count)]
+
+
+class DecodePipelineTester(unittest.TestCase):
+
+    def test_ordered(self):
+        with DecodePipeline(MyNodes, workers=4, max_pending=8, batch_size=3) as pipeline:
+            packets = list(pipeline.map(frames(100)))
+            self.assertEqual([packet.nodeId for packet in packets], list(range(100)))
+            stats = pipeline.stats
+        self.assertEqual(stats["submitted"], 100)
+        self.assertEqual(stats["decoded"], 100)
+        self.assertEqual(stats["pending"], 0)
+        self.assertLessEqual(stats["max_pending"], 24)
+
+    def test_unordered(self):
+        with DecodePipeline(MyNodes, ordered=False, max_pending=4) as pipeline:
+            packets = list(pipeline.map(frames(50)))
+        self.assertEqual(sorted(packet.nodeId for packet in packets), list(range(50)))
+
+    def test_backpressure(self):
+        consumed = []
+
+        def source():
+            for i, frame in enumerate(frames(100)):
+                consumed.append(i)
+                yield frame
+
+        with DecodePipeline(MyNodes, max_pending=2) as pipeline:
+            packets = pipeline.map(source())
+            next(packets)
+            self.assertLessEqual(len(consumed), 2)
+            self.assertEqual(len(list(packets)), 99)
+
+    def test_invalid_frames(self):
+        data = frames(3)
+        data.insert(1, b"\x00")
+        with DecodePipeline(MyNodes) as pipeline:
+            self.assertEqual(len(list(pipeline.map(data))), 3)
+            self.assertEqual(pipeline.stats["errors"], 1)
+        with DecodePipeline(MyNodes, skip_invalid=False) as pipeline:
+            packets = pipeline.map(data)
+            self.assertEqual(next(packets).nodeId, 0)
+            with self.assertRaises(DeserializeError):
+                next(packets)
+            with self.assertRaises(DeserializeError):
+                pipeline.decode(b"\x00")
+
+    def test_submit(self):
+        with DecodePipeline(MyNodes, max_pending=1) as pipeline:
+            futures = [pipeline.submit(frame) for frame in frames(5)]
+            self.assertEqual([future.result()[0].nodeId for future in futures], list(range(5)))
+            self.assertEqual(pipeline.decode(frames(1)[0]).nodeId, 0)
+
+    def test_process_pool_dispatcher(self):
+        dispatcher = Dispatcher("header.type")
+        dispatcher.register(1, Ping)
+        dispatcher.register(2, Ack)
+        data = [
+            Ping(header=Header(type=1), seq=i).serialize() if i % 2 else Ack(header=Header(type=2), seq=i).serialize()
+            for i in range(20)
+        ]
+        with DecodePipeline(dispatcher, workers=2, executor="process", batch_size=4) as pipeline:
+            packets = list(pipeline.map(data))
+        self.assertEqual([packet.seq for packet in packets], list(range(20)))
+        self.assertEqual([type(packet) for packet in packets[:2]], [Ack, Ping])
+
+    @unittest.skipIf(sys.version_info < (3, 7), "asyncio.run needs Python 3.7")
+    def test_asyncio(self):
+        import asyncio
+
+        async def source():
+            for frame in frames(30):
+                await asyncio.sleep(0)
+                yield frame
+
+        async def run(pipeline):
+            packets = [packet async for packet in pipeline.map_async(source())]
+            packets += [packet async for packet in pipeline.map_async(frames(5))]
+            single = await pipeline.decode_async(frames(2)[1])
+            return packets, single
+
+        with DecodePipeline(MyNodes, max_pending=4, batch_size=2) as pipeline:
+            packets, single = asyncio.run(run(pipeline))
+        self.assertEqual([packet.nodeId for packet in packets], list(range(30)) + list(range(5)))
+        self.assertEqual(single.nodeId, 1)
+
+    @unittest.skipIf(sys.version_info < (3, 7), "asyncio.run needs Python 3.7")
+    def test_decode_async_backpressure(self):
+        import asyncio
+
+        async def run(pipeline):
+            return await asyncio.gather(*[pipeline.decode_async(frame) for frame in frames(20)])
+
+        with DecodePipeline(MyNodes, max_pending=2) as pipeline:
+            packets = asyncio.run(run(pipeline))
+            stats = pipeline.stats
+        self.assertEqual([packet.nodeId for packet in packets], list(range(20)))
+        self.assertLessEqual(stats["max_pending"], 2)
+        self.assertEqual(stats["pending"], 0)
+
+    def test_dispatcher_stats(self):
+        dispatcher = Dispatcher("header.type")
+        dispatcher.register(1, Ping)
+        data = [Ping(header=Header(type=1), seq=i).serialize() for i in range(200)] + [b"\x01"] * 50
+        with DecodePipeline(dispatcher, workers=8) as pipeline:
+            self.assertEqual(len(list(pipeline.map(data))), 200)
+        self.assertEqual(dispatcher.stats["decoded"], {"Ping": 200})
+        self.assertEqual(dispatcher.stats["errors"], 50)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+"""test_query.py: Tests for aggregating fields of serialized packets. """
+
+import collections
+import io
+import os
+import random
+import shutil
+import tempfile
+import unittest
+
+from serdepa import SerdepaPacket, Length, List, nx_uint8, nx_uint16
+from serdepa.capture import CaptureWriter, CaptureReader
+from serdepa.dtypes import numpy
+from serdepa.exceptions import DeserializeError
+from serdepa.query import Aggregation, Histogram, aggregate
+
+from .test_capture import nodes
+from .test_serdepa import MyNodes, ArrayPacket, PointStruct, BeatRecord, Chunk
+
+
+class Trailed(SerdepaPacket):
+    _fields_ = [
+        ("count", Length(nx_uint8, "chunks")),
+        ("chunks", List(Chunk)),
+        ("origin", PointStruct),
+        ("seq", nx_uint16),
+        ("tail", List(nx_uint8)),
+    ]
+
+
+METHODS = ["struct"] + (["numpy"] if numpy is not None else [])
+
+
+def expected(packets, name, key=None):
+    groups = collections.defaultdict(list)
+    for packet in packets:
+        groups[key(packet) if key else None].append(name(packet))
+    return dict(
+        (group, {"min": min(values), "max": max(values), "mean": sum(values) / float(len(values)),
+                 "count": len(values), "sum": sum(values)})
+        for group, values in groups.items()
+    )
+
+
+class AggregateTester(unittest.TestCase):
+    reducers = ["count", "sum", "min", "max", "mean"]
+
+    def check(self, result, wanted):
+        self.assertEqual(sorted(result), sorted(wanted))
+        for key, values in wanted.items():
+            for reducer, value in values.items():
+                self.assertAlmostEqual(result[key][reducer], value)
+
+    def test_group_by(self):
+        packets = nodes(1000)
+        data = b"".join(packet.serialize() for packet in packets)
+        wanted = expected(packets, lambda packet: packet.qlty, lambda packet: packet.nodeId)
+        for method in METHODS:
+            for source in (data, io.BytesIO(data)):
+                result = aggregate(MyNodes, source, {"qlty": self.reducers, "attr": "min"}, group_by="nodeId",
+                                   chunk_records=300, method=method)
+                self.check(dict((key, values["qlty"]) for key, values in result.items()), wanted)
+                self.assertEqual(list(result), sorted(result))
+                self.assertEqual(set(values["attr"]["min"] for values in result.values()), {-1})
+
+    def test_nested_paths(self):
+        rng = random.Random(3)
+        packets = []
+        for _ in range(200):
+            packet = ArrayPacket(header=rng.randint(0, 2))
+            for i in range(4):
+                packet.data.append(PointStruct(x=rng.randint(-99, 99), y=i))
+            packets.append(packet)
+        data = b"".join(packet.serialize() for packet in packets)
+        wanted = expected(packets, lambda packet: packet.data[2].x)
+        grouped = expected(packets, lambda packet: packet.data[2].x, lambda packet: packet.header)
+        for method in METHODS:
+            self.check({None: aggregate(ArrayPacket, data, {"data[2].x": self.reducers}, method=method)["data[2].x"]},
+                       wanted)
+            result = aggregate(ArrayPacket, data, {"data[2].x": self.reducers}, group_by="header", method=method)
+            self.check(dict((key, values["data[2].x"]) for key, values in result.items()), grouped)
+
+    def test_histogram(self):
+        packets = nodes(500)
+        data = b"".join(packet.serialize() for packet in packets)
+        histogram = Histogram(0, 256, 4)
+        wanted = [0] * 4
+        for packet in packets:
+            wanted[packet.qlty // 64] += 1
+        for method in METHODS:
+            result = aggregate(MyNodes, data, {"qlty": histogram}, chunk_records=64, method=method)
+            self.assertEqual(result["qlty"]["histogram"], wanted)
+            grouped = aggregate(MyNodes, data, {"qlty": histogram}, group_by="nodeId", method=method)
+            self.assertEqual([sum(counts) for counts in zip(*[v["qlty"]["histogram"] for v in grouped.values()])],
+                             wanted)
+        self.assertEqual(Histogram(0, 10, 2).edges(), [0, 5, 10])
+        self.assertEqual([Histogram(0, 10, 2).bin(value) for value in (-5, 4, 5, 99)], [0, 0, 1, 1])
+
+    def test_sources(self):
+        packets = nodes(300)
+        data = b"".join(packet.serialize() for packet in packets)
+        wanted = aggregate(MyNodes, data, {"qlty": self.reducers}, group_by="nodeId")
+
+        capture = io.BytesIO()
+        with CaptureWriter(capture, MyNodes, block_records=100) as writer:
+            writer.write_many(packets)
+        self.assertEqual(
+            aggregate(MyNodes, CaptureReader(capture, MyNodes), {"qlty": self.reducers}, group_by="nodeId"), wanted
+        )
+        self.assertEqual(
+            aggregate(MyNodes, iter(packet.serialize() for packet in packets), {"qlty": self.reducers},
+                      group_by="nodeId", chunk_records=7),
+            wanted
+        )
+        directory = tempfile.mkdtemp()
+        try:
+            path = os.path.join(directory, "nodes.bin")
+            with open(path, "wb") as f:
+                f.write(data)
+            self.assertEqual(aggregate(MyNodes, path, {"qlty": self.reducers}, group_by="nodeId"), wanted)
+        finally:
+            shutil.rmtree(directory)
+
+    def test_variable_size(self):
+        records = []
+        for i in range(20):
+            packet = BeatRecord(clockstamp=i % 3, my_beat_id=i)
+            for k in range(i % 4):
+                packet.nodes.append(MyNodes(nodeId=k))
+            records.append(packet.serialize())
+        result = aggregate(BeatRecord, records, {"my_beat_id": ["sum", "count"]}, group_by="clockstamp")
+        self.assertEqual(
+            dict((key, values["my_beat_id"]["sum"]) for key, values in result.items()),
+            {0: sum(range(0, 20, 3)), 1: sum(range(1, 20, 3)), 2: sum(range(2, 20, 3))}
+        )
+        with self.assertRaises(ValueError):
+            aggregate(BeatRecord, b"".join(records), {"my_beat_id": "sum"})
+
+    def test_after_variable_fields(self):
+        records = []
+        for i in range(20):
+            packet = Trailed(seq=i)
+            packet.origin.y = -i
+            for k in range(i % 3):
+                packet.chunks.append(Chunk(kind=k))
+                packet.chunks[-1].payload.append(k)
+            records.append(packet.serialize())
+        result = aggregate(Trailed, records, {"seq": "sum", "origin.y": "min", "count": "max"})
+        self.assertEqual(result["seq"]["sum"], sum(range(20)))
+        self.assertEqual(result["origin.y"]["min"], -19)
+        self.assertEqual(result["count"]["max"], 2)
+        self.assertEqual(Trailed._partial_plans, {})    # the packets were not decoded
+        for name in ("chunks", "origin", "tail", "missing", "origin.z", "seq.x"):
+            with self.assertRaises(ValueError):
+                Aggregation(Trailed, {name: "max"})
+        with self.assertRaises(DeserializeError):
+            aggregate(Trailed, [records[2][:-3]], {"seq": "max"})
+
+    def test_empty_and_invalid(self):
+        self.assertEqual(aggregate(MyNodes, b"", {"qlty": ["count", "mean"]})["qlty"], {"count": 0, "mean": None})
+        self.assertEqual(aggregate(MyNodes, b"", {"qlty": "max"}, group_by="nodeId"), {})
+        with self.assertRaises(DeserializeError):
+            aggregate(MyNodes, MyNodes().serialize() + b"\x00", {"qlty": "max"})
+        with self.assertRaises(DeserializeError):
+            aggregate(MyNodes, io.BytesIO(MyNodes().serialize() + b"\x00"), {"qlty": "max"})
+        with self.assertRaises(ValueError):
+            Aggregation(MyNodes, {"missing": "max"})
+        with self.assertRaises(ValueError):
+            Aggregation(MyNodes, {"qlty": "median"})
+        with self.assertRaises(ValueError):
+            Aggregation(ArrayPacket, {"data": "max"})
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,118 @@
+"""test_ring.py: Tests for the shared memory packet ring. """
+
+import multiprocessing
+import unittest
+
+from serdepa.dispatch import Dispatcher
+from serdepa.ring import PacketRing, shared_memory
+
+from .test_serdepa import AnotherPacket, PointStruct
+from .test_dispatch import Header, Ping, Ack
+
+
+def make_packet(i):
+    packet = AnotherPacket(header=i % 256, timestamp=i)
+    for j in range(i % 7):
+        packet.data.append(PointStruct(x=i, y=-j))
+    return packet
+
+
+def produce(name, count):
+    ring = PacketRing.attach(name, AnotherPacket)
+    for i in range(count):
+        ring.put(make_packet(i), timeout=10)
+    ring.close()
+
+
+def consume(name, count, results):
+    ring = PacketRing.attach(name, AnotherPacket)
+    received = 0
+    for i in range(count):
+        packet = ring.get(timeout=10)
+        if packet != make_packet(i):
+            break
+        received += 1
+    ring.close()
+    results.put(received)
+
+
+@unittest.skipIf(shared_memory is None, "multiprocessing.shared_memory is not available")
+class PacketRingTester(unittest.TestCase):
+
+    def setUp(self):
+        self.ring = PacketRing(AnotherPacket, capacity=256)
+
+    def tearDown(self):
+        self.ring.close()
+        self.ring.unlink()
+
+    def test_put_get(self):
+        for i in range(40):     # wraps around several times
+            self.assertTrue(self.ring.put(make_packet(i)))
+            if i % 3 == 2:
+                self.assertTrue(self.ring.put(make_packet(i).serialize()))
+                self.assertEqual(self.ring.get(), make_packet(i))
+            self.assertEqual(self.ring.get(), make_packet(i))
+        self.assertIsNone(self.ring.get())
+        self.assertEqual(self.ring.used(), 0)
+
+    def test_full(self):
+        packets = 0
+        while self.ring.put(make_packet(6), timeout=0):
+            packets += 1
+        self.assertEqual(packets, 256 // (4 + len(make_packet(6).serialize())))
+        self.assertEqual(len(list(self.ring.drain())), packets)
+        with self.assertRaises(ValueError):
+            self.ring.put(bytes(bytearray(253)))
+
+    def test_large_record(self):
+        for offset in (96, 60, 110):   # after a partial lap the record only fits at the start
+            self.assertTrue(self.ring.put(bytes(bytearray(offset))))
+            self.ring.peek()
+            self.ring.advance()
+            record = bytes(bytearray(range(124)))
+            self.assertTrue(self.ring.put(record, timeout=0))
+            self.assertEqual(bytes(self.ring.peek()), record)
+            self.ring.advance()
+        with self.assertRaises(ValueError):
+            self.ring.put(bytes(bytearray(125)))
+        with self.assertRaises(ValueError):
+            self.ring.put(bytes(bytearray(196)))
+
+    def test_peek_in_place(self):
+        self.ring.put(make_packet(3))
+        view = self.ring.peek()
+        self.assertIsInstance(view, memoryview)
+        self.assertEqual(AnotherPacket.peek(view, "data"), make_packet(3).data)
+        self.assertIs(self.ring.peek(), view)
+        self.ring.advance()
+        self.assertIsNone(self.ring.peek())
+
+    def test_dispatcher(self):
+        dispatcher = Dispatcher("header.type")
+        dispatcher.register(1, Ping)
+        dispatcher.register(2, Ack)
+        with PacketRing(dispatcher, capacity=64) as ring:
+            try:
+                for i in range(20):
+                    ring.put(Ping(header=Header(type=1), seq=i))
+                    ring.put(Ack(header=Header(type=2), seq=i))
+                    self.assertEqual([type(p) for p in ring.drain()], [Ping, Ack])
+            finally:
+                ring.unlink()
+
+    def test_processes(self):
+        count = 500
+        results = multiprocessing.Queue()
+        consumer = multiprocessing.Process(target=consume, args=(self.ring.name, count, results))
+        producer = multiprocessing.Process(target=produce, args=(self.ring.name, count))
+        consumer.start()
+        producer.start()
+        producer.join(30)
+        consumer.join(30)
+        self.assertEqual(results.get(timeout=1), count)
+        self.assertEqual(self.ring.used(), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
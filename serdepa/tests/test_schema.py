@@ -0,0 +1,192 @@
+"""test_schema.py: Tests for declarative packet schemas. """
+
+import io
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+from codecs import decode
+
+from serdepa.exceptions import PacketDefinitionError
+from serdepa.schema import LayoutPlan, compile_schema, load_schema
+
+from .test_serdepa import PointStruct
+
+
+SCHEMA = {
+    "AnotherPacket": [
+        ["header", "nx_uint8"],
+        ["timestamp", "nx_uint32"],
+        ["origin", "PointStruct"],
+        ["points", {"type": "Length", "of": "nx_uint8", "field": "data"}],
+        ["data", {"type": "List", "of": "PointStruct"}],
+    ],
+    "PointStruct": [
+        {"name": "x", "type": "nx_int32"},
+        {"name": "y", "type": "nx_int32"},
+    ],
+    "Various": [
+        ["header", "uint16", 0x1234],
+        ["values", {"type": "Array", "of": "int8", "length": 3}],
+        ["tail", {"type": "ByteString"}],
+    ],
+    "Checked": [
+        ["origin", "PointStruct"],
+        ["crc", {"type": "CRC16", "last": "origin"}],
+        ["crc32", {"type": "CRC32"}],
+    ],
+}
+
+
+class SchemaTester(unittest.TestCase):
+    p1 = (
+        "D0"
+        "12345678"
+        "0000000100000001"
+        "01"
+        "0000000200000002"
+    )
+
+    def test_load_schema(self):
+        classes = load_schema(SCHEMA)
+        self.assertEqual(list(classes), ["PointStruct", "AnotherPacket", "Various", "Checked"])
+
+        packet = classes["AnotherPacket"]()
+        packet.deserialize(decode(self.p1, "hex"))
+        self.assertEqual(packet.header, 0xD0)
+        self.assertEqual(packet.origin.x, 1)
+        self.assertEqual(packet.points, 1)
+        self.assertEqual(packet.data[0].y, 2)
+        self.assertEqual(packet.serialize(), decode(self.p1, "hex"))
+
+    def test_defaults_arrays_and_bytestrings(self):
+        Various = load_schema(SCHEMA)["Various"]
+        packet = Various()
+        packet.values.append(-1)
+        packet.tail.append(0xAB)
+        self.assertEqual(packet.serialize(), decode("3412FF0000AB", "hex"))
+
+    def test_checksums(self):
+        Checked = load_schema(SCHEMA)["Checked"]
+        data = Checked().serialize()
+        self.assertEqual(data[8:10], decode("313E", "hex"))      # CRC-16/CCITT-FALSE of 8 zero bytes
+        self.assertEqual(data[10:], decode("E4B6726F", "hex"))   # CRC-32 of the rest
+
+    def test_checksum_options(self):
+        schema = {
+            "Modbus": [
+                ["data", {"type": "Array", "of": "nx_uint8", "length": 9}],
+                ["crc", {"type": "CRC16", "poly": 0x8005, "reflect": True, "int_type": "uint16"}],
+            ]
+        }
+        plan = pickle.loads(pickle.dumps(compile_schema(schema)))
+        for Modbus in (load_schema(schema)["Modbus"], plan.build()["Modbus"]):
+            data = Modbus.from_tuple((list(bytearray(b"123456789")), )).serialize()
+            self.assertEqual(data[9:], decode("374B", "hex"))   # CRC-16/MODBUS check value 0x4B37, little endian
+        for spec in (
+            {"type": "CRC16", "polynomial": 0x8005},
+            {"type": "CRC32", "poly": 0x04C11DB7},
+            {"type": "CRC16", "int_type": "Modbus"},
+        ):
+            with self.assertRaises(PacketDefinitionError):
+                load_schema({"Modbus": [["data", "nx_uint8"], ["crc", spec]]})
+
+    def test_existing_types(self):
+        schema = {
+            "Wrapper": [
+                ["point", "Point"],
+                ["count", {"type": "Length", "of": "nx_uint8", "field": "points"}],
+                ["points", {"type": "List", "of": "Point"}],
+            ]
+        }
+        Wrapper = load_schema(schema, types={"Point": PointStruct})["Wrapper"]
+        packet = Wrapper(point=PointStruct(x=1, y=2))
+        self.assertIsInstance(packet.point, PointStruct)
+        self.assertEqual(packet.serialize(), decode("000000010000000200", "hex"))
+
+    def test_invalid_schemas(self):
+        invalid = [
+            {"A": [["a", "nx_uint7"]]},
+            {"A": [["a"]]},
+            {"A": [["a", {"type": "Vector", "of": "nx_uint8"}]]},
+            {"A": [["a", {"type": "Array", "of": "nx_uint8"}]]},
+            {"A": [["a", {"type": "List", "of": "nx_uint8"}], ["b", "nx_uint8"]]},
+            {"A": [["a", "B"]], "B": [["b", "A"]]},
+            {"A": [["a", {"type": "Length", "of": "A", "field": "b"}], ["b", {"type": "List", "of": "nx_uint8"}]]},
+            {"A": [["a", "nx_uint8"], ["a", "nx_uint8"]]},
+        ]
+        for schema in invalid:
+            with self.assertRaises(PacketDefinitionError):
+                compile_schema(schema)
+
+
+class LayoutPlanTester(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_plan_round_trip(self):
+        plan = compile_schema(SCHEMA)
+        path = os.path.join(self.tmpdir, "plan.pickle")
+        plan.save(path)
+        loaded = LayoutPlan.open(path)
+        self.assertEqual(loaded, plan)
+
+        original = load_schema(SCHEMA)["AnotherPacket"]()
+        rebuilt = loaded.build(module="protocol")["AnotherPacket"]()
+        self.assertEqual(rebuilt.__class__.__module__, "protocol")
+        for packet in (original, rebuilt):
+            packet.header = 0xD0
+            packet.timestamp = 0x12345678
+            packet.origin.x = 1
+            packet.origin.y = 1
+            packet.data.append(packet.data._type(x=2, y=2))
+        self.assertEqual(rebuilt.serialize(), original.serialize())
+
+    def test_plan_is_trusted(self):
+        # A plan is validated by compile_schema, building it keeps only the structural checks.
+        plan = LayoutPlan([("Open", [("a", ("int", "nx_uint8")), ("b", ("List", ("int", "nx_uint8")))])])
+        self.assertEqual(list(plan.build()["Open"]._fields), ["a", "b"])
+        plan = LayoutPlan([("Unchecked", [("a", ("List", ("int", "nx_uint8"))), ("b", ("int", "nx_uint8"))])])
+        with self.assertRaises(PacketDefinitionError):
+            plan.build()
+        plan = LayoutPlan([("Dangling", [("n", ("Length", ("int", "nx_uint8"), "missing")), ("b", ("int", "nx_uint8"))])])
+        with self.assertRaises(PacketDefinitionError):
+            plan.build()
+
+    def test_plan_layouts(self):
+        plan = LayoutPlan.load(io.BytesIO(pickle.dumps(compile_schema(SCHEMA))))
+        planned = plan.build()
+        computed = LayoutPlan(plan.packets).build()
+        for name in planned:
+            for attr in ("_offsets", "_size", "_fixed_part", "_variable_fields", "_minimal_size",
+                         "_maximal_size", "_kinds", "_nested", "_tracked", "_has_checksums", "_computed"):
+                self.assertEqual(getattr(planned[name], attr), getattr(computed[name], attr))
+            self.assertEqual(
+                [(name, type(field), first, last, index) for name, field, first, last, index in planned[name]._checksums],
+                [(name, type(field), first, last, index) for name, field, first, last, index in computed[name]._checksums]
+            )
+        # the layout is installed as it is, not computed again
+        plan.layouts[0]["_minimal_size"] = 99
+        self.assertEqual(plan.build()[plan.packets[0][0]]._minimal_size, 99)
+
+        packet = planned["Checked"]()
+        packet.origin.x = 1
+        packet.deserialize(packet.serialize())
+        self.assertEqual(packet.serialize(), computed["Checked"](origin=packet.origin).serialize())
+
+    def test_invalid_plan_file(self):
+        f = io.BytesIO(pickle.dumps({"not": "a plan"}))
+        with self.assertRaises(PacketDefinitionError):
+            LayoutPlan.load(f)
+        f = io.BytesIO(pickle.dumps(LayoutPlan([], version=0)))
+        with self.assertRaises(PacketDefinitionError):
+            LayoutPlan.load(f)
+
+
+if __name__ == '__main__':
+    unittest.main()
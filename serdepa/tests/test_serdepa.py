@@ -1,16 +1,21 @@
 """test_serdepa.py: Tests for serdepa packets. """
 
+import io
+import os
+import struct
+import threading
 import unittest
 from codecs import decode, encode
 
 from serdepa import (
-    SerdepaPacket, Length, List, Array, ByteString,
+    SerdepaPacket, Length, List, Array, ByteString, CRC16, CRC32,
     nx_uint8, nx_uint16, nx_uint32, nx_uint64,
     nx_int8, nx_int16, nx_int32, nx_int64,
     uint8, uint16, uint32, uint64,
     int8, int16, int32, int64
 )
-from serdepa.exceptions import DeserializeError
+from serdepa.exceptions import DeserializeError, SerializeError, PacketDefinitionError
+from serdepa.serdepa import DecodeCache
 
 
 __author__ = "Raido Pahtma, Kaarel Ratas"
@@ -101,6 +106,14 @@ class BeatRecord(SerdepaPacket):
     ]
 
 
+class IncrementalBeatRecord(SerdepaPacket):
+    _incremental_ = True
+    _fields_ = BeatRecord._fields_ + [
+        ("origin", PointStruct),
+        ("tail", ByteString(2))
+    ]
+
+
 class TransformTester(unittest.TestCase):
     p1 = "010000303904010203040506"
 
@@ -143,6 +156,14 @@ class EmptyTailTester(unittest.TestCase):
         self.assertEqual(list(p.data), [1, 2, 3, 4])
         self.assertEqual(list(p.tail), [])
 
+    def test_empty_data_and_tail_deserialize(self):
+        p = OnePacket()
+        p.deserialize(decode("010000303900", "hex"))
+        self.assertEqual(p.length, 0)
+        self.assertEqual(list(p.tail), [])
+        with self.assertRaises(DeserializeError):
+            p.deserialize(decode("010000303901", "hex"))
+
     def test_empty_tail_serialize(self):
         p = OnePacket()
         p.header = 1
@@ -285,6 +306,33 @@ class SerializedSizeTester(unittest.TestCase):
         p.tail.append(6)
         self.assertEqual(p.serialized_size(), 12)
 
+    def test_nested_serialized_size(self):
+        packet = AnotherPacket()
+        packet.data.append(PointStruct(x=2, y=2))
+        self.assertEqual(packet.serialized_size(), len(packet.serialize()))
+        packet = ArrayPacket()
+        self.assertEqual(packet.serialized_size(), 33)
+
+        r = BeatRecord()
+        r.deserialize(decode(TestHourlyReport.report, "hex"))
+        self.assertEqual(r.serialized_size(), len(TestHourlyReport.report) // 2)
+
+    def test_size_bounds(self):
+        self.assertEqual(OnePacket.size_bounds(), (6, None))
+        self.assertEqual(MyNodes.size_bounds(), (8, 8))
+        self.assertEqual(ArrayPacket.size_bounds(), (33, 33))
+        self.assertEqual(AnotherPacket.size_bounds(), (14, 14 + 255 * 8))
+        self.assertEqual(BeatRecord.maximal_size(), 10 + 255 * 8 + 255 * 13)
+        self.assertEqual(ArrayPacket.minimal_size(), 33)
+
+    def test_reject_by_size(self):
+        packet = MyNodes()
+        with self.assertRaises(DeserializeError):
+            packet.deserialize(b"\x00" * 7)
+        with self.assertRaises(DeserializeError):
+            packet.deserialize(b"\x00" * 9)
+        self.assertEqual(packet.deserialize(b"\x00" * 9, pos=1), 9)
+
 
 class NestedPacketTester(unittest.TestCase):
     p0 = (
@@ -561,5 +609,1046 @@ class InvalidLengthTester(unittest.TestCase):
             packet.deserialize(self.long_input)
 
 
+class PartialDeserializeTester(unittest.TestCase):
+    report = TestHourlyReport.report
+    p1 = NestedPacketTester.p1
+
+    def test_fixed_prefix(self):
+        data = decode(self.report, "hex")
+        self.assertEqual(
+            BeatRecord.deserialize_fields(data, ["my_beat_id", "clockstamp"]),
+            (0x0005029E, 0x1DD26640)
+        )
+
+    def test_skip_variable_fields(self):
+        data = decode(self.report, "hex")
+        full = BeatRecord()
+        full.deserialize(data)
+        routers, count = BeatRecord.deserialize_fields(data, ["routers", "beats_in_cycle"])
+        self.assertEqual(count, 13)
+        self.assertEqual(list(routers), list(full.routers))
+
+    def test_nested_paths(self):
+        data = decode(self.p1, "hex")
+        self.assertEqual(
+            AnotherPacket.deserialize_fields(data, ["origin.y", "header", "points"]),
+            (1, 0xD0, 1)
+        )
+        origin, = AnotherPacket.deserialize_fields(data, ["origin"])
+        self.assertEqual(origin, PointStruct(x=1, y=1))
+
+    def test_trailing_list(self):
+        data = decode(TransformTester.p1, "hex")
+        tail, = OnePacket.deserialize_fields(data, ["tail"])
+        self.assertEqual(list(tail), [5, 6])
+
+    def test_variable_size_elements(self):
+        class Inner(SerdepaPacket):
+            _fields_ = [
+                ("count", Length(nx_uint8, "values")),
+                ("values", List(nx_uint8))
+            ]
+
+        class Outer(SerdepaPacket):
+            _fields_ = [
+                ("count", Length(nx_uint8, "packets")),
+                ("packets", List(Inner)),
+                ("last", nx_uint8)
+            ]
+        packet = Outer()
+        inner = Inner()
+        inner.values.append(1)
+        inner.values.append(2)
+        packet.packets.append(inner)
+        packet.last = 7
+        self.assertEqual(Outer.deserialize_fields(packet.serialize(), ["last", "count"]), (7, 1))
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            AnotherPacket.deserialize_fields(b"", ["nonexistent"])
+        with self.assertRaises(ValueError):
+            AnotherPacket.deserialize_fields(b"", ["timestamp.x"])
+        with self.assertRaises(DeserializeError):
+            AnotherPacket.deserialize_fields(decode(self.p1, "hex")[:10], ["origin.y"])
+
+
+class OffsetTableTester(unittest.TestCase):
+    report = TestHourlyReport.report
+
+    def test_offset_table(self):
+        self.assertEqual(
+            [(o.name, o.offset, o.size, o.terms) for o in BeatRecord.offset_table()],
+            [
+                ("clockstamp", 0, 4, ()),
+                ("nodes_in_beat", 4, 1, ()),
+                ("beats_in_cycle", 5, 1, ()),
+                ("my_beat_id", 6, 4, ()),
+                ("nodes", 10, None, ()),
+                ("routers", 10, None, (("nodes_in_beat", 8), )),
+            ]
+        )
+        self.assertEqual(AnotherPacket.offset_table()[3].offset, 13)
+
+    def test_field_offset(self):
+        data = decode(self.report, "hex")
+        self.assertEqual(BeatRecord.field_offset(data, "routers"), 10 + 7 * 8)
+        self.assertEqual(BeatRecord.field_offset(b"\x00" + data, "routers", pos=1), 11 + 7 * 8)
+        with self.assertRaises(ValueError):
+            BeatRecord.field_offset(data, "nonexistent")
+
+    def test_peek(self):
+        data = decode(self.report, "hex")
+        self.assertEqual(BeatRecord.peek(data, "my_beat_id"), 0x0005029E)
+        self.assertEqual(BeatRecord.peek(data, "beats_in_cycle"), 13)
+        self.assertEqual(BeatRecord.peek(b"\xFF" + data, "clockstamp", pos=1), 0x1DD26640)
+        self.assertEqual(len(BeatRecord.peek(data, "routers")), 13)
+
+        data = decode(NestedPacketTester.p1, "hex")
+        self.assertEqual(AnotherPacket.peek(data, "origin.y"), 1)
+        self.assertEqual(AnotherPacket.peek(data, "points"), 1)
+
+    def test_peek_invalid(self):
+        with self.assertRaises(ValueError):
+            AnotherPacket.peek(b"", "header.x")
+        with self.assertRaises(DeserializeError):
+            AnotherPacket.peek(b"\x00\x01", "timestamp")
+
+
+class PatchTester(unittest.TestCase):
+    router = "0000000102030405060701020F"
+
+    def test_patch_integer(self):
+        data = bytearray(decode(self.router, "hex"))
+        self.assertIs(MyRouters.patch(data, {"lifetime": 1, "beatId": 0xFFFFFFFF}), data)
+        self.assertEqual(data, decode("FFFFFFFF02030405060701010F", "hex"))
+
+    def test_patch_dynamic_offset(self):
+        data = bytearray(decode(TestHourlyReport.report, "hex"))
+        BeatRecord.patch(memoryview(data), {"my_beat_id": 5})
+        self.assertEqual(BeatRecord.peek(data, "my_beat_id"), 5)
+
+        packet = BeatRecord()
+        packet.deserialize(bytes(data))
+        packet.routers[0].lifetime = 0x10
+        BeatRecord.patch(data, {"routers": list(packet.routers)})
+        self.assertEqual(bytes(data), packet.serialize())
+
+    def test_patch_nested(self):
+        data = bytearray(decode(NestedPacketTester.p1, "hex"))
+        AnotherPacket.patch(data, {"origin.y": -1})
+        self.assertEqual(AnotherPacket.peek(data, "origin.y"), -1)
+        AnotherPacket.patch(data, {"origin": PointStruct(x=3, y=4)})
+        self.assertEqual(AnotherPacket.deserialize_fields(data, ["origin.x", "origin.y"]), (3, 4))
+
+    def test_patch_list_same_length(self):
+        data = bytearray(decode(TransformTester.p1, "hex"))
+        OnePacket.patch(data, {"data": [4, 3, 2, 1], "tail": [7, 8]})
+        self.assertEqual(data, decode("010000303904040302010708", "hex"))
+
+    def test_patch_refused(self):
+        data = bytearray(decode(TransformTester.p1, "hex"))
+        for updates in ({"length": 5}, {"data": [1, 2, 3]}, {"tail": [1]}, {"header": 2, "timestamp": -1}):
+            with self.assertRaises(SerializeError):
+                OnePacket.patch(data, updates)
+        self.assertEqual(data, decode(TransformTester.p1, "hex"))
+        with self.assertRaises(TypeError):
+            OnePacket.patch(bytes(data), {"header": 2})
+        with self.assertRaises(ValueError):
+            OnePacket.patch(data, {"header.x": 2})
+
+    def test_patch_fallback(self):
+        data = bytearray(decode(TransformTester.p1, "hex"))
+        patched = OnePacket.patch(data, {"data": [1, 2, 3], "header": 2}, fallback=True)
+        self.assertIsNot(patched, data)
+        self.assertEqual(patched, decode("0200003039030102030506", "hex"))
+
+    def test_patch_fallback_refused(self):
+        data = bytearray(decode(TransformTester.p1, "hex"))
+        for updates in ({"length": 5}, {"data": [1, 2, 3], "length": 4}, {"header": 300},
+                        {"data": [1, 2, 3], "header": 300}, {"tail": [1], "timestamp": -1}):
+            with self.assertRaises(SerializeError):
+                OnePacket.patch(data, updates, fallback=True)
+        self.assertEqual(data, decode(TransformTester.p1, "hex"))
+        patched = OnePacket.patch(data, {"length": 4, "header": 2}, fallback=True)     # the stored Length is fine
+        self.assertIs(patched, data)
+        self.assertEqual(data[0], 2)
+        patched = OnePacket.patch(data, {"length": 2, "data": [7, 8]}, fallback=True)
+        self.assertEqual(patched, decode("02000030390207080506", "hex"))
+
+
+class ByteStringInstanceTester(unittest.TestCase):
+    def test_bytestrings_are_not_shared(self):
+        class Packet(SerdepaPacket):
+            _fields_ = (
+                ('hdr', nx_uint8),
+                ('tail', ByteString())
+            )
+        first, second = Packet(), Packet()
+        first.tail.append(1)
+        self.assertEqual(len(second.tail), 0)
+
+
+class ReuseTester(unittest.TestCase):
+    report = TestHourlyReport.report
+
+    def test_deserialize_reuses_fields(self):
+        packet = AnotherPacket()
+        origin = packet.origin
+        packet.deserialize(decode(NestedPacketTester.p1, "hex"))
+        first = packet.data[0]
+        packet.deserialize(decode(NestedPacketTester.p1, "hex"))
+        self.assertIs(packet.origin, origin)
+        self.assertIs(packet.data[0], first)
+        self.assertEqual(packet.serialize(), decode(NestedPacketTester.p1, "hex"))
+
+    def test_lists_are_resized_in_place(self):
+        packet = OnePacket()
+        data = packet.data
+        packet.deserialize(decode(TransformTester.p1, "hex"))
+        self.assertEqual(list(packet.data), [1, 2, 3, 4])
+        packet.deserialize(decode("0100003039020102", "hex"))
+        self.assertIs(packet.data, data)
+        self.assertEqual(list(packet.data), [1, 2])
+        self.assertEqual(list(packet.tail), [])
+        packet.deserialize(decode(TransformTester.p1, "hex"))
+        self.assertEqual(list(packet.data), [1, 2, 3, 4])
+        self.assertEqual(list(packet.tail), [5, 6])
+
+    def test_reset(self):
+        packet = DefaultValuePacket()
+        origin = DefaultValuePacket().serialize()
+        packet.deserialize(decode("FF0000000001AA", "hex"))
+        packet.reset()
+        self.assertEqual(packet.serialize(), origin)
+
+        packet = AnotherPacket()
+        origin = packet.origin
+        packet.deserialize(decode(NestedPacketTester.p1, "hex"))
+        packet.reset()
+        self.assertIs(packet.origin, origin)
+        self.assertEqual(packet.serialize(), AnotherPacket().serialize())
+
+    def test_caller_objects_are_reused(self):
+        packet = AnotherPacket()
+        origin, point = PointStruct(x=7, y=7), PointStruct(x=8, y=8)
+        packet.origin = origin
+        packet.data.append(point)
+        packet.deserialize(decode(NestedPacketTester.p1, "hex"))
+        self.assertIs(packet.origin, origin)
+        self.assertIs(packet.data[0], point)
+        self.assertEqual((origin.x, origin.y, point.x, point.y), (1, 1, 2, 2))
+
+        bundle, chunk = Bundle(), Chunk(kind=9)
+        bundle.tail.append(chunk)
+        bundle.deserialize(IndexedListTester.data)
+        self.assertNotIn(chunk, list(list.__iter__(bundle.tail)))
+        self.assertEqual(chunk.kind, 9)
+
+    def test_pool(self):
+        pool = MyNodes.pool(maxsize=2)
+        self.assertIs(MyNodes.pool(), pool)
+        self.assertIs(MyNodes.pool(maxsize=2), pool)
+        with self.assertRaises(ValueError):
+            MyNodes.pool(maxsize=3)
+        self.assertIsNot(MyRouters.pool(), pool)
+        packet = pool.decode(decode("0001FFFF01020304", "hex"))
+        self.assertEqual(packet.nodeId, 1)
+        self.assertEqual(packet.attr, -1)
+        pool.release(packet)
+        self.assertIs(pool.acquire(), packet)
+        for packet in [MyNodes() for _ in range(3)]:
+            pool.release(packet)
+        self.assertEqual(len(pool), 2)
+        with self.assertRaises(DeserializeError):
+            pool.decode(b"\x00")
+        self.assertEqual(len(pool), 2)
+
+
+class ConcurrencyTester(unittest.TestCase):
+    threads = 16
+    rounds = 200
+
+    def run_threads(self, target):
+        errors = []
+
+        def run(index):
+            try:
+                for _ in range(self.rounds):
+                    target(index)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(i, )) for i in range(self.threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+
+    def test_serialize_is_pure(self):
+        packet = ArrayPacket(header=1)
+        packet.data.append(PointStruct(x=1, y=2))
+        before = len(packet.data)
+        expected = decode("01" "0000000100000002" + "00" * 24, "hex")
+
+        def serialize(index):
+            self.assertEqual(packet.serialize(), expected)
+        self.run_threads(serialize)
+        self.assertEqual(len(packet.data), before)
+
+        packet = DefaultValuePacket()
+        expected = packet.serialize()
+
+        def serialize_length(index):
+            self.assertEqual(packet.serialize(), expected)
+        self.run_threads(serialize_length)
+
+    def test_separate_instances(self):
+        frames = [decode("0100003039" + "%02X" % i + "00" * i + "FF", "hex") for i in range(self.threads)]
+
+        def deserialize(index):
+            packet = OnePacket()
+            packet.deserialize(frames[index])
+            self.assertEqual(packet.length, index)
+            self.assertEqual(list(packet.tail), [0xFF])
+            self.assertEqual(packet.serialize(), frames[index])
+        self.run_threads(deserialize)
+
+
+class IncrementalTester(unittest.TestCase):
+    report = TestHourlyReport.report + "00000001000000020A0B"
+
+    def setUp(self):
+        self.packet = IncrementalBeatRecord()
+        self.packet.deserialize(decode(self.report, "hex"))
+        self.reference = BeatRecord()
+        self.reference.deserialize(decode(TestHourlyReport.report, "hex"))
+
+    def assertMatches(self):
+        expected = self.reference.serialize() + decode(
+            "%08X%08X" % (self.packet.origin.x & 0xFFFFFFFF, self.packet.origin.y & 0xFFFFFFFF), "hex"
+        ) + decode(str(self.packet.tail), "hex")
+        self.assertEqual(self.packet.serialize(), expected)
+
+    def test_unchanged(self):
+        self.assertEqual(self.packet.serialize(), decode(self.report, "hex"))
+        encoded = self.packet._encoded_
+        self.assertEqual(self.packet.serialize(), decode(self.report, "hex"))
+        self.assertIs(self.packet._encoded_, encoded)
+
+    def test_changes_are_patched(self):
+        self.packet.serialize()
+        encoded = self.packet._encoded_
+        for packet in (self.packet, self.reference):
+            packet.my_beat_id = 0x12345678
+            packet.nodes[2].qlty = 0x55
+            packet.routers[12].flags = 0x77
+        self.packet.origin.y = -2
+        self.assertEqual(self.packet.dirty_fields(), frozenset(["my_beat_id"]))
+        self.assertMatches()
+        self.assertIs(self.packet._encoded_, encoded)
+        self.assertEqual(self.packet.dirty_fields(), frozenset())
+
+        for packet in (self.packet, self.reference):
+            packet.nodes[0] = MyNodes(nodeId=0xABCD)
+            packet.clockstamp = 1
+        self.packet.origin = PointStruct(x=5, y=6)
+        self.packet.tail.append(1)
+        self.packet.tail.pop(0)
+        self.assertMatches()
+        self.assertIs(self.packet._encoded_, encoded)
+
+    def test_length_change(self):
+        self.packet.serialize()
+        encoded = self.packet._encoded_
+        for packet in (self.packet, self.reference):
+            packet.nodes.append(MyNodes(nodeId=1))
+        self.assertMatches()
+        self.assertIsNot(self.packet._encoded_, encoded)
+        self.assertEqual(self.packet.nodes_in_beat, 8)
+
+    def test_deserialize_resets(self):
+        self.packet.serialize()
+        self.packet.deserialize(decode(self.report, "hex"))
+        self.assertIsNone(self.packet._encoded_)
+        self.assertEqual(self.packet.serialize(), decode(self.report, "hex"))
+
+    def test_plain_packets_keep_no_state(self):
+        packet = BeatRecord()
+        packet.deserialize(decode(TestHourlyReport.report, "hex"))
+        packet.my_beat_id = 1
+        self.assertFalse(set(vars(packet)) & {"_dirty_", "_encoded_"})
+        self.assertEqual(packet.dirty_fields(), frozenset())
+
+        self.packet.serialize()
+        self.packet.origin.deserialize(decode("0000000300000004", "hex"))    # a plain nested packet
+        self.assertEqual((self.packet.origin.x, self.packet.origin.y), (3, 4))
+        self.assertMatches()
+
+
+class StreamTester(unittest.TestCase):
+
+    class Bulk(SerdepaPacket):
+        _fields_ = (
+            ("header", nx_uint8),
+            ("length", Length(nx_uint8, "data")),
+            ("data", List(nx_uint16)),
+            ("payload", ByteString())
+        )
+
+    class Nodes(SerdepaPacket):
+        _fields_ = (
+            ("count", nx_uint8),
+            ("nodes", List(MyNodes))
+        )
+
+    def test_buffer(self):
+        stream = OnePacket.iter_stream(decode(TransformTester.p1, "hex"))
+        header = next(stream)
+        self.assertEqual(header.timestamp, 12345)
+        self.assertEqual(list(header.data), [1, 2, 3, 4])
+        self.assertEqual(list(header.tail), [])
+        self.assertEqual(list(stream), [5, 6])
+
+    def test_file_in_chunks(self):
+        payload = bytes(bytearray(i % 256 for i in range(100000)))
+        data = decode("070200010002", "hex") + payload
+        reads = []
+
+        class File(io.BytesIO):
+            def read(self, size=-1):
+                reads.append(size)
+                return super(File, self).read(size)
+
+        stream = self.Bulk.iter_stream(File(data), chunk=4096, read_size=1000)
+        header = next(stream)
+        self.assertEqual(list(header.data), [1, 2])
+        chunks = list(stream)
+        self.assertEqual(max(len(chunk) for chunk in chunks), 4096)
+        self.assertEqual(b"".join(chunks), payload)
+        self.assertLessEqual(max(reads), 1000)
+
+    def test_packet_elements(self):
+        nodes = [MyNodes(nodeId=i, attr=-i) for i in range(5)]
+        data = b"\x05" + b"".join(node.serialize() for node in nodes)
+        for source in (data, io.BytesIO(data)):
+            stream = self.Nodes.iter_stream(source, read_size=3)
+            self.assertEqual(next(stream).count, 5)
+            self.assertEqual(list(stream), nodes)
+
+    def test_invalid(self):
+        with self.assertRaises(ValueError):
+            next(AnotherPacket.iter_stream(b""))
+        with self.assertRaises(DeserializeError):
+            list(self.Nodes.iter_stream(io.BytesIO(b"\x01" + b"\x00" * 9)))
+        with self.assertRaises(DeserializeError):
+            next(self.Bulk.iter_stream(io.BytesIO(decode("070200", "hex"))))
+
+
+class SerializeToTester(unittest.TestCase):
+
+    class Bulk(SerdepaPacket):
+        _fields_ = (
+            ("header", nx_uint8),
+            ("length", Length(nx_uint16, "data")),
+            ("data", List(nx_uint16)),
+            ("payload", ByteString())
+        )
+
+    def setUp(self):
+        self.packet = self.Bulk()
+        self.packet.header = 7
+        for i in range(20000):
+            self.packet.data.append(i)
+        for i in range(300):
+            self.packet.payload.append(i % 256)
+
+    def test_serialize_to(self):
+        writes = []
+
+        class File(io.BytesIO):
+            def write(self, data):
+                writes.append(len(data))
+                return super(File, self).write(data)
+
+        f = File()
+        written = self.packet.serialize_to(f, chunk_size=1024)
+        self.assertEqual(f.getvalue(), self.packet.serialize())
+        self.assertEqual(written, len(f.getvalue()))
+        self.assertLessEqual(max(writes), 2048)
+        self.assertGreater(len(writes), 30)
+
+    def test_serialize_to_nested(self):
+        packet = StreamTester.Nodes(count=3)
+        for i in range(3):
+            packet.nodes.append(MyNodes(nodeId=i, attr=-i))
+        f = io.BytesIO()
+        packet.serialize_to(f, chunk_size=4)
+        self.assertEqual(f.getvalue(), packet.serialize())
+
+        for packet, item in ((ArrayPacket(), PointStruct(x=1, y=2)), (SimpleArray(), 1)):
+            packet.data.append(item)
+            f = io.BytesIO()
+            packet.serialize_to(f)
+            self.assertEqual(f.getvalue(), packet.serialize())
+
+    def test_serialize_buffers(self):
+        buffers = self.packet.serialize_buffers(min_size=4096)
+        self.assertEqual([len(buf) for buf in buffers], [3, 40000, 300])
+        self.assertEqual(b"".join(bytes(buf) for buf in buffers), self.packet.serialize())
+        self.assertEqual(len(self.Bulk().serialize_buffers()), 1)
+
+    @unittest.skipUnless(hasattr(os, "writev"), "os.writev is not available")
+    def test_writev(self):
+        r, w = os.pipe()
+        try:
+            buffers = self.packet.serialize_buffers(min_size=100)
+            expected = self.packet.serialize()
+            self.assertEqual(os.writev(w, buffers[:2]), sum(len(buf) for buf in buffers[:2]))
+            data = os.read(r, 65536)
+            while len(data) < 40003:
+                data += os.read(r, 65536)
+            self.assertEqual(data, expected[:40003])
+        finally:
+            os.close(r)
+            os.close(w)
+
+
+class SerializeManyTester(unittest.TestCase):
+
+    class Mixed(SerdepaPacket):
+        _fields_ = [
+            ("a", nx_uint16),
+            ("flag", uint8),
+            ("b", uint16, 0x1234),
+            ("points", Array(PointStruct, 2)),
+        ]
+
+    def test_fixed_size(self):
+        nodes = [MyNodes(nodeId=i, attr=-i, qlty=i % 256) for i in range(300)]
+        expected = b"".join(node.serialize() for node in nodes)
+        self.assertEqual(MyNodes.serialize_many(nodes), expected)
+        self.assertEqual(MyNodes.serialize_many(tuple((i, -i, 0, 0, i % 256, 0) for i in range(300))), expected)
+        self.assertEqual(MyNodes.serialize_many([{"nodeId": 1, "attr": -1}]), MyNodes(nodeId=1, attr=-1).serialize())
+        self.assertEqual(MyNodes.serialize_many([]), b"")
+
+    def test_mixed_byte_order(self):
+        packet = self.Mixed(a=1, flag=2)
+        packet.points.append(PointStruct(x=3, y=4))
+        expected = packet.serialize()
+        self.assertEqual(len(self.Mixed.__dict__.get("_batch_structs") or []), 0)
+        self.assertEqual(self.Mixed.serialize_many([packet]), expected)
+        self.assertEqual(len(self.Mixed.__dict__["_batch_structs"]), 3)
+        self.assertEqual(self.Mixed.serialize_many([(1, 2, 0x1234, [(3, 4)])]), expected)
+        self.assertEqual(self.Mixed.serialize_many([{"a": 1, "flag": 2, "points": [{"x": 3, "y": 4}]}]), expected)
+
+    def test_variable_size(self):
+        packets = [AnotherPacket(header=i, timestamp=i) for i in range(3)]
+        packets[1].data.append(PointStruct(x=1, y=2))
+        expected = b"".join(packet.serialize() for packet in packets)
+        items = [packets[0], (1, 1, (0, 0), [(1, 2)]), {"header": 2, "timestamp": 2}]
+        self.assertEqual(AnotherPacket.serialize_many(items), expected)
+
+    def test_prefix(self):
+        nodes = [MyNodes(nodeId=i) for i in range(3)]
+        data = MyNodes.serialize_many(nodes, prefix="count", prefix_type=nx_uint8)
+        self.assertEqual(data[:1], b"\x03")
+        self.assertEqual(data[1:], MyNodes.serialize_many(nodes))
+        data = MyNodes.serialize_many(nodes, prefix="length")
+        self.assertEqual(data[:4], decode("00000018", "hex"))
+        with self.assertRaises(ValueError):
+            MyNodes.serialize_many(nodes, prefix="size")
+
+    def test_invalid(self):
+        with self.assertRaises(SerializeError):
+            MyNodes.serialize_many([(1, 2)])
+        with self.assertRaises(SerializeError):
+            MyNodes.serialize_many([(70000, 0, 0, 0, 0, 0)])
+        with self.assertRaises(SerializeError):
+            MyNodes.serialize_many([(1, 0, 0, 0, 0, 0)] * 256, prefix="count", prefix_type=nx_uint8)
+        with self.assertRaises(TypeError):
+            MyNodes.serialize_many([MyNodes(), MyRouters()])
+        with self.assertRaises(TypeError):
+            AnotherPacket.serialize_many([BeatRecord()])
+        with self.assertRaises(TypeError):
+            Tagged.serialize_many([{"origin": MyNodes()}])
+
+
+class DecodeCacheTester(unittest.TestCase):
+
+    def frame(self, i, points=1):
+        packet = AnotherPacket(header=i, timestamp=i)
+        for j in range(points):
+            packet.data.append(PointStruct(x=i, y=j))
+        return packet.serialize()
+
+    def test_hits_and_evictions(self):
+        cache = AnotherPacket.cache(maxsize=2)
+        self.assertIs(AnotherPacket.cache(), cache)
+        self.assertIs(AnotherPacket.cache(maxsize=2, copy=False), cache)
+        for settings in ({"maxsize": 3}, {"max_bytes": 100}, {"copy": True}):
+            with self.assertRaises(ValueError):
+                AnotherPacket.cache(**settings)
+        first = cache.decode(self.frame(1))
+        self.assertIs(cache.decode(bytearray(self.frame(1))), first)
+        self.assertEqual(first.data[0].x, 1)
+        cache.decode(self.frame(2))
+        cache.decode(self.frame(1))
+        cache.decode(self.frame(3))     # evicts 2, the least recently used
+        self.assertIs(cache.decode(b"\x00" + self.frame(1), pos=1), first)
+        self.assertEqual(cache.stats, {"hits": 3, "misses": 3, "evictions": 1, "size": 2, "bytes": 44})
+        cache.clear()
+        self.assertEqual(len(cache), 0)
+
+    def test_byte_budget(self):
+        cache = DecodeCache(AnotherPacket, max_bytes=40)
+        cache.decode(self.frame(1))
+        cache.decode(self.frame(2))
+        self.assertEqual(len(cache), 1)
+        big = cache.decode(self.frame(3, points=10))
+        self.assertEqual(len(cache), 1)
+        big.header = 5      # not cached, so not frozen
+        with self.assertRaises(DeserializeError):
+            cache.decode(b"\x00")
+        self.assertEqual(cache.stats["misses"], 4)
+
+    def test_disabled(self):
+        cache = DecodeCache(AnotherPacket, maxsize=0)
+        first = cache.decode(self.frame(1))
+        self.assertIsNot(cache.decode(self.frame(1)), first)
+        self.assertEqual(len(cache), 0)
+        first.header = 5    # not cached, so not frozen
+        self.assertEqual(cache.stats["misses"], 2)
+
+    def test_frozen(self):
+        packet = DecodeCache(AnotherPacket).decode(self.frame(1))
+        with self.assertRaises(AttributeError):
+            packet.header = 2
+        with self.assertRaises(AttributeError):
+            packet.origin.x = 2
+        with self.assertRaises(AttributeError):
+            packet.data[0].y = 2
+        with self.assertRaises(AttributeError):
+            packet.deserialize(self.frame(2))
+        with self.assertRaises(AttributeError):
+            packet.reset()
+        self.assertEqual(packet.serialize(), self.frame(1))
+
+    def test_copy(self):
+        cache = DecodeCache(AnotherPacket, copy=True)
+        first = cache.decode(self.frame(1, points=3))
+        second = cache.decode(self.frame(1, points=3))
+        self.assertIsNot(first, second)
+        self.assertEqual(second.serialize(), self.frame(1, points=3))
+        second.data[2].x = 7
+        second.header = 9
+        self.assertEqual(cache.decode(self.frame(1, points=3)).serialize(), self.frame(1, points=3))
+
+
+class Chunk(SerdepaPacket):
+    _fields_ = [
+        ("kind", nx_uint8),
+        ("size", Length(nx_uint8, "payload")),
+        ("payload", List(nx_uint16))
+    ]
+
+
+class Bundle(SerdepaPacket):
+    _fields_ = [
+        ("count", Length(nx_uint8, "chunks")),
+        ("chunks", List(Chunk)),
+        ("tail", List(Chunk))
+    ]
+
+
+class IndexedListTester(unittest.TestCase):
+    data = decode(
+        "02"
+        "01" "01" "0001"
+        "02" "00"
+        "03" "02" "00030004"
+        "04" "03" "000500060007",
+        "hex"
+    )
+
+    def test_variable_size_elements(self):
+        packet = Bundle()
+        packet.deserialize(self.data)
+        self.assertEqual(len(packet.chunks), 2)
+        self.assertEqual(len(packet.tail), 2)
+        self.assertEqual(list(packet.tail[1].payload), [5, 6, 7])
+        self.assertEqual([chunk.kind for chunk in packet.chunks], [1, 2])
+        self.assertEqual([chunk.kind for chunk in packet.tail[0:2]], [3, 4])
+        self.assertEqual(packet.serialized_size(), len(self.data))
+        self.assertEqual(packet.serialize(), self.data)
+
+    def test_lazy_access(self):
+        packet = Bundle()
+        packet.deserialize(self.data)
+        self.assertEqual(packet.tail[-1].kind, 4)
+        decoded = [isinstance(item, Chunk) for item in list.__iter__(packet.tail)]
+        self.assertEqual(decoded, [False, True])
+        self.assertEqual(packet.serialize(), self.data)
+
+        packet.tail[-1].payload.append(8)
+        packet.chunks[0].kind = 9
+        expected = bytearray(self.data)
+        expected[1] = 9
+        expected[-7] = 4
+        self.assertEqual(packet.serialize(), bytes(expected) + b"\x00\x08")
+
+    def test_list_methods(self):
+        def chunks():
+            packet = Bundle()
+            packet.deserialize(self.data)
+            return packet.tail
+
+        third, fourth = Chunk(kind=3), Chunk(kind=4)
+        third.payload.append(3)
+        third.payload.append(4)
+        for value in (5, 6, 7):
+            fourth.payload.append(value)
+        self.assertEqual(chunks().pop(), fourth)
+        self.assertEqual(chunks().pop(0), third)
+        self.assertEqual(list(reversed(chunks())), [fourth, third])
+        self.assertIn(fourth, chunks())
+        self.assertNotIn(Chunk(kind=4), chunks())
+        self.assertEqual(chunks().index(fourth), 1)
+        self.assertEqual(chunks().count(third), 1)
+        tail = chunks()
+        tail.remove(third)
+        self.assertEqual([chunk.kind for chunk in tail], [4])
+        self.assertEqual(chunks().copy(), [third, fourth])
+        self.assertEqual(chunks() + [third], [third, fourth, third])
+        self.assertEqual(chunks() * 2, [third, fourth] * 2)
+        self.assertNotIn("_Undecoded", repr(chunks()))
+
+    def test_reset_does_not_decode(self):
+        packet = Bundle()
+        packet.deserialize(self.data)
+        decoded = []
+
+        def deserialize(chunk, *args, **kwargs):
+            decoded.append(chunk)
+            return original(chunk, *args, **kwargs)
+
+        original = Chunk.deserialize
+        Chunk.deserialize = deserialize
+        try:
+            packet.reset()
+            packet.tail.append(Chunk(kind=5))
+        finally:
+            Chunk.deserialize = original
+        self.assertEqual(decoded, [])
+        self.assertEqual([chunk.kind for chunk in packet.tail], [5])
+
+    def test_equality_and_copies(self):
+        first, second = Bundle(), Bundle()
+        first.deserialize(self.data)
+        second.deserialize(self.data)
+        second.chunks[1]
+        self.assertEqual(first.chunks, second.chunks)
+        cache = DecodeCache(Bundle, copy=True)
+        self.assertEqual(cache.decode(self.data).serialize(), self.data)
+        self.assertEqual(cache.decode(self.data).tail[1].kind, 4)
+
+    def test_invalid(self):
+        for data in (self.data[:-1], self.data[:4], decode("0301010001", "hex")):
+            with self.assertRaises(DeserializeError):
+                Bundle().deserialize(data)
+
+
+class Tagged(SerdepaPacket):
+    _fields_ = [
+        ("origin", PointStruct),
+        ("samples", Array(nx_int16, 3)),
+        ("stamp", uint32),
+        ("tag", ByteString(2))
+    ]
+
+
+class ConvertTester(unittest.TestCase):
+
+    def test_to_dict(self):
+        packet = AnotherPacket(header=1, timestamp=2, origin=PointStruct(x=-3, y=4))
+        packet.data.append(PointStruct(x=5, y=6))
+        expected = {"header": 1, "timestamp": 2, "origin": {"x": -3, "y": 4}, "data": [{"x": 5, "y": 6}]}
+        self.assertEqual(packet.to_dict(), expected)
+        self.assertEqual(packet.to_tuple(), (1, 2, (-3, 4), [(5, 6)]))
+        self.assertEqual(AnotherPacket.to_dicts([packet.serialize(), packet]), [expected, expected])
+        self.assertEqual(AnotherPacket.to_tuples(packet.serialize() * 2), [packet.to_tuple()] * 2)
+
+    def test_round_trip(self):
+        packet = Tagged(origin=PointStruct(x=1, y=-1), stamp=7)
+        packet.samples.append(-5)
+        packet.tag.append(0xAB)
+        self.assertEqual(packet.to_tuple(), ((1, -1), [-5, 0, 0], 7, b"\xAB\x00"))
+        for values in (packet.to_dict(), packet.to_tuple()):
+            converted = Tagged.from_dict(values) if isinstance(values, dict) else Tagged.from_tuple(values)
+            self.assertEqual(converted.serialize(), packet.serialize())
+        data = Tagged.serialize_many([packet.to_tuple()] * 3)
+        self.assertEqual(Tagged.to_dicts(data), [packet.to_dict()] * 3)
+        self.assertEqual(Tagged.to_tuples(memoryview(data)), [packet.to_tuple()] * 3)
+        self.assertEqual(MyNodes.to_tuples(MyNodes.serialize_many([(1, -2, 3, 4, 5, 6)] * 2)), [(1, -2, 3, 4, 5, 6)] * 2)
+        packets = BeatRecord.from_tuples([(1, 2, [(3, 4, 5, 6, 7, 8)], [])] * 2)
+        self.assertEqual([packet.nodes[0].nodeId for packet in packets], [3, 3])
+        self.assertEqual(BeatRecord.to_tuples(packets), [(1, 2, [(3, 4, 5, 6, 7, 8)], [])] * 2)
+
+    def test_matches_deserialize(self):
+        for packet_class, data in ((Bundle, IndexedListTester.data), (OnePacket, decode("0100000002020304" "05", "hex"))):
+            packet = packet_class()
+            packet.deserialize(data)
+            self.assertEqual(packet_class.to_dicts([data]), [packet.to_dict()])
+            self.assertEqual(packet_class.to_tuples([data]), [packet.to_tuple()])
+            self.assertEqual(packet_class.from_dict(packet.to_dict()).serialize(), data)
+        self.assertEqual(Bundle.to_tuples([IndexedListTester.data])[0][1][1], (4, [5, 6, 7]))
+
+    def test_invalid(self):
+        for data in (IndexedListTester.data[:-1], IndexedListTester.data[:4], decode("0301010001", "hex")):
+            with self.assertRaises(DeserializeError):
+                Bundle.to_dicts([data])
+        with self.assertRaises(DeserializeError):
+            MyNodes.to_tuples(b"\x00" * 9)
+        with self.assertRaises(DeserializeError):
+            MyNodes.to_dicts([b"\x00" * 9])
+        with self.assertRaises(TypeError):
+            MyNodes.from_dict((1, 2, 3, 4, 5, 6))
+        with self.assertRaises(ValueError):
+            MyNodes.from_dict({"unknown": 1})
+
+
+class Frame(SerdepaPacket):
+    _fields_ = [
+        ("header", nx_uint8),
+        ("size", Length(nx_uint8, "payload")),
+        ("payload", List(nx_uint16)),
+        ("crc", CRC16())
+    ]
+
+
+class SealedPoint(SerdepaPacket):
+    _fields_ = [
+        ("point", PointStruct),
+        ("crc", CRC16(int_type=uint16))
+    ]
+
+
+class Sealed(SerdepaPacket):
+    _fields_ = [
+        ("kind", nx_uint8),
+        ("points", Array(SealedPoint, 2)),
+        ("stamp", nx_uint32),
+        ("crc", CRC32("points", "stamp"))
+    ]
+
+
+class Frames(SerdepaPacket):
+    _fields_ = [
+        ("count", Length(nx_uint8, "frames")),
+        ("frames", List(Frame))
+    ]
+
+
+class ChecksumTester(unittest.TestCase):
+
+    def test_check_values(self):
+        data = b"123456789"
+        self.assertEqual(CRC16().compute(data), 0x29B1)
+        self.assertEqual(CRC16(init=0).compute(data), 0x31C3)
+        self.assertEqual(CRC16(poly=0x8005, init=0).compute(data), 0xFEE8)
+        self.assertEqual(CRC16(poly=0x8005, reflect=True).compute(data), 0x4B37)
+        self.assertEqual(CRC16(reflect=True, init=0).compute(data), 0x2189)
+        self.assertEqual(CRC32().compute(data), 0xCBF43926)
+        checksum = CRC16(poly=0x8005, reflect=True)
+        self.assertEqual(checksum.finish(checksum.update(checksum.update(checksum.start(), data[:4]), data[4:])), 0x4B37)
+
+    def test_serialize(self):
+        packet = Frame(header=7)
+        packet.payload.append(0x102)
+        data = packet.serialize()
+        self.assertEqual(data[:-2], decode("07010102", "hex"))
+        self.assertEqual(data[-2:], struct.pack(">H", CRC16().compute(data[:-2])))
+        self.assertEqual(packet.crc, CRC16().compute(data[:-2]))
+        out = io.BytesIO()
+        packet.serialize_to(out, chunk_size=1)
+        self.assertEqual(out.getvalue(), data)
+        with self.assertRaises(AttributeError):
+            packet.crc = 1
+
+        copy = Frame()
+        copy.deserialize(data)
+        self.assertEqual(list(copy.payload), [0x102])
+        self.assertEqual(Frame.to_tuples([data]), [(7, [0x102])])
+        self.assertEqual(Frame.from_tuple((7, [0x102])).serialize(), data)
+
+    def test_corrupted(self):
+        packet = Frame(header=7)
+        packet.payload.append(3)
+        data = bytearray(packet.serialize())
+        data[2] ^= 0x10
+        for decode_frame in (lambda: Frame().deserialize(data), lambda: Frame.verify(data),
+                             lambda: Frame.to_dicts([data])):
+            with self.assertRaises(DeserializeError):
+                decode_frame()
+
+    def test_fixed_and_nested(self):
+        packet = Sealed(kind=1, stamp=9)
+        packet.points.append(SealedPoint(point=PointStruct(x=1, y=2)))
+        data = packet.serialize()
+        self.assertEqual(len(data), Sealed._size)
+        self.assertEqual(data[9:11], struct.pack("<H", CRC16().compute(data[1:9])))
+        self.assertEqual(data[-4:], struct.pack(">I", CRC32().compute(data[1:-4])))
+        self.assertEqual(bytes(Sealed.serialize_many([packet, packet.to_tuple(), packet.to_dict()])), data * 3)
+        self.assertEqual(Sealed.to_tuples(data * 2), [packet.to_tuple()] * 2)
+
+        patched = Sealed.patch(bytearray(data), {"stamp": 10, "points": [SealedPoint(point=PointStruct(x=5))]})
+        Sealed.verify(patched)
+        decoded = Sealed()
+        decoded.deserialize(patched)
+        self.assertEqual((decoded.stamp, decoded.points[0].point.x), (10, 5))
+        with self.assertRaises(ValueError):
+            Sealed.patch(bytearray(data), {"crc": 0})
+
+        corrupted = bytearray(data)
+        corrupted[3] ^= 1
+        corrupted[-4:] = struct.pack(">I", CRC32().compute(corrupted[1:-4]))
+        Sealed.verify(corrupted, nested=False)
+        with self.assertRaises(DeserializeError):
+            Sealed.verify(corrupted)
+        with self.assertRaises(DeserializeError):
+            Sealed().deserialize(corrupted)
+
+    def test_nested_list(self):
+        data = bytearray(Frames.from_tuple(([(1, [2, 3]), (4, [5])], )).serialize())
+        packet = Frames()
+        packet.deserialize(data)
+        self.assertEqual(list(packet.frames[1].payload), [5])
+        data[5] ^= 1    # the second payload word of the first element
+        for validation in ("checked", "unchecked", "strict"):
+            with self.assertRaises(DeserializeError):
+                Frames().deserialize(data, validation=validation)
+        packet = Frames()
+        packet.deserialize(data, checksums=False)
+        with self.assertRaises(DeserializeError):
+            packet.frames[0]    # an element is checked when it is decoded
+
+    def test_definition(self):
+        with self.assertRaises(PacketDefinitionError):
+            class After(SerdepaPacket):
+                _fields_ = [
+                    ("crc", CRC16("data")),
+                    ("data", nx_uint8)
+                ]
+        with self.assertRaises(PacketDefinitionError):
+            class Missing(SerdepaPacket):
+                _fields_ = [
+                    ("data", nx_uint8),
+                    ("crc", CRC16("missing"))
+                ]
+        with self.assertRaises(PacketDefinitionError):
+            class Default(SerdepaPacket):
+                _fields_ = [
+                    ("data", nx_uint8),
+                    ("crc", CRC16(), 5)
+                ]
+        with self.assertRaises(PacketDefinitionError):
+            CRC32(int_type=nx_uint16)
+
+
+class Bounded(SerdepaPacket):
+    _fields_ = [
+        ("kind", nx_uint8),
+        ("levels", Array(nx_int16, 2)),
+        ("count", Length(nx_uint32, "points")),
+        ("points", List(PointStruct)),
+        ("tail", List(nx_uint16))
+    ]
+    _limits_ = {
+        "kind": (1, 5),
+        "levels": (-100, 100),
+        "points": (0, 3),
+    }
+
+
+class TrustedBounded(SerdepaPacket):
+    _fields_ = Bounded._fields_
+    _validation_ = "unchecked"
+
+
+class ValidationTester(unittest.TestCase):
+
+    def setUp(self):
+        self.data = bytes(Bounded.from_tuple((2, [-5, 7], [(1, 2), (3, 4)], [8, 9])).serialize())
+
+    def test_modes_agree(self):
+        for packet_class, data in [
+            (Bounded, self.data),
+            (AnotherPacket, decode("01000000020000000300000004" "02" "0000000500000006" "0000000700000008", "hex")),
+            (ArrayPacket, decode("01" + "0000000100000002" * 4, "hex")),
+            (Sealed, bytes(Sealed.from_tuple((1, [((2, 3), )], 4)).serialize())),
+            (TrustedBounded, self.data),
+        ]:
+            expected = packet_class()
+            expected.deserialize(data, validation="checked")
+            for validation in (None, "unchecked", "strict"):
+                packet = packet_class()
+                packet.deserialize(data, validation=validation)
+                self.assertEqual(packet.to_tuple(), expected.to_tuple())
+                self.assertEqual(packet.serialize(), data)
+
+    def test_unchecked(self):
+        packet = TrustedBounded()
+        packet.deserialize(self.data[:-2])
+        self.assertEqual(list(packet.tail), [8])
+        packet.deserialize(self.data)
+        self.assertEqual(list(packet.tail), [8, 9])
+        with self.assertRaises(DeserializeError):
+            packet.deserialize(self.data[:-1])     # half a tail element
+        with self.assertRaises(DeserializeError):
+            packet.deserialize(self.data[:6])
+        with self.assertRaises(DeserializeError):
+            packet.deserialize(self.data[:5] + b"\x00\x00\x00\x03" + self.data[9:25])
+        with self.assertRaises(ValueError):
+            packet.deserialize(self.data, validation="sloppy")
+
+    def test_strict(self):
+        packet = Bounded()
+        for data in [
+            b"\x06" + self.data[1:],                              # kind above its limit
+            self.data[:3] + b"\xFF\x00" + self.data[5:],           # a level below its limit
+            self.data[:5] + b"\x00\x00\x00\x04" + self.data[9:],   # more points than allowed
+            self.data[:5] + b"\xFF\xFF\xFF\xFF" + self.data[9:],   # more points than there are bytes
+            self.data + b"\x00",                                   # half a tail element
+        ]:
+            with self.assertRaises(DeserializeError):
+                Bounded.validate(data)
+            with self.assertRaises(DeserializeError):
+                packet.deserialize(data, validation="strict")
+        packet.deserialize(b"\x06" + self.data[1:])       # only strict checks the limits
+        self.assertEqual(packet.kind, 6)
+        self.assertEqual(Bounded.validate(self.data + b"\x00\x01", final=False), len(self.data) + 2)
+
+    def test_definition(self):
+        with self.assertRaises(PacketDefinitionError):
+            class Nested(SerdepaPacket):
+                _fields_ = [
+                    ("origin", PointStruct)
+                ]
+                _limits_ = {"origin": (0, 1)}
+        with self.assertRaises(PacketDefinitionError):
+            class Missing(SerdepaPacket):
+                _fields_ = [
+                    ("data", nx_uint8)
+                ]
+                _limits_ = {"missing": (0, 1)}
+        with self.assertRaises(PacketDefinitionError):
+            class Reversed(SerdepaPacket):
+                _fields_ = [
+                    ("data", nx_uint8)
+                ]
+                _limits_ = {"data": (5, 1)}
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -87,3 +87,50 @@ class FieldsTester(unittest.TestCase):
                 ('testfield', nx_int8),
                 ('testfield2', nx_uint8),
             )
+
+
+class LazyTester(unittest.TestCase):
+
+    class Lazy(SerdepaPacket):
+        _lazy_ = True
+
+    def test_compiled_on_first_use(self):
+        class Point(self.Lazy):
+            _fields_ = (
+                ('x', nx_uint8),
+                ('y', nx_uint8),
+            )
+
+        class Packet(self.Lazy):
+            _fields_ = (
+                ('count', Length(nx_uint8, 'points')),
+                ('points', List(Point)),
+            )
+
+        self.assertNotIn('x', Point.__dict__)
+        self.assertNotIn('count', Packet.__dict__)
+        packet = Packet()
+        self.assertIn('x', Point.__dict__)
+        packet.deserialize(decode("0201020304", "hex"))
+        self.assertEqual([(p.x, p.y) for p in packet.points], [(1, 2), (3, 4)])
+        self.assertEqual(packet.serialize(), decode("0201020304", "hex"))
+
+    def test_class_methods(self):
+        class Packet(self.Lazy):
+            _fields_ = (
+                ('a', nx_uint16),
+                ('b', nx_uint8),
+            )
+
+        self.assertEqual(Packet.peek(decode("010203", "hex"), 'b'), 3)
+        self.assertEqual(Packet.size_bounds(), (3, 3))
+
+    def test_errors_on_first_use(self):
+        class Broken(self.Lazy):
+            _fields_ = (
+                ('testfield', List(nx_int8)),
+                ('testfield2', nx_uint8)
+            )
+
+        with self.assertRaises(PacketDefinitionError):
+            Broken()
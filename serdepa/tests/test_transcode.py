@@ -0,0 +1,121 @@
+"""test_transcode.py: Tests for converting packet buffers between layouts. """
+
+import io
+import random
+import struct
+import unittest
+
+from serdepa import (
+    SerdepaPacket, Array, nx_uint8, nx_uint16, nx_int16, nx_uint32, nx_int64,
+    uint8, uint16, int16, uint32, int64
+)
+from serdepa.dtypes import numpy
+from serdepa.transcode import Transcoder, Step
+
+
+class OnAirPoint(SerdepaPacket):
+    _fields_ = [
+        ("x", nx_int16),
+        ("y", nx_int16),
+    ]
+
+
+class HostPoint(SerdepaPacket):
+    _fields_ = [
+        ("x", int16),
+        ("y", int16),
+    ]
+
+
+class OnAir(SerdepaPacket):
+    _fields_ = [
+        ("kind", nx_uint8),
+        ("seq", nx_uint16),
+        ("stamp", nx_uint32),
+        ("origin", OnAirPoint),
+        ("track", Array(OnAirPoint, 3)),
+        ("energy", nx_int64),
+    ]
+
+
+class Host(SerdepaPacket):
+    _fields_ = [
+        ("stamp", uint32),
+        ("energy", int64),
+        ("seq", uint16),
+        ("origin", HostPoint),
+        ("track", Array(HostPoint, 3)),
+        ("kind", uint8),
+    ]
+
+
+class Words(SerdepaPacket):
+    _fields_ = [
+        ("values", Array(nx_uint16, 4)),
+    ]
+
+
+class HostWords(SerdepaPacket):
+    _fields_ = [
+        ("values", Array(uint16, 4)),
+    ]
+
+
+def leaves(packet_class, data):
+    records = []
+    for pos in range(0, len(data), packet_class._size):
+        records.append(dict(
+            (path, struct.unpack_from(int_type._format, data, pos + offset)[0])
+            for path, offset, int_type in packet_class.leaf_fields()
+        ))
+    return records
+
+
+class TranscoderTester(unittest.TestCase):
+
+    def setUp(self):
+        rng = random.Random(1)
+        self.data = bytes(bytearray(rng.randint(0, 255) for _ in range(OnAir._size * 50)))
+
+    def methods(self):
+        return ["slices", "numpy"] if numpy is not None else ["slices"]
+
+    def test_convert(self):
+        for method in self.methods():
+            transcoder = Transcoder(OnAir, Host, method=method)
+            converted = transcoder.convert(self.data)
+            self.assertEqual(leaves(Host, converted), leaves(OnAir, self.data))
+            self.assertEqual(transcoder.reverse().method, method)
+            self.assertEqual(transcoder.reverse().convert(converted), self.data)
+
+    def test_plan(self):
+        plan = Transcoder(OnAir, Host).plan
+        self.assertEqual(plan[0], Step(0, 30, 1, 1, False))
+        self.assertEqual(plan[3], Step(7, 14, 2, 8, True))     # origin and track in one run
+        self.assertEqual(Transcoder(OnAir, OnAir).plan, [Step(0, 0, OnAir._size, 1, False)])
+
+    def test_byteswap(self):
+        transcoder = Transcoder(Words, HostWords)
+        self.assertEqual(transcoder.method, "byteswap")
+        data = bytes(bytearray(range(64)))
+        expected = Transcoder(Words, HostWords, method="slices").convert(data)
+        self.assertEqual(transcoder.convert(data), expected)
+        with self.assertRaises(ValueError):
+            Transcoder(OnAir, Host, method="byteswap")
+
+    def test_stream(self):
+        source, target = io.BytesIO(self.data), io.BytesIO()
+        self.assertEqual(Transcoder(OnAir, Host).convert_stream(source, target, records=7), 50)
+        self.assertEqual(bytes(target.getvalue()), bytes(Transcoder(OnAir, Host).convert(self.data)))
+
+    def test_incompatible(self):
+        with self.assertRaises(ValueError):
+            Transcoder(OnAir, Words)
+        with self.assertRaises(ValueError):
+            Transcoder(Words, OnAirPoint)
+        with self.assertRaises(ValueError):
+            Transcoder(OnAir, Host).convert(self.data[:-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,164 @@
+"""
+transcode.py: Converting buffers of fixed size packets between two classes
+with the same fields in a different byte order or order of fields, without
+decoding them.
+
+    transcoder = Transcoder(OnAirRecord, HostRecord)
+    host_data = transcoder.convert(on_air_data)
+
+The fields of the two classes are matched by their paths (see
+SerdepaPacket.leaf_fields) and must have the same sizes. The conversion plan
+is a list of moves and byte swaps of runs of fields, which is applied to all
+the records of a buffer at once: with array.byteswap when the conversion is
+a plain byte swap, with NumPy when it is installed and otherwise with
+strided bytearray slices.
+"""
+
+from __future__ import unicode_literals
+
+import array
+import collections
+
+from .dtypes import numpy
+
+
+__author__ = "Raido Pahtma, Kaarel Ratas"
+__license__ = "MIT"
+
+
+# Moves count fields of width bytes from offset source of a source record to
+# offset target of a target record, reversing the bytes of each if swap is set.
+Step = collections.namedtuple("Step", ["source", "target", "width", "count", "swap"])
+
+_ARRAY_CODES = {}
+for _code in "HILQ":
+    try:
+        _ARRAY_CODES.setdefault(array.array(str(_code)).itemsize, _code)
+    except ValueError:  # no Q on Python 2
+        pass
+
+
+class Transcoder(object):
+    """
+    Converts buffers of source_class packets into buffers of target_class
+    packets. method is "byteswap", "numpy" or "slices", or None to pick the
+    fastest one available.
+    """
+
+    def __init__(self, source_class, target_class, method=None):
+        for cls in (source_class, target_class):
+            if cls._size is None:
+                raise ValueError("{} does not have a fixed size".format(cls.__name__))
+        self.source_class = source_class
+        self.target_class = target_class
+        self.plan = _plan(source_class, target_class)
+        if method is None:
+            method = "byteswap" if self._byteswap_code() else "numpy" if numpy is not None else "slices"
+        elif method == "byteswap" and not self._byteswap_code():
+            raise ValueError("Converting {} to {} is not a plain byte swap".format(
+                source_class.__name__, target_class.__name__
+            ))
+        elif method == "numpy" and numpy is None:
+            raise ImportError("NumPy is required for this, install it with 'pip install numpy'.")
+        elif method not in ("byteswap", "numpy", "slices"):
+            raise ValueError("Unknown method {}".format(method))
+        self.method = method
+
+    def reverse(self):
+        """
+        Returns the Transcoder converting target_class packets back with the
+        same method.
+        """
+        return Transcoder(self.target_class, self.source_class, method=self.method)
+
+    def _byteswap_code(self):
+        size = self.source_class._size
+        if size != self.target_class._size or len(self.plan) != 1:
+            return None
+        step = self.plan[0]
+        if step.swap and step.source == step.target == 0 and step.width * step.count == size:
+            return _ARRAY_CODES.get(step.width)
+        return None
+
+    def convert(self, data):
+        """
+        Returns a bytearray with the records in data converted. Checksum
+        fields of the target class are computed again for every record.
+        """
+        source_size, target_size = self.source_class._size, self.target_class._size
+        if len(data) % source_size:
+            raise ValueError("{} bytes is not a whole number of {} byte records".format(len(data), source_size))
+        count = len(data) // source_size
+        if self.method == "byteswap":
+            values = array.array(str(self._byteswap_code()), bytes(data))
+            values.byteswap()
+            target = bytearray(values.tobytes() if hasattr(values, "tobytes") else values.tostring())
+        elif self.method == "numpy":
+            source = numpy.frombuffer(data, dtype=numpy.uint8).reshape(count, source_size)
+            converted = numpy.empty((count, target_size), dtype=numpy.uint8)
+            for step in self.plan:
+                size = step.width * step.count
+                columns = source[:, step.source:step.source + size]
+                if step.swap:
+                    columns = columns.reshape(count, step.count, step.width)[:, :, ::-1].reshape(count, size)
+                converted[:, step.target:step.target + size] = columns
+            target = bytearray(converted.tobytes())
+        else:
+            target = bytearray(count * target_size)
+            data = memoryview(data)
+            for step in self.plan:
+                for i in range(step.count):
+                    for k in range(step.width):
+                        source = step.source + i * step.width + (step.width - 1 - k if step.swap else k)
+                        target[step.target + i * step.width + k::target_size] = data[source::source_size]
+        if self.target_class._has_checksums:
+            for pos in range(0, len(target), target_size):
+                self.target_class._fill_checksums(target, pos)
+        return target
+
+    def convert_stream(self, source, target, records=65536):
+        """
+        Converts the records read from the file object source into the file
+        object target, records records at a time. Returns the number of
+        records converted.
+        """
+        size = self.source_class._size
+        converted = 0
+        while True:
+            data = source.read(size * records)
+            if not data:
+                return converted
+            while len(data) % size:
+                more = source.read(size - len(data) % size)
+                if not more:
+                    raise ValueError("The data ends with a partial record of {} bytes".format(len(data) % size))
+                data += more
+            target.write(self.convert(data))
+            converted += len(data) // size
+
+
+def _plan(source_class, target_class):
+    targets = dict((path, (offset, int_type)) for path, offset, int_type in target_class.leaf_fields())
+    sources = source_class.leaf_fields()
+    if len(sources) != len(targets) or any(path not in targets for path, _, _ in sources):
+        raise ValueError("{} and {} do not have the same fields".format(source_class.__name__, target_class.__name__))
+    plan = []
+    for path, offset, int_type in sources:
+        target_offset, target_type = targets[path]
+        width = int_type.serialized_size()
+        if width != target_type.serialized_size() or int_type._signed != target_type._signed:
+            raise ValueError("{} is a {} in {} and a {} in {}".format(
+                path, int_type.__name__, source_class.__name__, target_type.__name__, target_class.__name__
+            ))
+        swap = width > 1 and int_type._format[0] != target_type._format[0]
+        last = plan[-1] if plan else None
+        if last is not None and last.swap == swap and \
+                last.source + last.width * last.count == offset and last.target + last.width * last.count == target_offset:
+            if swap and last.width == width:
+                plan[-1] = last._replace(count=last.count + 1)
+                continue
+            elif not swap:
+                plan[-1] = last._replace(width=last.width + width)
+                continue
+        plan.append(Step(offset, target_offset, width, 1, swap))
+    return plan
@@ -9,7 +9,7 @@ setup(name='serdepa',
       author_email='github@thinnect.com',
       license='MIT',
       packages=['serdepa'],
-      install_requires=['six'],
+      install_requires=['futures; python_version < "3"'],
       test_suite='nose.collector',
       tests_require=['nose'],
       zip_safe=False)